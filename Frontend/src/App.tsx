@@ -8,7 +8,11 @@ import { searchResults as searchApi, SearchResult } from './services/api';
 export default function App() {
   const [query, setQuery] = useState("");
   const [results, setResults] = useState<SearchResult[]>([]);
+  const [nextCursor, setNextCursor] = useState<string | null>(null);
+  const [searchedQuery, setSearchedQuery] = useState("");
+  const [correctedQuery, setCorrectedQuery] = useState<string | null>(null);
   const [loading, setLoading] = useState(false);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState<string | null>(null);
 
   const handleSearch = async (e: React.FormEvent) => {
@@ -19,16 +23,39 @@ export default function App() {
     setError(null);
 
     try {
-      const data = await searchApi(query);
-      setResults(data);
+      const page = await searchApi(query);
+      setResults(page.results);
+      setNextCursor(page.next_cursor);
+      setSearchedQuery(query);
+      setCorrectedQuery(page.corrected_query);
     } catch (err) {
       setError('Failed to fetch search results. Please try again.');
       setResults([]);
+      setNextCursor(null);
+      setCorrectedQuery(null);
     } finally {
       setLoading(false);
     }
   };
 
+  const handleLoadMore = async () => {
+    if (!nextCursor) return;
+
+    setLoadingMore(true);
+
+    try {
+      const page = await searchApi(searchedQuery, nextCursor);
+      setResults((previous) => [...previous, ...page.results]);
+      setNextCursor(page.next_cursor);
+    } catch (err) {
+      // an expired cursor (the index changed) means the query has to run again
+      setError('Failed to fetch more results. Please search again.');
+      setNextCursor(null);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   return (
     <div className="min-h-screen bg-gray-50">
       <div className="container mx-auto px-4 py-8">
@@ -49,11 +76,19 @@ export default function App() {
         </header>
         
         <main className="max-w-3xl mx-auto">
+          {correctedQuery && !loading && !error && (
+            <p className="mb-4 text-gray-600">
+              Showing results for <span className="font-semibold italic">{correctedQuery}</span>
+            </p>
+          )}
           <SearchResults
             results={results}
             loading={loading}
             error={error}
             query={query}
+            hasMore={nextCursor !== null}
+            loadingMore={loadingMore}
+            onLoadMore={handleLoadMore}
           />
         </main>
       </div>
@@ -1,6 +1,17 @@
 import React, { useRef, useState } from 'react';
 import { Upload } from 'lucide-react';
-import { uploadDocument } from '../services/api';
+import { getUploadJob, uploadDocument, UploadJob } from '../services/api';
+
+// Polls the indexing job of an upload until it is done or failed
+async function waitForJob(jobId: string): Promise<UploadJob> {
+  for (;;) {
+    const job = await getUploadJob(jobId);
+    if (job.phase === 'done' || job.phase === 'failed') {
+      return job;
+    }
+    await new Promise((resolve) => setTimeout(resolve, 1000));
+  }
+}
 
 export function FileUpload() {
   const fileInputRef = useRef<HTMLInputElement>(null);
@@ -24,7 +35,16 @@ export function FileUpload() {
       const formData = new FormData();
       formData.append('file', file);
       const response = await uploadDocument(formData);
-      alert(response.message || 'Document uploaded successfully!');
+      if (!response.job_id) {
+        alert(response.message || 'Document uploaded successfully!');
+        return;
+      }
+      const job = await waitForJob(response.job_id);
+      if (job.phase === 'failed') {
+        alert(`Indexing ${job.filename} failed: ${job.error}`);
+      } else {
+        alert(`Indexed ${job.documents_processed} documents from ${job.filename}`);
+      }
     } catch (error) {
       if (error instanceof Error) {
         alert(error.message);
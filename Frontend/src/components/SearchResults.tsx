@@ -10,24 +10,40 @@ interface SearchResultsProps {
   loading: boolean;
   error: string | null;
   query: string;
+  hasMore: boolean;
+  loadingMore: boolean;
+  onLoadMore: () => void;
 }
 
-export function SearchResults({ results, loading, error, query }: SearchResultsProps) {
+export function SearchResults({ results, loading, error, query, hasMore, loadingMore, onLoadMore }: SearchResultsProps) {
   if (loading) return <LoadingSpinner />;
   if (error) return <ErrorMessage message={error} />;
   
   return (
     <div className="space-y-4">
       {results.length > 0 ? (
-        results.map((result) => (
-          <SearchResultComponent
-            key={result.id}
-            title={result.title}
-            url={result.url}
-            description={result.description}
-            tags={result.tags}
-          />
-        ))
+        <>
+          {results.map((result) => (
+            <SearchResultComponent
+              key={result.id}
+              title={result.title}
+              url={result.url}
+              description={result.description}
+              tags={result.tags}
+            />
+          ))}
+          {hasMore && (
+            <div className="flex justify-center">
+              <button
+                onClick={onLoadMore}
+                disabled={loadingMore}
+                className="px-4 py-2 text-blue-600 border border-blue-600 rounded-lg hover:bg-blue-50 disabled:opacity-50"
+              >
+                {loadingMore ? 'Loading...' : 'More results'}
+              </button>
+            </div>
+          )}
+        </>
       ) : (
         <NoResults query={query} />
       )}
@@ -8,12 +8,33 @@ export interface SearchResult {
   tags: string[];
 }
 
+export interface SearchPage {
+  results: SearchResult[];
+  next_cursor: string | null;
+  // the query that was ranked if the spelling of some of its words was corrected
+  corrected_query: string | null;
+}
+
+// Results per page, the backend ranks only as deep as the pages asked for
+export const PAGE_SIZE = 10;
+
 interface UploadResponse {
   message: string;
+  job_id?: string;
+}
+
+export interface UploadJob {
+  job_id: string;
+  filename: string;
+  phase: string;
+  documents_total: number | null;
+  documents_processed: number;
+  doc_id_range: [number, number] | null;
+  error: string | null;
 }
 
-// Function to search for results based on a query
-export async function searchResults(query: string): Promise<SearchResult[]> {
+// Function to search for one page of results based on a query, pass the cursor of the previous page for the next one
+export async function searchResults(query: string, cursor: string | null = null): Promise<SearchPage> {
   try {
     query = query.toLowerCase();
     const response = await fetch(`${API_BASE_URL}/query`, {
@@ -21,7 +42,7 @@ export async function searchResults(query: string): Promise<SearchResult[]> {
       headers: {
         'Content-Type': 'application/json',
       },
-      body: JSON.stringify({ query }),
+      body: JSON.stringify(cursor ? { query, cursor, limit: PAGE_SIZE } : { query, limit: PAGE_SIZE }),
     });
     if (!response.ok) {
       throw new Error('Search request failed');
@@ -53,3 +74,12 @@ export async function uploadDocument(formData: FormData): Promise<UploadResponse
     throw error;
   }
 }
+
+// Function to check how far the indexing of an upload has come
+export async function getUploadJob(jobId: string): Promise<UploadJob> {
+  const response = await fetch(`${API_BASE_URL}/jobs/${jobId}`);
+  if (!response.ok) {
+    throw new Error('Could not get the upload status');
+  }
+  return (await response.json()) as UploadJob;
+}
@@ -1,29 +1,36 @@
 import csv
 import os
-import re
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
 import pathlib
+import sys
+import time
 
 base_dir = pathlib.Path(__file__).parent.parent
-newdata = base_dir / 'engine_data' / 'newdata.csv'
+sys.path.append(str(base_dir / 'src'))
+from segments import list_segments, segment_stats_path, write_segment
+from analyzer import get_analyzer
+from compact_lexicon import LEXICON_FILE, CompactLexicon
+from forward_index import word_positions
+from metrics import INGEST_DOCUMENTS, INGEST_STAGE_SECONDS, count, record, span
+from term_stats import STATS_FILE, TermStats, load_stats
 class ADDFile:
     csv.field_size_limit(10**7)
-    def __init__(self, lexicon_file, barrel_directory, doc_id_file, num_barrels=50):
+    def __init__(self, lexicon_file, barrel_directory, doc_id_file, num_barrels=50, segment_directory=None):
         self.lexicon_file = lexicon_file
         self.barrel_directory = barrel_directory
+        self.segment_directory = segment_directory or os.path.join(os.path.dirname(barrel_directory), 'segments')
         self.doc_id_file = doc_id_file
         self.num_barrels = num_barrels
         self.lexicon = self._load_lexicon()
-        self.stop_words = set(stopwords.words('english'))
-        self.lemmatizer = WordNetLemmatizer()
+        self.analyzer = get_analyzer()
 
         # Ensure barrel directory exists
         if not os.path.exists(self.barrel_directory):
             os.makedirs(self.barrel_directory)
-#loading the lexicon from the lexicon file
+#loading the lexicon from the lexicon file, or mapping the compact one written by the build
     def _load_lexicon(self):
+        compact_file = pathlib.Path(self.lexicon_file).with_name(LEXICON_FILE)
+        if compact_file.exists():
+            return CompactLexicon.open(compact_file)
         lexicon = {}
         with open(self.lexicon_file, 'r', encoding='utf-8') as f:
             next(f)  # Skip header row
@@ -31,107 +38,146 @@ class ADDFile:
                 word, word_id, lemma_id = line.strip().split(',')
                 lexicon[word] = (int(word_id), int(lemma_id))
         return lexicon
+#unmapping the compact lexicon, the ingest opens a new ADDFile on every staged snapshot
+    def close(self):
+        if isinstance(self.lexicon, CompactLexicon):
+            self.lexicon.close()
+        self.lexicon = None
 #getting the document it from text file and incrementing it
-    def _get_next_doc_id(self):
+    def _get_next_doc_id(self, count=1):
         """
-        Read and increment the document ID from the doc_id file.
+        Reserve count consecutive document IDs in the doc_id file and return the first one.
         """
-        if not os.path.exists(self.doc_id_file):
-            with open(self.doc_id_file, 'w') as f:
-                f.write('1')  # Initialize with the first doc_id
-
-        with open(self.doc_id_file, 'r+') as f:
-            current_id = int(f.read().strip())
-            new_id = current_id + 1
-            f.seek(0)
-            f.write(str(new_id))
-            f.truncate()
-        return new_id
+        current_id = 1  # Initialize with the first doc_id
+        if os.path.exists(self.doc_id_file):
+            with open(self.doc_id_file, 'r') as f:
+                current_id = int(f.read().strip())
+
+        # Written under a new name and moved over the old file: snapshots share it through hard links
+        tmp_file = f"{self.doc_id_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            f.write(str(current_id + count))
+        os.replace(tmp_file, self.doc_id_file)
+        return current_id + 1
     #cleaning the text of the new document and tokenizing it
 
     def _clean_and_tokenize(self, text):
         """
         Tokenizes and lemmatizes the input text while removing stopwords.
         """
-        text = re.sub(r'http[s]?://\S+|[^a-zA-Z0-9\s]+|\s+', ' ', text).strip()
-        tokens = word_tokenize(text.lower())
-
-        tokens = [
-            (word, self.lemmatizer.lemmatize(word))
-            for word in tokens
-            if word not in self.stop_words and word.isalpha()
-        ]
-        return tokens
-#updating the barrel with the new document by the word id 
-    def _update_barrel(self, word_id, doc_bitarray_entry):
+        return self.analyzer.tokenize(text)
+#updating the inverted index with the new documents
+    @staticmethod
+    def read_rows(new_file):
         """
-        Update the specific barrel for the given word ID.
+        Read the document rows (title, text, url, ..., tags) of an uploaded CSV file.
         """
-        barrel_index = word_id % self.num_barrels
-        barrel_file = os.path.join(self.barrel_directory, f'barrel_{barrel_index}.csv')
-
-        updated = False
-        barrel_data = []
-
-        if os.path.exists(barrel_file):
-            with open(barrel_file, 'r', encoding='utf-8') as f:
-                reader = csv.reader(f)
-                next(reader)  # Skip header row
-                for row in reader:
-                    current_word_id = int(row[0])
-                    doc_info = row[1]
-                    if current_word_id == word_id:
-                        doc_info += f" {doc_bitarray_entry}"
-                        updated = True
-                    barrel_data.append((current_word_id, doc_info))
-
-        if not updated:
-            barrel_data.append((word_id, doc_bitarray_entry))
-
-        with open(barrel_file, 'w', encoding='utf-8', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(['word_id', 'doc_info'])
-            writer.writerows(barrel_data)
-#updating the inverted index with the new document
+        with open(new_file, 'r', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)  # Skip header row
+            return [row for row in reader if len(row) >= 3]
+
     def update_index(self, new_file):
         """
-        Update the inverted index using the data from the new file.
+        Index every row of the new file into an in-memory delta and flush it as one immutable
+        segment, so the cost depends on the size of the upload and not on the size of the barrels.
         """
-        doc_id = self._get_next_doc_id()
+        rows = self.read_rows(new_file)
+        if not rows:
+            print(f"No documents found in {new_file}.")
+            return []
+        return self.update_index_batch([rows])[0]
 
-        with open(new_file, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            next(reader)  # Skip header row
-            for row in reader:
-                title = row[0]
-                url = row[2]
-                text = row[1]
-                tags = row[5] if len(row) > 5 else ""
-                with open(newdata, 'a', encoding='utf-8', newline='') as h:
-                    writer = csv.writer(h)
-                    writer.writerow([doc_id, title, url, tags])
-
-                tokens = self._clean_and_tokenize(title + ' ' + text + ' ' + tags)
-                words_in_title = set(title.lower().split())
-                words_in_tags = set(tags.lower().split())
-
-                word_frequency = {}
-                for word, lemma in tokens:
-                    if word in self.lexicon:
-                        word_id, lemma_id = self.lexicon[word]
-                        title_presence = 1 if word in words_in_title else 0
-                        tag_presence = 1 if word in words_in_tags else 0
-                        bitarray = (title_presence << 9) | (tag_presence << 8) | min(word_frequency.get(word, 0), 255)
-
-                        if word in word_frequency:
-                            word_frequency[word] += 1
-                        else:
-                            word_frequency[word] = 1
-
-                        doc_bitarray_entry = f"{doc_id}:{bitarray}"
-                        self._update_barrel(lemma_id, doc_bitarray_entry)
-
-        print(f"Inverted index updated successfully for document ID {doc_id}.")
+    def update_index_batch(self, row_lists, progress=None, chunk_size=500):
+        """
+        Index the rows of several uploads together as one segment. Returns the doc IDs given to
+        each list of rows. progress(phase, documents_done) is called as the work advances.
+        """
+        rows = [row for row_list in row_lists for row in row_list]
+        doc_id_lists = []
+        if not rows:
+            return [[] for _ in row_lists]
+        first_doc_id = self._get_next_doc_id(len(rows))
+        doc_ids = list(range(first_doc_id, first_doc_id + len(rows)))
+        start = 0
+        for row_list in row_lists:
+            doc_id_lists.append(doc_ids[start:start + len(row_list)])
+            start += len(row_list)
+        delta = {}  # lemma_id -> [(doc_id, bit_array), ...]
+        stats = TermStats()
+        # word positions only if the index keeps them, lemma_id -> [(doc_id, positions), ...]
+        positions = {} if (pathlib.Path(self.barrel_directory).parent / 'positions').is_dir() else None
+
+        # The titles, urls and tags go into the segment too, compaction moves them into the index
+        documents = [(doc_id, row[0], row[2], row[5] if len(row) > 5 else "") for doc_id, row in zip(doc_ids, rows)]
+
+        texts = [row[0] + ' ' + row[1] + ' ' + (row[5] if len(row) > 5 else "") for row in rows]
+        tokenize_seconds = [0.0]
+        started = time.perf_counter()
+        for doc_id, row, tokens in zip(doc_ids, rows, self._tokenized(texts, progress, chunk_size, tokenize_seconds)):
+            title = row[0]
+            tags = row[5] if len(row) > 5 else ""
+            words_in_title = set(title.lower().split())
+            words_in_tags = set(tags.lower().split())
+
+            word_frequency = {}
+            for word, lemma in tokens:
+                word_frequency[word] = word_frequency.get(word, 0) + 1
+
+            doc_postings = []
+            for word, frequency in word_frequency.items():
+                entry = self.lexicon.get(word)
+                if entry is None:
+                    continue
+                word_id, lemma_id = entry
+                title_presence = 1 if word in words_in_title else 0
+                tag_presence = 1 if word in words_in_tags else 0
+                bitarray = (title_presence << 9) | (tag_presence << 8) | min(frequency, 255)
+                delta.setdefault(lemma_id, []).append((doc_id, bitarray))
+                doc_postings.append((lemma_id, bitarray))
+            stats.add_document(doc_id, doc_postings)
+            if positions is not None:
+                for word, offsets in word_positions(title, row[1], self.lexicon).items():
+                    positions.setdefault(self.lexicon.get(word)[1], []).append((doc_id, offsets))
+        record(INGEST_STAGE_SECONDS, 'tokenize', tokenize_seconds[0])
+        record(INGEST_STAGE_SECONDS, 'index', time.perf_counter() - started - tokenize_seconds[0])
+
+        if progress is not None:
+            progress('writing', len(rows))
+        with span('impacts', INGEST_STAGE_SECONDS):
+            impacts = self._impacts(delta, stats)
+        with span('write', INGEST_STAGE_SECONDS):
+            segment = write_segment(self.segment_directory, delta, stats, impacts, documents, positions)
+        count(INGEST_DOCUMENTS, len(rows))
+        print(f"Inverted index updated successfully for document IDs {doc_ids[0]}-{doc_ids[-1]} in {segment}.")
+        return doc_id_lists
+
+    def _tokenized(self, texts, progress, chunk_size, seconds):
+        # seconds[0] adds up the time spent in the analyzer, apart from building the postings
+        for start in range(0, len(texts), chunk_size):
+            if progress is not None:
+                progress('tokenizing', start)
+            started = time.perf_counter()
+            tokens = self.analyzer.tokenize_many(texts[start:start + chunk_size])
+            seconds[0] += time.perf_counter() - started
+            yield from tokens
+
+
+    def _impacts(self, delta, stats):
+        """
+        BM25 impacts of the new postings if the index has impact barrels, scored with the statistics
+        of the index, its segments and this upload together. Returns None otherwise.
+        """
+        index_dir = pathlib.Path(self.barrel_directory).parent
+        segments = list_segments(self.segment_directory)
+        # the lengths of the indexed documents are not needed, the average length is total_length / num_docs
+        # and the new documents bring their own lengths in stats
+        index_stats = load_stats([index_dir / STATS_FILE] + [segment_stats_path(segment) for segment in segments], doc_lengths=False)
+        if index_stats is None or not index_stats.impact_scale:
+            return None
+        stats.impact_scale = index_stats.impact_scale
+        index_stats.merge(stats)
+        return {lemma_id: index_stats.impact_postings(lemma_id, postings) for lemma_id, postings in delta.items()}
 
 
 # temporary example usage of the ADDFile class
@@ -143,3 +189,4 @@ if __name__ == "__main__":
 
     index_manager = ADDFile(lexicon_file, barrel_directory, doc_id_file)
     index_manager.update_index(new_file)
+    index_manager.close()
@@ -1,104 +1,348 @@
-from flask import Flask, request, jsonify
-import subprocess
+import time
+
+# process start, before the imports, for the time it takes to become ready
+STARTED_AT = time.perf_counter()
+
+from flask import Flask, Response, request, jsonify
+from werkzeug.utils import secure_filename
 import json
 from flask_cors import CORS
 import traceback
 import os
-from ADDFile import ADDFile
+import sys
+import threading
 import pathlib
+import uuid
 
 app = Flask(__name__)
 
 # Automatically determine the base directory
 base_dir = pathlib.Path(__file__).parent.parent
+sys.path.append(str(base_dir / 'src'))
+
+from bundle import MANIFEST_FILE, verify_bundle
+from cursor_cache import CursorCache, RankedQuery, format_cursor, parse_cursor
+from engine_manager import EngineManager
+from ingest_queue import IngestQueue
+from result_cache import ResultCache
+from query_engine import open_engine
+from analyzer import get_analyzer
+from metrics import INGEST_STAGE_SECONDS, QUERY_SECONDS, REGISTRY, SLOW_QUERIES, end_trace, span, start_trace
+from segments import compact, needs_compaction
+from snapshot import SnapshotStore
 
-lexicon_file = base_dir / 'engine_data' / 'lexicon.csv'
-barrels_dir = base_dir / 'engine_data' / 'barrels'
-doc_id_file = base_dir / 'engine_data' / 'doc_id.txt'
+# engine_data holds the index snapshots, the one being served is named in engine_data/CURRENT
+index_root = pathlib.Path(os.environ.get('INDEX_ROOT', base_dir / 'engine_data'))
+snapshots = SnapshotStore(index_root)
 
 # Enable CORS for my frontend app running on port 5173
 CORS(app, origins="http://localhost:5173")
 
-# path to the compiled C++ executable
-CPP_EXECUTABLE = base_dir / 'backend' / 'ProcessQuery.exe'
-
 # directory for the uploaded files to be stored
 UPLOAD_FOLDER = "uploads"
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+# queries slower than this print their stage timings and counters
+app.config['SLOW_QUERY_SECONDS'] = float(os.environ.get('SLOW_QUERY_MS', 500)) / 1000
 
-# start the cpp process on start of server 
-cpp_process = None
-#function to start the cpp process
-def start_cpp_process():
-    """Start the C++ program as a persistent process."""
-    global cpp_process
-    cpp_process = subprocess.Popen(
-        [CPP_EXECUTABLE],
-        stdin=subprocess.PIPE,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        text=True,
-        encoding='utf-8'
-    )
-#function to handle the query within the cpp process
-def handle_cpp_query(query):
-    """Send the query to the running C++ process and get the result."""
-    if cpp_process:
-        # Send the query to C++ program via stdin
-        cpp_process.stdin.write(query + '\n')
-        cpp_process.stdin.flush()
-
-        # Read the response from the C++ program
-        result = cpp_process.stdout.readline()
-        return result
-    else:
-        raise Exception("C++ process is not running")
+# boost for documents with the query words close together, needs an index built with --positions
+PROXIMITY_WEIGHT = float(os.environ.get('PROXIMITY_WEIGHT', 0))
+
+# queries answered by one /query/batch request at most
+MAX_BATCH_QUERIES = 1000
+
+# snapshots built as a bundle are checked against their manifest before they are served: file sizes
+# always, checksums too with VERIFY_INDEX=1 (reads every file once, so it slows down startup)
+VERIFY_CHECKSUMS = os.environ.get('VERIFY_INDEX', '0') == '1'
+
+# results of repeated queries, dropped whenever a new snapshot is swapped in
+result_cache = ResultCache(max_entries=1024, max_bytes=64 * 1024 * 1024)
+
+# paged queries: the first page is ranked only as deep as it goes, later pages are cut from the
+# ranking kept under their cursor, which is ranked PAGE_GROWTH times deeper when it runs out
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+MAX_RESULT_DEPTH = 1000
+PAGE_GROWTH = 4
+cursor_cache = CursorCache(max_entries=256, ttl=float(os.environ.get('CURSOR_TTL_SECONDS', 300)))
+
+# seconds from process start until the first snapshot was served, None while starting
+ready_seconds = None
+#function to open the query engine of a snapshot
+def load_engine(snapshot_dir):
+    """Open the engine of a snapshot, refusing a bundle whose files do not match its manifest."""
+    problems = verify_bundle(snapshot_dir, checksums=VERIFY_CHECKSUMS)
+    if problems:
+        raise ValueError(f"Index bundle {snapshot_dir} is damaged: {'; '.join(problems[:5])}")
+    return open_engine(snapshot_dir, analyzer=get_analyzer(), proximity_weight=PROXIMITY_WEIGHT)
+#function called whenever a new snapshot is being served
+def snapshot_swapped(version):
+    """Drop the cached results of the old snapshot and note when the server first became ready."""
+    global ready_seconds
+    result_cache.bump_generation()
+    cursor_cache.bump_generation()
+    if ready_seconds is None:
+        ready_seconds = time.perf_counter() - STARTED_AT
+        print(f"Ready to serve queries {ready_seconds:.2f}s after start")
+
+# query engines of the snapshots, shared by all request threads
+engines = EngineManager(
+    snapshots,
+    load_engine,
+    warm_queries=lambda: list(dict.fromkeys(result_cache.recent_queries(20) + cursor_cache.recent_queries(20))),  # the popular queries are warm before the swap
+    on_swap=snapshot_swapped,
+)
+
+REGISTRY.gauge('result_cache_entries', "Query results held by the result cache", lambda: result_cache.stats()["entries"])
+REGISTRY.gauge('result_cache_bytes', "Approximate size of the cached query results", lambda: result_cache.stats()["bytes"])
+REGISTRY.gauge('result_cache_hit_rate', "Share of queries answered from the result cache", lambda: result_cache.stats()["hit_rate"])
+REGISTRY.gauge('cursor_cache_entries', "Rankings of paged queries held for their cursors", lambda: cursor_cache.stats()["entries"])
+REGISTRY.gauge('snapshot_version', "Version of the index snapshot being served", lambda: int(engines.version) if engines.version else None)
+REGISTRY.gauge('startup_seconds', "Seconds from process start until the first snapshot was served", lambda: ready_seconds)
+#function to start serving the current snapshot
+def start_query_engine():
+    """Publish the index built in engine_data as the first snapshot if needed, then serve the current one."""
+    if snapshots.current() is None and ((index_root / MANIFEST_FILE).exists() or (index_root / 'lexicon.csv').exists()):
+        snapshots.import_index(index_root)
+    engines.start()
+
+# snapshots are staged and published one at a time, compaction runs in the background and never twice at once
+publish_lock = threading.Lock()
+compaction_lock = threading.Lock()
+#function to fold the upload segments back into the barrels
+def compact_segments():
+    """Compact the segments into the barrels once they hit the size or count limits."""
+    if not compaction_lock.acquire(blocking=False):
+        return
+    try:
+        with publish_lock:
+            base_version = snapshots.current()
+            if base_version is None or not needs_compaction(snapshots.path(base_version) / 'segments'):
+                return
+            staging = snapshots.begin()
+        # uploads keep publishing while this runs, their segments are carried over before the switch
+        try:
+            compacted = compact(staging / 'barrels', staging / 'segments', force=True)
+            with publish_lock:
+                snapshots.rebase(staging, base_version)
+                version = snapshots.publish(staging)
+        except BaseException:
+            snapshots.abort(staging)
+            raise
+        print(f"Compacted {compacted} segments into the barrels of snapshot {version}")
+        engines.refresh()
+    except Exception as e:
+        print("Compaction error:", e)
+    finally:
+        compaction_lock.release()
 #route to handle the query from the frontend
 @app.route('/query', methods=['POST'])
 def query():
     data = request.json
-    if not data or 'query' not in data:
+    if not data or ('query' not in data and 'cursor' not in data):
         return jsonify({"status": "error", "message": "No query provided"}), 400
 
-    query = data['query']
+    # with a limit or a cursor the answer is one page and the cursor of the next
+    paged = 'limit' in data or 'cursor' in data
+    query = data.get('query', '')
+    start_trace(query)
+    status = 'error'
 
     try:
-        # Handle the query by passing it to the already running C++ process
         print(query)
-        result = handle_cpp_query(query)
-        
-        if result:
-            # Parse JSON output from C++ program
-            try:
-                cpp_output = json.loads(result)
-            except json.JSONDecodeError as e:
-                return jsonify({"status": "error", "message": "Invalid JSON from C++ program", "stderr": result.strip()}), 500
-
-            # Extract and process the 'results' field
-            if 'results' not in cpp_output or not isinstance(cpp_output['results'], list):
-                return jsonify({"status": "error", "message": "Unexpected format in C++ program output"}), 500
-
-            search_results = [
-                {
-                    "id": item.get("doc_id"),
-                    "title": item.get("title"),
-                    "url": item.get("url"),
-                    "description": item.get("description", ""),
-                    "tags": parse_tags(item.get("tags", '[]'))  # Use the parsing function
-                }
-                for item in cpp_output['results']
-            ]
-            return jsonify(search_results)
-        else:
-            return jsonify({"status": "error", "message": "No response from C++ program"}), 500
+        if paged:
+            response, status = query_page(query, data.get('limit'), data.get('cursor'))
+            return response
+        with span('cache'):
+            cached = result_cache.get(query)
+        if cached is not None:
+            status = 'cached'
+            with span('serialize'):
+                return results_response(cached)
+        # read the generation before the engine: a new snapshot is swapped in first and then bumps it
+        generation = result_cache.generation
+        # one engine for the whole request, it is not closed before the request is done even if a new snapshot is swapped in
+        with engines.engine() as current_engine:
+            if current_engine is None:
+                status = 'unavailable'
+                return jsonify({"status": "error", "message": "Query engine is not running"}), 503
+            output = current_engine.search(query)
+        if output['status'] != 'success':
+            status = 'no_match'
+            return jsonify({"status": "error", "message": output['message']}), 400
+
+        with span('serialize'):
+            answer = {"results": serialize_results(output['results']), "corrected_query": output.get('corrected_query')}
+            response = results_response(answer)
+        result_cache.put(query, answer, generation)
+        status = 'success'
+        return response
 
     except Exception as e:
         # Log the full traceback of the error
         print("Error occurred:", e)
         print("Traceback:", traceback.format_exc())
         return jsonify({"status": "error", "message": str(e)}), 500
+    finally:
+        finish_query(status)
+#function to answer one page of a query
+def query_page(query, limit, cursor):
+    """Serve a page from the ranking behind the cursor, ranking deeper only when it runs out. Returns the response and the status to record."""
+    try:
+        limit = min(max(int(limit if limit is not None else DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        return (jsonify({"status": "error", "message": "limit must be a number"}), 400), 'error'
+    entry, entry_id, offset = None, None, 0
+    if cursor is not None:
+        position = parse_cursor(cursor)
+        if position is not None:
+            entry_id, offset = position
+            with span('cache'):
+                entry = cursor_cache.get(entry_id)
+        if entry is None:
+            # the index changed, the cursor expired or it is not one of ours
+            return (jsonify({"status": "error", "message": "Cursor expired, run the query again"}), 410), 'expired'
+    else:
+        # a query asked for again starts from the ranking kept for it, deepened below if the page needs more
+        with span('cache'):
+            entry_id, entry = cursor_cache.find(query)
+    end = min(offset + limit, MAX_RESULT_DEPTH)
+    status = 'cached'
+
+    # read the generation before the engine, as for the result cache
+    generation = cursor_cache.generation
+    with engines.engine() as current_engine:
+        if current_engine is None:
+            return (jsonify({"status": "error", "message": "Query engine is not running"}), 503), 'unavailable'
+        if entry is None:
+            output, ranked = current_engine.rank_query(query, end)
+            if ranked is None and output['status'] != 'success':
+                return (jsonify({"status": "error", "message": output['message']}), 400), 'no_match'
+            entry = RankedQuery(query, ranked or [], end, generation, output.get('corrected_query'))
+            entry_id = cursor_cache.add(entry)
+            status = 'success'
+        elif len(entry.ranked) < end and not entry.complete:
+            # a snapshot swapped in since the cursor was looked up must not extend it with its results
+            if entry.generation != generation or generation != cursor_cache.generation:
+                return (jsonify({"status": "error", "message": "Cursor expired, run the query again"}), 410), 'expired'
+            depth = min(max(end, entry.depth * PAGE_GROWTH), MAX_RESULT_DEPTH)
+            _, ranked = current_engine.rank_query(entry.query, depth)
+            entry.extend(ranked or [], depth)
+            status = 'success'
+        results = current_engine.describe(entry.ranked[offset:end])
+
+    more = end < len(entry.ranked) or (not entry.complete and end < MAX_RESULT_DEPTH)
+    with span('serialize'):
+        response = jsonify({
+            "results": serialize_results(results),
+            "next_cursor": format_cursor(entry_id, end) if more else None,
+            "corrected_query": entry.corrected_query,
+        })
+    return response, status
+#route for offline jobs to send many queries in one request
+@app.route('/query/batch', methods=['POST'])
+def query_batch():
+    data = request.json
+    if not data or not isinstance(data.get('queries'), list) or not all(isinstance(query, str) for query in data['queries']):
+        return jsonify({"status": "error", "message": "No list of queries provided"}), 400
+    queries = data['queries']
+    if len(queries) > MAX_BATCH_QUERIES:
+        return jsonify({"status": "error", "message": f"At most {MAX_BATCH_QUERIES} queries per batch"}), 400
+
+    # the whole batch is one trace, observed under its own status so it stays apart from single queries
+    start_trace(f"batch of {len(queries)} queries")
+    status = 'error'
+
+    try:
+        answers = [None] * len(queries)
+        missing = []
+        with span('cache'):
+            for i, query in enumerate(queries):
+                cached = result_cache.get(query)
+                if cached is not None:
+                    answers[i] = dict(cached, query=query, status="success")
+                else:
+                    missing.append(i)
+        generation = result_cache.generation
+        if missing:
+            # the queries missing from the cache are ranked together, sharing the postings of their words
+            with engines.engine() as current_engine:
+                if current_engine is None:
+                    status = 'unavailable'
+                    return jsonify({"status": "error", "message": "Query engine is not running"}), 503
+                outputs = current_engine.search_batch([queries[i] for i in missing])
+            with span('serialize'):
+                for i, output in zip(missing, outputs):
+                    if output['status'] != 'success':
+                        answers[i] = {"query": queries[i], "status": "error", "message": output['message']}
+                        continue
+                    answer = {"results": serialize_results(output['results']), "corrected_query": output.get('corrected_query')}
+                    result_cache.put(queries[i], answer, generation)
+                    answers[i] = dict(answer, query=queries[i], status="success")
+        with span('serialize'):
+            response = jsonify(answers)
+        status = 'batch'
+        return response
+
+    except Exception as e:
+        print("Error occurred:", e)
+        print("Traceback:", traceback.format_exc())
+        return jsonify({"status": "error", "message": str(e)}), 500
+    finally:
+        finish_query(status)
+#function to answer /query with the results of a query
+def results_response(answer):
+    """The result list of an answer, naming the query that was ranked in a header if its spelling was corrected."""
+    response = jsonify(answer["results"])
+    if answer["corrected_query"] is not None:
+        response.headers['X-Corrected-Query'] = answer["corrected_query"]
+    return response
+#function to turn engine results into the objects the frontend expects
+def serialize_results(results):
+    return [
+        {
+            "id": item.get("doc_id"),
+            "title": item.get("title"),
+            "url": item.get("url"),
+            "description": item.get("description", ""),
+            "tags": parse_tags(item.get("tags", '[]'))  # Use the parsing function
+        }
+        for item in results
+    ]
+#function to record the latency of a query and log it if it was slow
+def finish_query(status):
+    """Observe the total time of the request's query and print its trace if it took too long."""
+    trace = end_trace()
+    seconds = trace.elapsed
+    QUERY_SECONDS.observe(seconds, status)
+    if seconds >= app.config['SLOW_QUERY_SECONDS']:
+        SLOW_QUERIES.inc()
+        print("Slow query:", json.dumps(dict(trace.to_dict(), status=status)))
+#route for load balancers and orchestrators to know when the server can take queries
+@app.route('/ready', methods=['GET'])
+def ready():
+    if engines.version is None or ready_seconds is None:
+        return jsonify({"status": "starting", "uptime_seconds": round(time.perf_counter() - STARTED_AT, 3)}), 503
+    return jsonify({"status": "ready", "snapshot": engines.version, "startup_seconds": round(ready_seconds, 3)})
+#route for Prometheus to scrape the latency histograms and counters
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+#route to size the result cache
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(dict(result_cache.stats(), cursors=cursor_cache.stats()))
+#route for search box autocompletion
+@app.route('/suggest', methods=['GET'])
+def suggest():
+    prefix = request.args.get('prefix', '')
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    with engines.engine() as current_engine:
+        if current_engine is None:
+            return jsonify({"status": "error", "message": "Query engine is not running"}), 503
+        suggestions = current_engine.suggest(prefix, limit)
+    return jsonify([{"word": word, "frequency": frequency} for word, frequency in suggestions])
 #function to parse the tags field 
 def parse_tags(raw_tags):
     """Parse the tags field safely."""
@@ -107,7 +351,66 @@ def parse_tags(raw_tags):
         return json.loads(cleaned_tags)
     except json.JSONDecodeError:
         return []
-#function to upload the file and update the inverted index
+#function the ingestion worker runs on every batch of queued uploads
+def ingest_uploads(jobs):
+    """Index a batch of uploaded files as one segment and publish it as one snapshot."""
+    from ADDFile import ADDFile  # imported on the first upload, the query path does not need it
+    readable, row_lists = [], []
+    for job in jobs:
+        job.set_phase('reading')
+        try:
+            with span('read', INGEST_STAGE_SECONDS):
+                rows = ADDFile.read_rows(job.path)
+        except Exception as e:
+            job.fail(f"Could not read {job.filename}: {e}")
+            continue
+        job.progress(0, len(rows))
+        readable.append(job)
+        row_lists.append(rows)
+    if not any(row_lists):
+        for job in readable:
+            job.fail("No documents found in the file")
+        return
+
+    def report(phase, processed):
+        # documents are processed in job order, spread the batch count over the jobs
+        start = 0
+        for job, rows in zip(readable, row_lists):
+            job.set_phase(phase)
+            job.progress(min(max(processed - start, 0), len(rows)))
+            start += len(rows)
+
+    with publish_lock:
+        with span('stage', INGEST_STAGE_SECONDS):
+            staging = snapshots.begin()#copy of the current snapshot, the served one is never modified
+        try:
+            index_manager = ADDFile(staging / 'lexicon.csv', staging / 'barrels', staging / 'doc_id.txt', segment_directory=staging / 'segments')#calling the ADDFile class functions
+            try:
+                doc_id_lists = index_manager.update_index_batch(row_lists, report) #for updating the inverted index as a new segment
+            finally:
+                index_manager.close()
+            report('publishing', sum(len(rows) for rows in row_lists))
+            with span('publish', INGEST_STAGE_SECONDS):
+                version = snapshots.publish(staging)
+        except BaseException:
+            snapshots.abort(staging)
+            raise
+    for job, doc_ids in zip(readable, doc_id_lists):
+        job.doc_ids = doc_ids
+        job.snapshot = version
+        job.set_phase('warming')
+    # the documents are published, a snapshot that fails to load is retried by the watcher and does not fail the jobs
+    try:
+        with span('warm', INGEST_STAGE_SECONDS):
+            engines.refresh()#warm up the new snapshot and switch to it, in-flight queries finish on the old one
+    except Exception as e:
+        print("Snapshot refresh error:", e)
+    threading.Thread(target=compact_segments, daemon=True).start()
+
+# uploads are indexed in the background, in batches
+ingest_queue = IngestQueue(ingest_uploads)
+REGISTRY.gauge('ingest_queue_depth', "Uploads waiting to be indexed", lambda: len(ingest_queue.pending))
+#route to upload a file, which is queued for indexing
 @app.route('/upload', methods=['POST'])
 def upload():
     if 'file' not in request.files:
@@ -118,17 +421,28 @@ def upload():
         return jsonify({"status": "error", "message": "No file selected for uploading"}), 400
 
     try:
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
+        filename = secure_filename(file.filename) or 'upload.csv'
+        filepath = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4().hex}_{filename}")
         file.save(filepath)
-        index_manager = ADDFile(lexicon_file,  barrels_dir, doc_id_file)#calling the ADDFile class functions 
-        index_manager.update_index(f"{filepath}") #for updating the inverted index
-        start_cpp_process()#again starting the cpp process for the updated inverted index
-        return jsonify({"status": "success", "message": "File uploaded successfully"})
+        job = ingest_queue.submit(file.filename, filepath)
+        return jsonify({
+            "status": "queued",
+            "job_id": job.id,
+            "message": "File uploaded successfully, it is being indexed",
+        }), 202
     except Exception as e:
         print("Upload error:", e)
         return jsonify({"status": "error", "message": str(e)}), 500
+#route to follow an upload through indexing
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    job = ingest_queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": "Unknown job"}), 404
+    return jsonify(job.to_dict())
 
-# Initialize the C++ process when the server starts
+# Load the query engine when the server starts
 if __name__ == '__main__':
-    start_cpp_process()
-    app.run(debug=True)
+    start_query_engine()
+    ingest_queue.start()
+    app.run(debug=True, threaded=True)
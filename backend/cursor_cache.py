@@ -0,0 +1,160 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from result_cache import normalize_query
+
+
+def format_cursor(entry_id, offset):
+    return f"{entry_id}.{offset}"
+
+
+def parse_cursor(cursor):
+    """
+    The (entry id, offset) a cursor stands for, or None if it is not one of ours.
+    """
+    entry_id, _, offset = str(cursor).partition('.')
+    if not entry_id or not offset.isdigit():
+        return None
+    return entry_id, int(offset)
+
+
+class RankedQuery:
+    """
+    The (doc_id, score) pairs of a query ranked so far, best first. depth is the k they were
+    ranked with; once the ranking found fewer documents than that, the list is complete.
+    corrected_query is the query that was ranked if its spelling was corrected.
+    """
+
+    def __init__(self, query, ranked, depth, generation, corrected_query=None):
+        self.query = query
+        self.corrected_query = corrected_query
+        self.ranked = ranked
+        self.depth = depth
+        self.generation = generation
+        self.complete = len(ranked) < depth
+        self.lock = threading.Lock()  # the first pages of a query share its ranking, so may extend it at once
+
+    def extend(self, ranked, depth):
+        """
+        Continue the ranking with a deeper one of the same query. The results ranked so far keep
+        their places, so the pages handed out stay valid, and only the documents they do not hold
+        are appended: a deeper ranking need not start with the same results, proximity reranking
+        reorders a larger pool of candidates.
+        """
+        with self.lock:
+            if depth > self.depth:
+                served = {doc_id for doc_id, _ in self.ranked}
+                self.ranked = self.ranked + [result for result in ranked if result[0] not in served]
+                self.depth = depth
+                self.complete = len(ranked) < depth
+
+
+class CursorCache:
+    """
+    Rankings of paged queries, keyed by the id in their cursors, so later pages are cut from the
+    ranking of the first one or extend it instead of starting over. LRU bounded by entry count;
+    entries also expire ttl seconds after they were last used. Like the result cache, rankings are
+    tagged with the index generation, and bump_generation() drops them all when the index changes.
+    A query is ranked once per generation: the first pages of it asked for again are served from
+    the ranking kept for it (see find), whose queries also warm up a new index before it serves.
+    """
+
+    def __init__(self, max_entries=256, ttl=300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.generation = 0
+        self.entries = OrderedDict()  # entry id -> (RankedQuery, expiry time)
+        self.queries = {}  # normalized query -> id of the latest entry ranking it
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def add(self, entry):
+        """
+        Keep a ranking and return the id for its cursors. Rankings of a generation that has been
+        replaced while they were computed are not kept, their cursors are already expired.
+        """
+        entry_id = uuid.uuid4().hex
+        now = time.monotonic()
+        with self.lock:
+            if entry.generation != self.generation:
+                return entry_id
+            # least recently used first, so the expired entries are all at the front
+            while self.entries and next(iter(self.entries.values()))[1] < now:
+                self._remove(next(iter(self.entries)))
+            self.entries[entry_id] = (entry, now + self.ttl)
+            self.queries[normalize_query(entry.query)] = entry_id
+            while len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+        return entry_id
+
+    def get(self, entry_id):
+        """
+        The ranking behind a cursor, or None if it expired or was evicted.
+        """
+        with self.lock:
+            return self._get(entry_id)
+
+    def find(self, query):
+        """
+        The (entry id, ranking) kept for a query on the current generation, or (None, None).
+        """
+        with self.lock:
+            entry_id = self.queries.get(normalize_query(query))
+            if entry_id is None:
+                self.misses += 1
+                return None, None
+            entry = self._get(entry_id)
+            return (entry_id, entry) if entry is not None else (None, None)
+
+    def recent_queries(self, limit):
+        """
+        The most recently used paged queries, used with those of the result cache to warm up a new index.
+        """
+        with self.lock:
+            queries = dict.fromkeys(normalize_query(entry.query) for entry, _ in reversed(self.entries.values()))
+            return list(queries)[:limit]
+
+    def _get(self, entry_id):
+        now = time.monotonic()
+        item = self.entries.get(entry_id)
+        if item is None or item[1] < now or item[0].generation != self.generation:
+            if item is not None:
+                self._remove(entry_id)
+            self.misses += 1
+            return None
+        self.entries[entry_id] = (item[0], now + self.ttl)
+        self.entries.move_to_end(entry_id)
+        self.hits += 1
+        return item[0]
+
+    def _remove(self, entry_id):
+        entry = self.entries.pop(entry_id)[0]
+        key = normalize_query(entry.query)
+        if self.queries.get(key) == entry_id:
+            del self.queries[key]
+
+    def bump_generation(self):
+        """
+        Expire every cursor, called after the index has changed.
+        """
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.queries.clear()
+            return self.generation
+
+    def stats(self):
+        with self.lock:
+            return {
+                "generation": self.generation,
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
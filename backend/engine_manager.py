@@ -0,0 +1,117 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class LoadedSnapshot:
+    """
+    A query engine loaded from one snapshot, with the number of requests currently using it.
+    """
+
+    def __init__(self, version, engine):
+        self.version = version
+        self.engine = engine
+        self.active = 0
+        self.retired = False
+
+
+class EngineManager:
+    """
+    Serves queries from the engine of the current snapshot. A newly published snapshot is loaded
+    and warmed up next to the serving one, then swapped in under a short lock, so no request ever
+    waits for a load or sees a half loaded index. The replaced engine is closed as soon as the
+    last request still using it is done.
+    """
+
+    def __init__(self, store, load_engine, warm_queries=None, on_swap=None, poll_interval=2.0):
+        self.store = store
+        self.load_engine = load_engine  # index directory -> engine
+        self.warm_queries = warm_queries or (lambda: [])
+        self.on_swap = on_swap
+        self.poll_interval = poll_interval
+        self.loaded = None
+        self.lock = threading.Lock()  # guards loaded and the request counts
+        self.refresh_lock = threading.Lock()  # one snapshot is loaded at a time
+        self._stop = threading.Event()
+        self._watcher = None
+
+    @contextmanager
+    def engine(self):
+        """
+        The engine to use for one request, or None before the first snapshot is loaded. It stays
+        open until the request is done even if a newer snapshot is swapped in meanwhile.
+        """
+        with self.lock:
+            loaded = self.loaded
+            if loaded is not None:
+                loaded.active += 1
+        if loaded is None:
+            yield None
+            return
+        try:
+            yield loaded.engine
+        finally:
+            with self.lock:
+                loaded.active -= 1
+                drained = loaded.retired and loaded.active == 0
+            if drained:
+                loaded.engine.close()
+
+    @property
+    def version(self):
+        loaded = self.loaded
+        return loaded.version if loaded is not None else None
+
+    def refresh(self):
+        """
+        Load the current snapshot if it is not the one being served, warm it up and swap it in.
+        Returns True if the engine was swapped.
+        """
+        with self.refresh_lock:
+            version = self.store.current()
+            if version is None or version == self.version:
+                return False
+            started = time.perf_counter()
+            engine = self.load_engine(self.store.path(version))
+            for query in self.warm_queries():
+                try:
+                    engine.search(query)
+                except Exception as e:
+                    print("Warm-up query failed:", e)
+            with self.lock:
+                old = self.loaded
+                self.loaded = LoadedSnapshot(version, engine)
+                if old is not None:
+                    old.retired = True
+                    drained = old.active == 0
+            if self.on_swap is not None:
+                self.on_swap(version)
+            if old is not None and drained:
+                old.engine.close()
+            print(f"Serving snapshot {version}, loaded in {time.perf_counter() - started:.2f}s")
+            return True
+
+    def start(self):
+        """
+        Load the current snapshot and watch CURRENT for snapshots published by other processes.
+        """
+        self.refresh()
+        self._watcher = threading.Thread(target=self._watch, daemon=True)
+        self._watcher.start()
+
+    def _watch(self):
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print("Snapshot refresh error:", e)
+
+    def stop(self):
+        self._stop.set()
+        with self.lock:
+            loaded, self.loaded = self.loaded, None
+            if loaded is not None:
+                loaded.retired = True
+                drained = loaded.active == 0
+        if loaded is not None and drained:
+            loaded.engine.close()
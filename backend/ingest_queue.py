@@ -0,0 +1,156 @@
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+
+QUEUED = 'queued'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class IngestJob:
+    """
+    One uploaded file waiting for or going through ingestion. The worker moves it through phases
+    (queued, reading, tokenizing, writing, publishing, warming, done or failed) and records how
+    long each one took.
+    """
+
+    def __init__(self, filename, path):
+        self.id = uuid.uuid4().hex
+        self.filename = filename
+        self.path = path
+        self.phase = QUEUED
+        self.submitted_at = time.time()
+        self.finished_at = None
+        self.timings = {}
+        self.documents_total = None
+        self.documents_processed = 0
+        self.doc_ids = None
+        self.batch_size = None
+        self.snapshot = None
+        self.error = None
+        self._phase_started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @property
+    def finished(self):
+        return self.phase in (DONE, FAILED)
+
+    def set_phase(self, phase):
+        with self._lock:
+            if self.finished or phase == self.phase:
+                return
+            now = time.perf_counter()
+            self.timings[self.phase] = self.timings.get(self.phase, 0.0) + now - self._phase_started
+            self._phase_started = now
+            self.phase = phase
+            if self.finished:
+                self.finished_at = time.time()
+
+    def progress(self, processed, total=None):
+        with self._lock:
+            self.documents_processed = processed
+            if total is not None:
+                self.documents_total = total
+
+    def fail(self, error):
+        self.error = error
+        self.set_phase(FAILED)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "job_id": self.id,
+                "filename": self.filename,
+                "phase": self.phase,
+                "documents_total": self.documents_total,
+                "documents_processed": self.documents_processed,
+                "doc_id_range": [self.doc_ids[0], self.doc_ids[-1]] if self.doc_ids else None,
+                "batch_size": self.batch_size,
+                "snapshot": self.snapshot,
+                "submitted_at": self.submitted_at,
+                "finished_at": self.finished_at,
+                "timings": dict(self.timings),
+                "error": self.error,
+            }
+
+
+class IngestQueue:
+    """
+    Uploads are queued and indexed by one background worker. Every file queued by the time the
+    worker picks up the next batch (waiting coalesce_delay seconds for stragglers) is handed to
+    ingest_fn together, so a burst of uploads costs one index update and one snapshot publish.
+    ingest_fn(jobs) fails the jobs it cannot index itself; if it raises, the whole batch fails.
+    """
+
+    def __init__(self, ingest_fn, max_batch=16, coalesce_delay=0.5, max_jobs_kept=1000):
+        self.ingest_fn = ingest_fn
+        self.max_batch = max_batch
+        self.coalesce_delay = coalesce_delay
+        self.max_jobs_kept = max_jobs_kept
+        self.jobs = OrderedDict()  # job id -> job, oldest first
+        self.pending = []
+        self.condition = threading.Condition()
+        self._worker = None
+        self._stopping = False
+
+    def submit(self, filename, path):
+        job = IngestJob(filename, path)
+        with self.condition:
+            self.jobs[job.id] = job
+            self._forget_old_jobs()
+            self.pending.append(job)
+            self.condition.notify()
+        return job
+
+    def get(self, job_id):
+        with self.condition:
+            return self.jobs.get(job_id)
+
+    def _forget_old_jobs(self):
+        while len(self.jobs) > self.max_jobs_kept:
+            oldest = next(iter(self.jobs.values()))
+            if not oldest.finished:
+                break
+            del self.jobs[oldest.id]
+
+    def start(self):
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+
+    def stop(self):
+        with self.condition:
+            self._stopping = True
+            self.condition.notify()
+        if self._worker is not None:
+            self._worker.join()
+
+    def _next_batch(self):
+        with self.condition:
+            while not self.pending and not self._stopping:
+                self.condition.wait()
+            if self._stopping:
+                return None
+        time.sleep(self.coalesce_delay)
+        with self.condition:
+            batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            for job in batch:
+                job.batch_size = len(batch)
+            try:
+                self.ingest_fn(batch)
+            except Exception as e:
+                print("Ingest error:", e)
+                print("Traceback:", traceback.format_exc())
+                for job in batch:
+                    job.fail(str(e))
+            for job in batch:
+                job.set_phase(DONE)
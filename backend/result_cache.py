@@ -0,0 +1,98 @@
+import json
+import threading
+from collections import OrderedDict
+
+
+def normalize_query(query):
+    """
+    Cache key of a query: case and extra whitespace do not change the results.
+    """
+    return ' '.join(query.lower().split())
+
+
+class ResultCache:
+    """
+    LRU cache of query results, bounded by entry count and by the approximate size of the cached
+    JSON. Every entry is tagged with the index generation it was computed on; bump_generation()
+    is called whenever the index changes, after which older entries are never served again.
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.generation = 0
+        self.entries = OrderedDict()  # key -> (generation, results, size)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, query):
+        """
+        Return the cached results of a query for the current generation, or None.
+        """
+        key = normalize_query(query)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != self.generation:
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, query, results, generation):
+        """
+        Cache results computed on the given generation. Results of a generation that has been
+        replaced while they were computed are dropped.
+        """
+        key = normalize_query(query)
+        size = len(json.dumps(results))
+        with self.lock:
+            if generation != self.generation or size > self.max_bytes:
+                return
+            if key in self.entries:
+                self._remove(key)
+            self.entries[key] = (generation, results, size)
+            self.bytes += size
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                self._remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def recent_queries(self, limit):
+        """
+        The most recently used cached queries, used to warm up a new index before it serves.
+        """
+        with self.lock:
+            return list(reversed(self.entries))[:limit]
+
+    def bump_generation(self):
+        """
+        Invalidate every cached result, called after the index has changed.
+        """
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+            self.bytes = 0
+            return self.generation
+
+    def _remove(self, key):
+        self.bytes -= self.entries.pop(key)[2]
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "generation": self.generation,
+                "entries": len(self.entries),
+                "bytes": self.bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,11 @@
+"""
+Benchmarks for the index build, incremental ingest and query serving. Run from the repository root:
+
+    python -m benchmarks                  generate a corpus, time the build and replay queries
+    python -m benchmarks.corpus           only generate a synthetic data.csv and query log
+    python -m benchmarks.build            only time the build stages and the ingest
+    python -m benchmarks.queries          only replay a query log against the backend or an index
+    python -m benchmarks.startup          only time a cold backend start until its first query
+
+Every run writes its parameters, environment and results as JSON, so runs can be compared.
+"""
@@ -0,0 +1,46 @@
+import argparse
+from pathlib import Path
+from benchmarks.build import add_build_arguments, benchmark_build
+from benchmarks.corpus import CorpusGenerator, synthetic_corpus
+from benchmarks.queries import EngineTarget, add_query_arguments, benchmark_queries, load_queries
+from benchmarks.report import write_results
+from benchmarks.startup import benchmark_startup
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a corpus, time the index build and ingest, then replay queries against the built index")
+    parser.add_argument('--docs', type=int, default=10000, help="articles in the generated corpus")
+    parser.add_argument('--average-words', type=int, default=300)
+    parser.add_argument('--vocabulary', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--queries', default=None, help="query log to replay (default: generate one from the corpus vocabulary)")
+    parser.add_argument('--data-dir', default='benchmark_data', help="where generated corpora are kept and reused")
+    parser.add_argument('--work-dir', default='benchmark_work', help="scratch directory, replaced on every run")
+    parser.add_argument('--output', default='benchmark_results.json', help="JSON results file")
+    add_build_arguments(parser)
+    add_query_arguments(parser)
+    parser.add_argument('--startup-runs', type=int, default=3, help="backend processes started to time the first query, 0 skips it")
+    args = parser.parse_args(argv)
+
+    data_file = synthetic_corpus(args.data_dir, args.docs, args.average_words, args.vocabulary, args.seed)
+    results = {"build": benchmark_build(data_file, args.work_dir, args)}
+    streaming = results["build"]["streaming"]
+    if streaming["exit_code"] == 0:
+        if args.queries:
+            queries = load_queries(args.queries)
+        else:
+            queries = CorpusGenerator(args.vocabulary, seed=args.seed).queries(args.num_queries)
+        if args.startup_runs:
+            print("Startup:")
+            results["startup"] = benchmark_startup(Path(args.work_dir) / 'index', queries[0], args.startup_runs)
+        print("Query replay:")
+        target = EngineTarget(Path(args.work_dir) / 'index', not args.match_any, args.engine_workers)
+        try:
+            results["queries"] = benchmark_queries(target, queries, args.concurrency, args.warmup, args.batch_sizes)
+        finally:
+            target.close()
+    write_results(args.output, 'suite', vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
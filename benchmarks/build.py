@@ -0,0 +1,107 @@
+import argparse
+import json
+import shutil
+import sys
+from pathlib import Path
+from benchmarks.corpus import CorpusGenerator, synthetic_corpus
+from benchmarks.report import SRC_DIR, run_stage, write_results
+
+# The script pipeline from the readme, one child process per stage, run in a scratch directory
+PIPELINE = [
+    ('lexicon', lambda work, options: ['lexicon.py', '--data', 'data.csv', '--output', 'lexicon.csv', '--workers', str(options.workers)]),
+    ('forward_index', lambda work, options: ['forward_index.py']),
+    ('inverted_index', lambda work, options: ['inverted_index.py']),
+    ('barrels', lambda work, options: ['external_index.py', '--forward-index', 'forward_index.csv', '--barrels', str(work / 'barrels'),
+                                       '--memory-mb', str(options.memory_mb), '--tmp-dir', str(work)]),
+    ('metadata', lambda work, options: ['clean_data.py']),
+    ('doc_store', lambda work, options: ['doc_store.py', '--newdata', 'newdata.csv', '--output', str(work)]),
+    ('compact_lexicon', lambda work, options: ['compact_lexicon.py', '--index', str(work)]),
+]
+
+
+def python_stage(name, arguments, cwd):
+    return run_stage(name, [sys.executable, str(SRC_DIR / arguments[0])] + arguments[1:], cwd=cwd)
+
+
+def benchmark_build(data_file, work_dir, options):
+    """
+    Time every stage of the script pipeline and of the streaming build on data_file, then the
+    incremental ingest of an upload into the streamed index. Returns the results as a dict.
+    """
+    work_dir = Path(work_dir).resolve()
+    shutil.rmtree(work_dir, ignore_errors=True)
+    pipeline_dir = work_dir / 'pipeline'
+    pipeline_dir.mkdir(parents=True)
+    shutil.copyfile(data_file, pipeline_dir / 'data.csv')
+    results = {"pipeline": [], "streaming": None, "ingest": None}
+
+    print("Script pipeline:")
+    for name, arguments in PIPELINE:
+        result = python_stage(name, arguments(pipeline_dir, options), pipeline_dir)
+        results["pipeline"].append(result)
+        if result["exit_code"] != 0:
+            break
+    results["pipeline_seconds"] = round(sum(stage["seconds"] for stage in results["pipeline"]), 4)
+
+    print("Streaming build:")
+    index_dir = work_dir / 'index'
+    arguments = ['build_index.py', '--data', str(Path(data_file).resolve()), '--output', str(index_dir),
+                 '--workers', str(options.workers), '--memory-mb', str(options.memory_mb)]
+    if options.impacts:
+        arguments.append('--impacts')
+    if options.shards > 1:
+        arguments += ['--shards', str(options.shards)]
+    if options.positions:
+        arguments.append('--positions')
+    streaming = python_stage('build_index', arguments, work_dir)
+    timings_file = index_dir / 'build_timings.json'
+    if streaming["exit_code"] == 0 and timings_file.exists():
+        with open(timings_file, 'r') as f:
+            summary = json.load(f)
+        streaming["documents"] = summary["documents"]
+        streaming["stages"] = {name: round(seconds, 4) for name, seconds in summary["timings"].items()}
+    results["streaming"] = streaming
+
+    if streaming["exit_code"] == 0 and options.upload_docs:
+        print("Incremental ingest:")
+        upload_file = work_dir / 'upload.csv'
+        CorpusGenerator(options.vocabulary, seed=options.seed + 1).write_corpus(upload_file, options.upload_docs, options.average_words)
+        ingest_file = work_dir / 'ingest.json'
+        ingest = run_stage('ingest', [sys.executable, '-m', 'benchmarks.ingest', '--index', str(index_dir),
+                                      '--data', str(upload_file), '--output', str(ingest_file)])
+        if ingest["exit_code"] == 0:
+            with open(ingest_file, 'r') as f:
+                ingest.update(json.load(f))
+        results["ingest"] = ingest
+    return results
+
+
+def add_build_arguments(parser):
+    parser.add_argument('--workers', type=int, default=1, help="tokenizer processes for the lexicon and streaming build")
+    parser.add_argument('--memory-mb', type=int, default=256, help="posting buffer of the external sort")
+    parser.add_argument('--impacts', action='store_true', help="build impact barrels in the streaming build")
+    parser.add_argument('--shards', type=int, default=1, help="document shards written by the streaming build")
+    parser.add_argument('--positions', action='store_true', help="store word positions in the streaming build")
+    parser.add_argument('--upload-docs', type=int, default=1000, help="articles in the timed upload, 0 skips the ingest")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time each index build stage and the incremental ingest")
+    parser.add_argument('--data', default=None, help="articles CSV to index (default: generate one)")
+    parser.add_argument('--docs', type=int, default=10000, help="articles to generate when --data is not given")
+    parser.add_argument('--average-words', type=int, default=300)
+    parser.add_argument('--vocabulary', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default='benchmark_data', help="where generated corpora are kept and reused")
+    parser.add_argument('--work-dir', default='benchmark_work', help="scratch directory, replaced on every run")
+    parser.add_argument('--output', default='benchmark_build.json', help="JSON results file")
+    add_build_arguments(parser)
+    args = parser.parse_args(argv)
+
+    data_file = args.data or synthetic_corpus(args.data_dir, args.docs, args.average_words, args.vocabulary, args.seed)
+    results = benchmark_build(data_file, args.work_dir, args)
+    write_results(args.output, 'build', vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+import argparse
+import csv
+import math
+import random
+from itertools import accumulate
+from pathlib import Path
+
+# Synthetic articles in the column layout of the Kaggle data.csv (title, text, url, authors, timestamp,
+# tags). Words are drawn from a Zipfian distribution over a generated vocabulary, with the most common
+# English function words at the top ranks like in real text, so posting list lengths, stop word share
+# and lexicon growth behave like the real corpus. The same seed always produces the same corpus.
+FUNCTION_WORDS = ['the', 'of', 'and', 'to', 'a', 'in', 'is', 'that', 'for', 'it', 'as', 'with', 'was', 'on',
+                  'be', 'this', 'are', 'by', 'you', 'we', 'or', 'an', 'from', 'at', 'not', 'but', 'can', 'have',
+                  'they', 'which', 'your', 'all', 'will', 'more', 'has', 'one', 'our', 'if', 'their', 'what']
+ONSETS = ['b', 'c', 'd', 'f', 'g', 'h', 'j', 'k', 'l', 'm', 'n', 'p', 'r', 's', 't', 'v', 'w', 'z',
+          'br', 'ch', 'cl', 'cr', 'dr', 'fl', 'gr', 'pl', 'pr', 'sh', 'sl', 'st', 'th', 'tr']
+VOWELS = ['a', 'e', 'i', 'o', 'u', 'ai', 'ea', 'io', 'ou']
+CODAS = ['', '', '', 'n', 'r', 's', 't', 'l', 'm', 'ng', 'st', 'ck']
+DEFAULT_VOCABULARY = 50000
+DEFAULT_TAGS = 2000
+ZIPF_EXPONENT = 1.07
+
+
+def make_vocabulary(size, seed=0):
+    """
+    size distinct pronounceable words, shortest first so that frequent ranks get short words.
+    """
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        syllables = min(1 + int(rng.expovariate(0.9)), 5)
+        words.add(''.join(rng.choice(ONSETS) + rng.choice(VOWELS) + rng.choice(CODAS) for _ in range(syllables)))
+    words = sorted(words - set(FUNCTION_WORDS), key=lambda word: (len(word), word))
+    return FUNCTION_WORDS + words[:size - len(FUNCTION_WORDS)]
+
+
+def zipf_weights(size, exponent=ZIPF_EXPONENT):
+    return list(accumulate(1.0 / rank ** exponent for rank in range(1, size + 1)))
+
+
+class CorpusGenerator:
+    """
+    Generates articles and query logs over one Zipfian vocabulary.
+    """
+
+    def __init__(self, vocabulary_size=DEFAULT_VOCABULARY, num_tags=DEFAULT_TAGS, seed=0, exponent=ZIPF_EXPONENT):
+        self.rng = random.Random(seed)
+        self.vocabulary = make_vocabulary(vocabulary_size, seed)
+        self.weights = zipf_weights(len(self.vocabulary), exponent)
+        # Tags are phrases of one or two content words with their own popularity
+        content = self.vocabulary[len(FUNCTION_WORDS):]
+        tag_rng = random.Random(seed + 1)
+        self.tags = [' '.join(word.capitalize() for word in tag_rng.sample(content[:5000], tag_rng.choice((1, 1, 2))))
+                     for _ in range(num_tags)]
+        self.tag_weights = zipf_weights(num_tags, 1.0)
+        self.authors = [f"{tag_rng.choice(content[:3000]).capitalize()} {tag_rng.choice(content[:3000]).capitalize()}"
+                        for _ in range(max(num_tags // 2, 1))]
+
+    def words(self, count):
+        return self.rng.choices(self.vocabulary, cum_weights=self.weights, k=count)
+
+    def sentence(self):
+        words = self.words(self.rng.randint(6, 24))
+        return ' '.join(words).capitalize() + self.rng.choice('....!?')
+
+    def article(self, average_words=300):
+        rng = self.rng
+        length = max(20, int(rng.lognormvariate(math.log(average_words), 0.6)))
+        paragraphs, paragraph, written = [], [], 0
+        while written < length:
+            sentence = self.sentence()
+            paragraph.append(sentence)
+            written += sentence.count(' ') + 1
+            if len(paragraph) >= rng.randint(3, 7):
+                paragraphs.append(' '.join(paragraph))
+                paragraph = []
+        if paragraph:
+            paragraphs.append(' '.join(paragraph))
+        title = ' '.join(word.capitalize() for word in self.words(rng.randint(4, 12)))
+        author = rng.choice(self.authors)
+        tags = rng.choices(self.tags, cum_weights=self.tag_weights, k=rng.randint(1, 5))
+        slug = '-'.join(title.lower().split()[:8])
+        return [
+            title,
+            '\n\n'.join(paragraphs),
+            f"https://medium.com/@{author.replace(' ', '').lower()}/{slug}-{rng.getrandbits(48):012x}",
+            str([author]),
+            f"20{rng.randint(15, 24)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} "
+            f"{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}.{rng.randint(0, 999):03d}000+00:00",
+            str(list(dict.fromkeys(tags))),
+        ]
+
+    def write_corpus(self, path, num_docs, average_words=300):
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['title', 'text', 'url', 'authors', 'timestamp', 'tags'])
+            for _ in range(num_docs):
+                writer.writerow(self.article(average_words))
+        return Path(path)
+
+    def queries(self, count, distinct=None):
+        """
+        A query log of count queries of one to four content words. Queries repeat with a Zipfian
+        popularity over distinct different queries, like a real log does.
+        """
+        rng = self.rng
+        offset = len(FUNCTION_WORDS)
+        content, weights = self.vocabulary[offset:], [weight - self.weights[offset - 1] for weight in self.weights[offset:]]
+        distinct = distinct or max(1, count // 4)
+        pool = [' '.join(rng.choices(content, cum_weights=weights, k=rng.choice((1, 2, 2, 2, 3, 3, 4))))
+                for _ in range(distinct)]
+        return rng.choices(pool, cum_weights=zipf_weights(len(pool), 1.0), k=count)
+
+    def write_queries(self, path, count, distinct=None):
+        with open(path, 'w', encoding='utf-8') as f:
+            for query in self.queries(count, distinct):
+                f.write(query + '\n')
+        return Path(path)
+
+
+def synthetic_corpus(data_dir, num_docs, average_words=300, vocabulary=DEFAULT_VOCABULARY, seed=0):
+    """
+    Path of a generated corpus in data_dir, generating it the first time it is asked for.
+    """
+    path = Path(data_dir) / f"data_{num_docs}docs_{average_words}w_{vocabulary}v_seed{seed}.csv"
+    if not path.exists():
+        path.parent.mkdir(parents=True, exist_ok=True)
+        print(f"Generating {num_docs} articles into {path}")
+        tmp_path = path.with_suffix('.tmp')
+        CorpusGenerator(vocabulary, seed=seed).write_corpus(tmp_path, num_docs, average_words)
+        tmp_path.replace(path)
+    return path
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic Zipfian data.csv and query log")
+    parser.add_argument('--docs', type=int, default=10000, help="number of articles")
+    parser.add_argument('--output', default='data.csv', help="articles CSV to write")
+    parser.add_argument('--average-words', type=int, default=300, help="median article length in words")
+    parser.add_argument('--vocabulary', type=int, default=DEFAULT_VOCABULARY, help="number of distinct words")
+    parser.add_argument('--queries', default=None, help="also write a query log, one query per line, to this file")
+    parser.add_argument('--num-queries', type=int, default=10000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    generator = CorpusGenerator(args.vocabulary, seed=args.seed)
+    generator.write_corpus(args.output, args.docs, args.average_words)
+    print(f"Wrote {args.docs} articles to {args.output}")
+    if args.queries:
+        generator.write_queries(args.queries, args.num_queries)
+        print(f"Wrote {args.num_queries} queries to {args.queries}")
+
+
+if __name__ == "__main__":
+    main()
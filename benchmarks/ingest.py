@@ -0,0 +1,64 @@
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from benchmarks.report import BACKEND_DIR, SRC_DIR, peak_rss_mb
+
+sys.path.append(str(SRC_DIR))
+sys.path.append(str(BACKEND_DIR))
+from ADDFile import ADDFile
+
+
+def time_ingest(index_dir, upload_file):
+    """
+    Index upload_file into index_dir as one segment the way the backend does, and return the time
+    spent reading, tokenizing and writing.
+    """
+    index_dir = Path(index_dir)
+    timings = {}
+    phase = ['reading', time.perf_counter()]
+
+    def progress(name, _processed):
+        if name != phase[0]:
+            now = time.perf_counter()
+            timings[phase[0]] = timings.get(phase[0], 0.0) + now - phase[1]
+            phase[:] = [name, now]
+
+    started = time.perf_counter()
+    index_manager = ADDFile(index_dir / 'lexicon.csv', index_dir / 'barrels', index_dir / 'doc_id.txt',
+                            segment_directory=index_dir / 'segments')
+    timings['open'] = time.perf_counter() - started
+    phase[1] = time.perf_counter()
+    rows = ADDFile.read_rows(upload_file)
+    try:
+        doc_ids = index_manager.update_index_batch([rows], progress)[0]
+    finally:
+        index_manager.close()
+    progress('done', len(rows))
+    total = time.perf_counter() - started
+    return {
+        "documents": len(doc_ids),
+        "seconds": round(total, 4),
+        "documents_per_second": round(len(doc_ids) / total, 1) if total else None,
+        "phases": {name: round(seconds, 4) for name, seconds in timings.items()},
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the incremental ingest of one upload into an index")
+    parser.add_argument('--index', required=True, help="index directory to add the upload to (it is modified)")
+    parser.add_argument('--data', required=True, help="uploaded articles CSV")
+    parser.add_argument('--output', default=None, help="JSON file for the timings (default: print them)")
+    args = parser.parse_args(argv)
+    result = time_ingest(args.index, args.data)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(result, f, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+import argparse
+import json
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from benchmarks.corpus import CorpusGenerator
+from benchmarks.report import SRC_DIR, latency_summary, peak_rss_mb, process_peak_rss_mb, write_results
+
+sys.path.append(str(SRC_DIR))
+
+
+def load_queries(path):
+    """
+    A query log: one query per line, blank lines skipped.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class HttpTarget:
+    """
+    The running backend, queried through POST /query like the frontend does.
+    """
+
+    def __init__(self, url, server_pid=None, timeout=30.0):
+        self.url = url.rstrip('/')
+        self.server_pid = server_pid
+        self.timeout = timeout
+
+    def search(self, query):
+        request = urllib.request.Request(f"{self.url}/query", data=json.dumps({"query": query}).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                response.read()
+        except urllib.error.HTTPError as e:
+            # 400 is the answer to a query without known words, not a failure of the server
+            if e.code != 400:
+                raise
+
+    def search_batch(self, queries):
+        request = urllib.request.Request(f"{self.url}/query/batch", data=json.dumps({"queries": queries}).encode('utf-8'),
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            response.read()
+
+    def peak_rss_mb(self):
+        if self.server_pid is None:
+            return None
+        peak = process_peak_rss_mb(self.server_pid)
+        return round(peak, 1) if peak is not None else None
+
+    def details(self):
+        try:
+            with urllib.request.urlopen(f"{self.url}/cache/stats", timeout=self.timeout) as response:
+                return {"cache": json.load(response)}
+        except (OSError, ValueError):
+            return {}
+
+    def close(self):
+        pass
+
+
+class EngineTarget:
+    """
+    A query engine loaded in this process, without the HTTP server and result cache in front of it.
+    """
+
+    def __init__(self, index_dir, match_all=True, workers=None):
+        from analyzer import get_analyzer
+        from query_engine import open_engine
+        started = time.perf_counter()
+        self.engine = open_engine(index_dir, workers=workers, analyzer=get_analyzer())
+        self.load_seconds = time.perf_counter() - started
+        self.match_all = match_all
+
+    def search(self, query):
+        self.engine.search(query, self.match_all)
+
+    def search_batch(self, queries):
+        self.engine.search_batch(queries, self.match_all)
+
+    def peak_rss_mb(self):
+        return round(peak_rss_mb(), 1)
+
+    def details(self):
+        return {"load_seconds": round(self.load_seconds, 4)}
+
+    def close(self):
+        self.engine.close()
+
+
+def replay(target, queries, concurrency=1, warmup=0):
+    """
+    Send the queries to target from concurrency threads, each sending its next query as soon as the
+    previous one is answered, and measure throughput and per query latency. The first warmup
+    queries are sent before the clock starts.
+    """
+    for query in queries[:warmup]:
+        target.search(query)
+    queries = queries[warmup:]
+    latencies = [[] for _ in range(concurrency)]
+    errors = []
+    position = [0]
+    lock = threading.Lock()
+
+    def worker(measured):
+        while True:
+            with lock:
+                index = position[0]
+                position[0] += 1
+            if index >= len(queries):
+                return
+            started = time.perf_counter()
+            try:
+                target.search(queries[index])
+            except Exception as e:
+                errors.append(f"{queries[index]!r}: {e}")
+                continue
+            measured.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=worker, args=(measured,)) for measured in latencies]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    answered = sum(len(measured) for measured in latencies)
+    result = {
+        "concurrency": concurrency,
+        "queries": len(queries),
+        "errors": len(errors),
+        "seconds": round(seconds, 4),
+        "throughput_qps": round(answered / seconds, 1) if seconds else None,
+        "latency": latency_summary([value for measured in latencies for value in measured]),
+        "peak_rss_mb": target.peak_rss_mb(),
+    }
+    if errors:
+        result["first_errors"] = errors[:5]
+    print(f"  concurrency {concurrency:>3}: {result['throughput_qps']} q/s, p50 {result['latency']['p50_ms']} ms, "
+          f"p95 {result['latency']['p95_ms']} ms, p99 {result['latency']['p99_ms']} ms, {len(errors)} errors")
+    return result
+
+
+def replay_batches(target, queries, batch_size):
+    """
+    Send the queries in batches of batch_size from one thread and measure the time per query.
+    """
+    latencies = []
+    started = time.perf_counter()
+    for start in range(0, len(queries), batch_size):
+        batch = queries[start:start + batch_size]
+        batch_started = time.perf_counter()
+        target.search_batch(batch)
+        latencies.append(time.perf_counter() - batch_started)
+    seconds = time.perf_counter() - started
+    result = {
+        "batch_size": batch_size,
+        "queries": len(queries),
+        "seconds": round(seconds, 4),
+        "throughput_qps": round(len(queries) / seconds, 1) if seconds else None,
+        "per_query_ms": round(seconds / len(queries) * 1000, 3) if queries else None,
+        "batch_latency": latency_summary(latencies),
+    }
+    print(f"  batches of {batch_size}: {result['throughput_qps']} q/s, {result['per_query_ms']} ms per query")
+    return result
+
+
+def benchmark_queries(target, queries, concurrency_levels=(1,), warmup=100, batch_sizes=()):
+    results = {"runs": [replay(target, queries, concurrency, warmup) for concurrency in concurrency_levels]}
+    if batch_sizes:
+        results["batches"] = [replay_batches(target, queries[warmup:], batch_size) for batch_size in batch_sizes]
+    results.update(target.details())
+    return results
+
+
+def add_query_arguments(parser):
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4], help="client threads, one run per value")
+    parser.add_argument('--warmup', type=int, default=100, help="queries sent before measuring each run")
+    parser.add_argument('--num-queries', type=int, default=5000, help="queries to generate when --queries is not given")
+    parser.add_argument('--match-any', action='store_true', help="rank documents containing any query word (in-process only)")
+    parser.add_argument('--batch-sizes', type=int, nargs='*', default=[], help="also replay the queries in batches of these sizes")
+    parser.add_argument('--engine-workers', type=int, default=None, help="worker processes of a sharded index (in-process only)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a query log and report throughput, latency percentiles and peak RSS")
+    target_group = parser.add_mutually_exclusive_group(required=True)
+    target_group.add_argument('--url', help="backend to query, e.g. http://localhost:5000")
+    target_group.add_argument('--index', help="or an index directory to load and query in this process")
+    parser.add_argument('--server-pid', type=int, default=None, help="pid of the backend, to report its peak RSS")
+    parser.add_argument('--queries', default=None, help="query log, one query per line (default: generate one)")
+    parser.add_argument('--vocabulary', type=int, default=50000, help="vocabulary of the generated queries, as used for the corpus")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='benchmark_queries.json', help="JSON results file")
+    add_query_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.queries:
+        queries = load_queries(args.queries)
+    else:
+        queries = CorpusGenerator(args.vocabulary, seed=args.seed).queries(args.num_queries)
+    if args.url:
+        target = HttpTarget(args.url, args.server_pid)
+    else:
+        target = EngineTarget(args.index, not args.match_any, args.engine_workers)
+    try:
+        results = benchmark_queries(target, queries, args.concurrency, args.warmup, args.batch_sizes)
+    finally:
+        target.close()
+    write_results(args.output, 'queries', vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
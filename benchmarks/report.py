@@ -0,0 +1,125 @@
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+SRC_DIR = ROOT_DIR / 'src'
+BACKEND_DIR = ROOT_DIR / 'backend'
+
+
+def peak_rss_mb(usage=None):
+    """
+    Peak resident set size in MB of this process, or of the process a resource usage was taken for.
+    ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    """
+    usage = usage or resource.getrusage(resource.RUSAGE_SELF)
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return usage.ru_maxrss / scale
+
+
+def process_peak_rss_mb(pid):
+    """
+    Peak RSS in MB of another running process (Linux only), or None if it cannot be read.
+    """
+    try:
+        with open(f'/proc/{pid}/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def latency_summary(seconds):
+    """
+    Latency percentiles in milliseconds of a list of durations in seconds.
+    """
+    values = sorted(seconds)
+    summary = {"count": len(values)}
+    for name, fraction in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99), ("max", 1.0)):
+        value = percentile(values, fraction)
+        summary[f"{name}_ms"] = round(value * 1000, 3) if value is not None else None
+    summary["mean_ms"] = round(sum(values) / len(values) * 1000, 3) if values else None
+    return summary
+
+
+def run_stage(name, command, cwd=None, env=None):
+    """
+    Run one stage as a child process and return its wall time, peak RSS and exit code. The child's
+    own resource usage is collected with wait4, so stages do not mix their peaks.
+    """
+    env = dict(os.environ if env is None else env)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(SRC_DIR), str(BACKEND_DIR), str(ROOT_DIR), env.get('PYTHONPATH')]))
+    started = time.perf_counter()
+    process = subprocess.Popen(command, cwd=cwd, env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = process.stdout.read()
+    process.stdout.close()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    seconds = time.perf_counter() - started
+    result = {
+        "stage": name,
+        "seconds": round(seconds, 4),
+        "peak_rss_mb": round(peak_rss_mb(usage), 1),
+        "exit_code": process.returncode,
+    }
+    print(f"  {name:<16} {seconds:8.2f}s  {result['peak_rss_mb']:8.1f} MB")
+    if process.returncode != 0:
+        result["output"] = output.decode('utf-8', 'replace')[-4000:]
+        print(result["output"])
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    """
+    What a result was measured on, so runs on different machines or commits are not compared blindly.
+    """
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "git_revision": git_revision(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def write_results(path, benchmark, parameters, results):
+    """
+    Write one benchmark run as JSON: the benchmark name, its parameters, the environment and the results.
+    """
+    document = {
+        "benchmark": benchmark,
+        "parameters": parameters,
+        "environment": environment(),
+        "results": results,
+    }
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(document, f, indent=2)
+    print(f"Results written to {path}")
+    return document
@@ -0,0 +1,113 @@
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+from benchmarks.report import BACKEND_DIR, ROOT_DIR, SRC_DIR, write_results
+
+sys.path.append(str(SRC_DIR))
+
+# The child prints its timings on a line of its own after this marker, the backend prints other lines too
+RESULT_MARKER = 'STARTUP_RESULT '
+
+
+def child_startup(query):
+    """
+    Run in a fresh interpreter: start the backend the way app.py does and answer one query through
+    its routes. Prints the seconds each step took from the start of this function.
+    """
+    started = time.perf_counter()
+    sys.path.append(str(BACKEND_DIR))
+    import app
+    imported = time.perf_counter() - started
+    app.start_query_engine()
+    client = app.app.test_client()
+    readiness = client.get('/ready')
+    ready = time.perf_counter() - started
+    response = client.post('/query', json={"query": query})
+    first_query = time.perf_counter() - started
+    app.engines.stop()
+    result = {
+        "import_seconds": round(imported, 4),
+        "ready_seconds": round(ready, 4),
+        "first_query_seconds": round(first_query, 4),
+        "ready_status": readiness.status_code,
+        "query_status": response.status_code,
+        # heavy modules the query path should not need before its first query
+        "loaded": {name: name in sys.modules for name in ('nltk', 'pandas', 'numpy')},
+    }
+    print(RESULT_MARKER + json.dumps(result), flush=True)
+
+
+def time_startup(index_root, query):
+    """
+    Start one backend process on the snapshots in index_root and time it until its first answer.
+    The wall time includes starting the interpreter.
+    """
+    env = dict(os.environ, INDEX_ROOT=str(index_root))
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [str(SRC_DIR), str(BACKEND_DIR), str(ROOT_DIR), env.get('PYTHONPATH')]))
+    started = time.perf_counter()
+    process = subprocess.run([sys.executable, '-m', 'benchmarks.startup', '--child', '--query', query],
+                             cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    seconds = time.perf_counter() - started
+    for line in process.stdout.splitlines():
+        if line.startswith(RESULT_MARKER):
+            result = json.loads(line[len(RESULT_MARKER):])
+            result["time_to_first_query_seconds"] = round(seconds, 4)
+            return result
+    return {"exit_code": process.returncode, "output": (process.stdout + process.stderr)[-4000:]}
+
+
+def benchmark_startup(index_dir, query, runs=3, work_dir=None):
+    """
+    Time-to-first-query of the backend serving the index in index_dir, over runs cold processes
+    (the operating system's file cache stays warm between them). The index is published as a
+    snapshot in a scratch root next to it, hard-linked, so index_dir itself is left untouched.
+    """
+    from snapshot import SnapshotStore
+    index_dir = Path(index_dir).resolve()
+    index_root = Path(work_dir or index_dir.parent / 'startup_root').resolve()
+    shutil.rmtree(index_root, ignore_errors=True)
+    SnapshotStore(index_root).import_index(index_dir)
+    results = {"bundle": (index_dir / 'manifest.json').exists(), "runs": []}
+    try:
+        for _ in range(runs):
+            results["runs"].append(time_startup(index_root, query))
+    finally:
+        shutil.rmtree(index_root, ignore_errors=True)
+    timed = [run["time_to_first_query_seconds"] for run in results["runs"] if "time_to_first_query_seconds" in run]
+    if timed:
+        results["time_to_first_query_seconds"] = round(statistics.median(timed), 4)
+        results["ready_seconds"] = round(statistics.median(run["ready_seconds"] for run in results["runs"] if "ready_seconds" in run), 4)
+        print(f"  time to first query {results['time_to_first_query_seconds']:.2f}s (median of {len(timed)}), "
+              f"ready after {results['ready_seconds']:.2f}s in process")
+    else:
+        print("  the backend did not start:")
+        print(results["runs"][-1].get("output", ""))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time how long a freshly started backend takes to answer its first query")
+    parser.add_argument('--index', help="index directory to serve (it is published into a scratch snapshot root)")
+    parser.add_argument('--query', default='search engine', help="the first query")
+    parser.add_argument('--runs', type=int, default=3, help="backend processes to start, the median is reported")
+    parser.add_argument('--output', default='benchmark_startup.json', help="JSON results file")
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child_startup(args.query)
+        return
+    if not args.index:
+        parser.error("--index is required")
+    print("Startup:")
+    results = benchmark_startup(args.index, args.query, args.runs)
+    write_results(args.output, 'startup', vars(args), results)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,11 +6,24 @@
 #include <vector>
 #include <string>
 #include <unordered_map>
+#include <cstdint>
+#include <cstring>
+#include <stdexcept>
 
 class LoadBarrel {
 
     const int NUM_BARRELS = 50; 
     const std::string BARRELS_DIR = "..\\engine_data\\barrels";
+    const size_t POSTING_SIZE = 6;  // uint32 doc ID + uint16 bit array, see binary_barrel.py
+    // Only the version 1 "fixed" codec is read: barrels from build_index.py, external_index.py and the
+    // uploads are packed (version 3), write fixed ones with python barrel.py --codec fixed
+
+    struct DirectoryEntry {
+        uint64_t offset;
+        uint32_t count;
+    };
+
+    std::unordered_map<int, std::unordered_map<int, DirectoryEntry>> directories;  // barrel index -> word directory
 
 public:
 
@@ -28,94 +41,92 @@ public:
         return wordID % NUM_BARRELS;
     }
 
-    std::vector<std::string> getDocumentIDs(int wordID) {
-        int barrelIndex = calculateBarrelIndex(wordID);
-        std::string barrelFile = BARRELS_DIR + "/barrel_" + std::to_string(barrelIndex) + ".csv";
-        
-        std::ifstream file(barrelFile);
-        if (!file.is_open()) {
-            throw std::runtime_error("Unable to open barrel file: " + barrelFile);
+    // Load (once) the word directory of a binary barrel: word ID -> offset and posting count in barrel_<n>.bin
+    const std::unordered_map<int, DirectoryEntry>& loadDirectory(int barrelIndex) {
+        auto cached = directories.find(barrelIndex);
+        if (cached != directories.end()) {
+            return cached->second;
         }
 
-        std::string line;
-        bool isHeader = true;
+        std::string dirFile = BARRELS_DIR + "/barrel_" + std::to_string(barrelIndex) + ".dir";
+        std::ifstream file(dirFile, std::ios::binary);
+        if (!file.is_open()) {
+            throw std::runtime_error("Unable to open barrel directory: " + dirFile);
+        }
 
-        std::vector<std::string> docIDs;
-        docIDs.clear();  // Vector to store all document IDs found
-        std::vector<std::string> bitArrays;
+        char magic[4];
+        uint16_t version = 0;
+        uint32_t entries = 0;
+        file.read(magic, sizeof(magic));
+        file.read(reinterpret_cast<char*>(&version), sizeof(version));
+        file.read(reinterpret_cast<char*>(&entries), sizeof(entries));
+        if (!file || std::string(magic, sizeof(magic)) != "BRLD" || version != 1) {
+            throw std::runtime_error("Unsupported barrel directory format: " + dirFile +
+                                     " (only fixed barrels are read, rebuild them with python barrel.py --codec fixed)");
+        }
 
-        while (std::getline(file, line)) {
-            if (isHeader) {  // Skip the first line (header)
-                isHeader = false;
-                continue;
-            }
-
-            auto tokens = split(line, ',');
-            if (tokens.size() == 2) {
-                int id = std::stoi(tokens[0]);  // Word ID is in the first column
-                if (id == wordID) {
-                    std::string docInfo = tokens[1];
-
-                    // Split the docInfo by spaces to get individual "a:b" pairs
-                    auto docPairs = split(docInfo, ' ');
-
-                    // Loop over each "a:b" pair
-                    for (const auto& pair : docPairs) {
-                        // Split each pair by colon and get the part before the colon
-                        auto docToken = split(pair, ':');
-                        if (!docToken.empty()) {
-                            docIDs.push_back(docToken[0]);
-                            bitArrays.push_back(docToken[1]);
-                        }
-                    }
-                }
-            }
+        std::unordered_map<int, DirectoryEntry>& directory = directories[barrelIndex];
+        directory.reserve(entries);
+        for (uint32_t i = 0; i < entries; ++i) {
+            uint32_t id = 0;
+            DirectoryEntry entry;
+            file.read(reinterpret_cast<char*>(&id), sizeof(id));
+            file.read(reinterpret_cast<char*>(&entry.offset), sizeof(entry.offset));
+            file.read(reinterpret_cast<char*>(&entry.count), sizeof(entry.count));
+            directory[static_cast<int>(id)] = entry;
         }
 
         file.close();
-
-        return docIDs;  // Return the vector containing all document IDs
+        return directory;
     }
 
-    std::vector<std::string> getBitArrays(int wordID) {
+    // Fetch all (doc ID, bit array) postings of a word with a single seek and read
+    std::vector<std::pair<int, int>> getPostings(int wordID) {
         int barrelIndex = calculateBarrelIndex(wordID);
-        std::string barrelFile = BARRELS_DIR + "/barrel_" + std::to_string(barrelIndex) + ".csv";
-        
-        std::ifstream file(barrelFile);
+        const auto& directory = loadDirectory(barrelIndex);
+        std::vector<std::pair<int, int>> postings;
+
+        auto it = directory.find(wordID);
+        if (it == directory.end() || it->second.count == 0) {
+            return postings;
+        }
+
+        std::string barrelFile = BARRELS_DIR + "/barrel_" + std::to_string(barrelIndex) + ".bin";
+        std::ifstream file(barrelFile, std::ios::binary);
         if (!file.is_open()) {
             throw std::runtime_error("Unable to open barrel file: " + barrelFile);
         }
 
-        std::string line;
-        bool isHeader = true;
-        std::vector<std::string> bitArrays;  // Vector to store all bit arrays found
-
-        while (std::getline(file, line)) {
-            if (isHeader) {  // Skip the first line (header)
-                isHeader = false;
-                continue;
-            }
-
-            auto tokens = split(line, ',');
-            if (tokens.size() == 2) {
-                int id = std::stoi(tokens[0]);  // Word ID is in the first column
-                if (id == wordID) {
-                    std::string docInfo = tokens[1];
-                    // Split the docInfo by spaces to get individual "a:b" pairs
-                    auto docPairs = split(docInfo, ' ');
-                    // Loop over each "a:b" pair
-                    for (const auto& pair : docPairs) {
-                        auto docToken = split(pair, ':');
-                        if (docToken.size() == 2) {
-                            std::string bitArray = docToken[1];  // Extract the bit array part
-                            bitArrays.push_back(bitArray);  // Add the bit array to the vector
-                        }
-                    }
-                }
-            }
+        std::vector<char> buffer(static_cast<size_t>(it->second.count) * POSTING_SIZE);
+        file.seekg(static_cast<std::streamoff>(it->second.offset));
+        file.read(buffer.data(), buffer.size());
+        file.close();
+
+        postings.reserve(it->second.count);
+        for (size_t i = 0; i < it->second.count; ++i) {
+            uint32_t docID = 0;
+            uint16_t bitArray = 0;
+            std::memcpy(&docID, buffer.data() + i * POSTING_SIZE, sizeof(docID));
+            std::memcpy(&bitArray, buffer.data() + i * POSTING_SIZE + sizeof(docID), sizeof(bitArray));
+            postings.push_back({static_cast<int>(docID), static_cast<int>(bitArray)});
         }
 
-        file.close();
+        return postings;
+    }
+
+    std::vector<std::string> getDocumentIDs(int wordID) {
+        std::vector<std::string> docIDs;
+        for (const auto& posting : getPostings(wordID)) {
+            docIDs.push_back(std::to_string(posting.first));
+        }
+        return docIDs;  // Return the vector containing all document IDs
+    }
+
+    std::vector<std::string> getBitArrays(int wordID) {
+        std::vector<std::string> bitArrays;
+        for (const auto& posting : getPostings(wordID)) {
+            bitArrays.push_back(std::to_string(posting.second));
+        }
         return bitArrays;  // Return the vector containing all bit arrays
     }
 
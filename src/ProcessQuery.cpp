@@ -80,22 +80,12 @@ void handleQuery(const std::string& query, LoadLexicon& lexicon, LoadBarrel& bar
         int wordID = lexicon.getWordID(word);
         if (wordID != -1) {
             queryWordIDs.push_back(wordID);
-            std::vector<std::string> documentIDs = barrel.getDocumentIDs(wordID);
-            std::vector<std::string> bitArrays = barrel.getBitArrays(wordID);
-
-            if (documentIDs.size() != bitArrays.size()) {
-                output["status"] = "error";
-                output["message"] = "Mismatch between document IDs and bit arrays.";
-                response << output.dump();
-                return;
-            }
+            std::vector<std::pair<int, int>> postings = barrel.getPostings(wordID);
 
             std::set<int> docs;
-            for (size_t i = 0; i < documentIDs.size(); ++i) {
-                int docID = std::stoi(documentIDs[i]);
-                int bitArray = std::stoi(bitArrays[i]);
-                ranker.processDocumentData(docID, wordID, bitArray);
-                docs.insert(docID);
+            for (const auto& posting : postings) {
+                ranker.processDocumentData(posting.first, wordID, posting.second);
+                docs.insert(posting.first);
             }
 
             if (firstWord) {
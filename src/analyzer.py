@@ -0,0 +1,84 @@
+import re
+import threading
+from functools import lru_cache
+
+# URLs, anything that is not alphanumeric or whitespace, and runs of whitespace all become one space
+CLEAN_PATTERN = re.compile(r'http[s]?://\S+|[^a-zA-Z0-9\s]+|\s+')
+LEMMA_CACHE_SIZE = 200000
+
+
+class Analyzer:
+    """
+    The clean -> tokenize -> stopword filter -> lemmatize pipeline shared by the lexicon build,
+    uploads and queries. Lemmas are memoized in a bounded LRU cache since natural language
+    vocabularies repeat heavily; the cache is thread-safe and reports its hit rate.
+    """
+
+    def __init__(self, lemma_cache_size=LEMMA_CACHE_SIZE):
+        # NLTK is imported here and not with the module, so processes that never analyze text
+        # (shard workers, the server before its engine loads) do not pay for it
+        from nltk.corpus import stopwords
+        from nltk.tokenize import word_tokenize
+        from nltk.stem import WordNetLemmatizer
+        self.stop_words = frozenset(stopwords.words('english'))
+        self.word_tokenize = word_tokenize
+        self.lemmatizer = WordNetLemmatizer()
+        self.lemmatize = lru_cache(maxsize=lemma_cache_size)(self.lemmatizer.lemmatize)
+        # WordNet and the tokenizer models load on first use; load them now, not on the first query or document
+        self.lemmatizer.lemmatize(self.word_tokenize('loading')[0])
+
+    def clean(self, text):
+        return CLEAN_PATTERN.sub(' ', text).strip()
+
+    def tokenize(self, text):
+        """
+        Return the (word, lemma) pairs of a text with stop words and non-alphabetic tokens removed.
+        """
+        return self.tokenize_many((text,))[0]
+
+    def tokenize_many(self, texts):
+        """
+        Batch version of tokenize: one list of (word, lemma) pairs per text, with the lookups
+        hoisted out of the loop.
+        """
+        stop_words = self.stop_words
+        lemmatize = self.lemmatize
+        word_tokenize = self.word_tokenize
+        clean = CLEAN_PATTERN.sub
+        results = []
+        for text in texts:
+            results.append([
+                (word, lemmatize(word))
+                for word in word_tokenize(clean(' ', text).strip().lower())
+                if word not in stop_words and word.isalpha()
+            ])
+        return results
+
+    def cache_stats(self):
+        info = self.lemmatize.cache_info()
+        lookups = info.hits + info.misses
+        return {
+            "hits": info.hits,
+            "misses": info.misses,
+            "size": info.currsize,
+            "max_size": info.maxsize,
+            "hit_rate": info.hits / lookups if lookups else 0.0,
+        }
+
+    def clear_cache(self):
+        self.lemmatize.cache_clear()
+
+
+_shared_analyzer = None
+_shared_lock = threading.Lock()
+
+
+def get_analyzer():
+    """
+    Return the analyzer shared by everything in this process, so they also share its lemma cache.
+    """
+    global _shared_analyzer
+    with _shared_lock:
+        if _shared_analyzer is None:
+            _shared_analyzer = Analyzer()
+        return _shared_analyzer
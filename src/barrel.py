@@ -1,5 +1,13 @@
+import argparse
 import csv
 from pathlib import Path
+from binary_barrel import FIXED, PACKED, BarrelWriter, barrel_path, parse_doc_info
+
+# The C++ ProcessQuery (LoadBarrel.h) only reads the fixed codec, the Python backend reads both
+parser = argparse.ArgumentParser(description="Split inverted_index.csv into CSV and binary barrels")
+parser.add_argument('--codec', choices=[PACKED, FIXED], default=PACKED,
+                    help="binary barrel codec, fixed for the C++ ProcessQuery")
+args = parser.parse_args()
 
 # Constants
 num_barrels = 50
@@ -50,4 +58,10 @@ for barrel_index, data in barrels.items():
 
     f.close()
 
+# Write the binary barrels used for query time lookups, the CSV barrels above are kept for export/debugging
+for barrel_index, data in barrels.items():
+    with BarrelWriter(barrel_path(barrels_dir, barrel_index), args.codec) as writer:
+        for word_id, doc_info in data:
+            writer.add(word_id, parse_doc_info(doc_info))
+
 print("Barrels have been created and written to files.")
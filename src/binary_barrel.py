@@ -0,0 +1,783 @@
+import copy
+import mmap
+import os
+import struct
+import time
+from bisect import bisect_left
+from itertools import accumulate
+from pathlib import Path
+from bitmaps import BITMAP_MIN_DOCS, RoaringBitmap, encode_bitmap, read_bitmap_directory, write_bitmaps
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Binary barrel layout (little endian), written next to the CSV barrels:
+#   barrel_<n>.bin  the posting lists of every word in the barrel
+#   barrel_<n>.dir  header (magic, version, entry count) followed by one entry per word, sorted by word id
+#
+# Version 1, "fixed" codec, the only one LoadBarrel.h (ProcessQuery.cpp) reads; write it with
+# python barrel.py --codec fixed, every other script writes the packed codec:
+#   .bin  one fixed-width record per posting: doc id (uint32), bit array (uint16)
+#   .dir  word id (uint32), byte offset into .bin (uint64), posting count (uint32)
+#
+# Version 3, "packed" codec (default): each posting list is sorted by doc id, keeps one posting per
+# document (the last one written wins) and is cut into blocks of BLOCK_SIZE postings.
+#   .bin  per word a skip table: block count (uint32), then per block its last doc id (uint32), byte
+#         offset from the start of the word (uint32) and max bit array (uint16); followed by the blocks.
+#         A block is a header (posting count, gap width, bit array width as uint8) then the doc id gaps
+#         and the bit arrays, each packed with the block's width of 1, 2 or 4 bytes. The first gap of a
+#         block is relative to the last doc id of the previous block, so any block decodes on its own.
+#   .dir  word id (uint32), byte offset into .bin (uint64), byte length (uint32), posting count (uint32),
+#         max bit array of the whole list (uint16)
+# A "max bit array" has the title and tag bits of any posting it covers set and the highest frequency,
+# so scoring it gives an upper bound for every posting of the block or list (see max_bit_array).
+# Version 2 was the packed codec without the max bit arrays; barrels in it have to be rebuilt.
+#
+# Version 4, "positions" codec, for the positions/ barrels next to the posting barrels: the same skip
+# tables, blocks and directory as the packed codec (with max bit arrays of 0), but a block holds the
+# word offsets of each document instead of its bit array. A block is a header (document count, gap
+# width, position count width, position width as uint8) then the doc id gaps, the number of positions
+# of each document and all the positions, each document's as gaps from its previous position (the
+# first from 0). Queries only read them to check phrases, so term queries never touch these files.
+#
+# Packed barrels also get a barrel_<n>.bmp with a compressed bitmap of the doc ids of every word in
+# at least BITMAP_MIN_DOCS documents (see bitmaps.py), for intersecting frequent words quickly.
+MAGIC = b'BRLD'
+FIXED = 'fixed'
+PACKED = 'packed'
+POSITIONS = 'positions'
+VERSIONS = {FIXED: 1, PACKED: 3, POSITIONS: 4}
+CODECS = {version: codec for codec, version in VERSIONS.items()}
+BLOCK_SIZE = 128
+POSTING = struct.Struct('<IH')
+DIR_HEADER = struct.Struct('<4sHI')
+DIR_ENTRIES = {FIXED: struct.Struct('<IQI'), PACKED: struct.Struct('<IQIIH'), POSITIONS: struct.Struct('<IQIIH')}
+WORD_ID = struct.Struct('<I')
+SKIP_COUNT = struct.Struct('<I')
+SKIP_ENTRY = struct.Struct('<IIH')
+BLOCK_HEADER = struct.Struct('<BBB')
+POSITION_BLOCK_HEADER = struct.Struct('<BBBB')
+WIDTH_FORMATS = {1: 'B', 2: 'H', 4: 'I'}
+WIDTH_DTYPES = {1: '<u1', 2: '<u2', 4: '<u4'}
+
+
+def barrel_path(barrels_dir, barrel_index):
+    """
+    Return the path stem (without extension) of a binary barrel.
+    """
+    return Path(barrels_dir) / f"barrel_{barrel_index}"
+
+
+def parse_doc_info(doc_info):
+    """
+    Parse a CSV barrel "doc_id:bit_array doc_id:bit_array ..." string into (doc_id, bit_array) tuples.
+    """
+    postings = []
+    for pair in doc_info.split():
+        doc_id, bit_array = pair.split(':')
+        postings.append((int(doc_id), int(bit_array)))
+    return postings
+
+
+def _width(max_value):
+    if max_value < 1 << 8:
+        return 1
+    if max_value < 1 << 16:
+        return 2
+    return 4
+
+
+def max_bit_array(bit_arrays):
+    """
+    Combine bit arrays into one with every title/tag bit that is set in any of them and the highest
+    frequency. Title/tag boosts and the frequency weighting only ever grow, so its score bounds theirs.
+    """
+    flags = 0
+    frequency = 0
+    for bit_array in bit_arrays:
+        flags |= bit_array & ~0xFF
+        frequency = max(frequency, bit_array & 0xFF)
+    return flags | frequency
+
+
+def encode_postings(postings):
+    """
+    Encode a posting list with the packed codec. Returns (data, posting count, max bit array).
+    """
+    by_doc = {}
+    for doc_id, bit_array in postings:
+        by_doc[doc_id] = bit_array
+    doc_ids = sorted(by_doc)
+
+    skips = []
+    blocks = []
+    block_offset = SKIP_COUNT.size + SKIP_ENTRY.size * ((len(doc_ids) + BLOCK_SIZE - 1) // BLOCK_SIZE)
+    previous = 0
+    for start in range(0, len(doc_ids), BLOCK_SIZE):
+        block_docs = doc_ids[start:start + BLOCK_SIZE]
+        gaps = [block_docs[0] - previous] + [b - a for a, b in zip(block_docs, block_docs[1:])]
+        bit_arrays = [by_doc[doc_id] for doc_id in block_docs]
+        gap_width = _width(max(gaps))
+        bits_width = _width(max(bit_arrays))
+        block = (BLOCK_HEADER.pack(len(block_docs), gap_width, bits_width)
+                 + struct.pack(f'<{len(gaps)}{WIDTH_FORMATS[gap_width]}', *gaps)
+                 + struct.pack(f'<{len(bit_arrays)}{WIDTH_FORMATS[bits_width]}', *bit_arrays))
+        skips.append(SKIP_ENTRY.pack(block_docs[-1], block_offset, max_bit_array(bit_arrays)))
+        blocks.append(block)
+        block_offset += len(block)
+        previous = block_docs[-1]
+
+    data = SKIP_COUNT.pack(len(skips)) + b''.join(skips) + b''.join(blocks)
+    return data, len(doc_ids), max_bit_array(by_doc.values())
+
+
+def encode_positions(postings):
+    """
+    Encode (doc_id, positions) pairs with the positions codec. Positions given for the same document
+    more than once (one list per word of a lemma) are merged. Returns (data, document count).
+    """
+    by_doc = {}
+    for doc_id, positions in postings:
+        by_doc.setdefault(doc_id, set()).update(positions)
+    doc_ids = sorted(by_doc)
+
+    skips = []
+    blocks = []
+    block_offset = SKIP_COUNT.size + SKIP_ENTRY.size * ((len(doc_ids) + BLOCK_SIZE - 1) // BLOCK_SIZE)
+    previous = 0
+    for start in range(0, len(doc_ids), BLOCK_SIZE):
+        block_docs = doc_ids[start:start + BLOCK_SIZE]
+        gaps = [block_docs[0] - previous] + [b - a for a, b in zip(block_docs, block_docs[1:])]
+        counts = []
+        deltas = []
+        for doc_id in block_docs:
+            positions = sorted(by_doc[doc_id])
+            counts.append(len(positions))
+            deltas.extend(b - a for a, b in zip([0] + positions, positions))
+        gap_width = _width(max(gaps))
+        count_width = _width(max(counts))
+        position_width = _width(max(deltas, default=0))
+        block = (POSITION_BLOCK_HEADER.pack(len(block_docs), gap_width, count_width, position_width)
+                 + struct.pack(f'<{len(gaps)}{WIDTH_FORMATS[gap_width]}', *gaps)
+                 + struct.pack(f'<{len(counts)}{WIDTH_FORMATS[count_width]}', *counts)
+                 + struct.pack(f'<{len(deltas)}{WIDTH_FORMATS[position_width]}', *deltas))
+        skips.append(SKIP_ENTRY.pack(block_docs[-1], block_offset, 0))
+        blocks.append(block)
+        block_offset += len(block)
+        previous = block_docs[-1]
+
+    data = SKIP_COUNT.pack(len(skips)) + b''.join(skips) + b''.join(blocks)
+    return data, len(doc_ids)
+
+
+def decode_block(data, offset, previous_doc):
+    """
+    Decode one packed block starting at offset. Returns (doc_ids, bit_arrays).
+    """
+    count, gap_width, bits_width = BLOCK_HEADER.unpack_from(data, offset)
+    offset += BLOCK_HEADER.size
+    gaps = struct.unpack_from(f'<{count}{WIDTH_FORMATS[gap_width]}', data, offset)
+    bit_arrays = struct.unpack_from(f'<{count}{WIDTH_FORMATS[bits_width]}', data, offset + count * gap_width)
+    doc_ids = list(accumulate(gaps, initial=previous_doc))
+    del doc_ids[0]
+    return doc_ids, bit_arrays
+
+
+def decode_arrays(data, block_offsets, previous_docs=None):
+    """
+    Decode the packed blocks at block_offsets, in order, into NumPy arrays of int32 doc ids and
+    uint16 bit arrays. The first gap of a block follows on from the previous block, so one
+    cumulative sum over all the gaps gives the doc ids. When only some blocks of a list are
+    decoded, previous_docs gives the doc id each one follows on from (the last doc id of the block
+    before it in the list, 0 for the first).
+    """
+    gaps = []
+    bit_arrays = []
+    for offset in block_offsets:
+        count, gap_width, bits_width = BLOCK_HEADER.unpack_from(data, offset)
+        offset += BLOCK_HEADER.size
+        gaps.append(np.frombuffer(data, WIDTH_DTYPES[gap_width], count, offset))
+        bit_arrays.append(np.frombuffer(data, WIDTH_DTYPES[bits_width], count, offset + count * gap_width))
+    if not gaps:
+        return np.zeros(0, np.int32), np.zeros(0, np.uint16)
+    if previous_docs is None:
+        doc_ids = np.cumsum(np.concatenate(gaps), dtype=np.int64)
+    else:
+        # make the first gap of every block relative to the end of the block decoded before it
+        starts = np.cumsum([0] + [len(block_gaps) for block_gaps in gaps[:-1]])
+        gaps = np.concatenate(gaps).astype(np.int64)
+        previous_docs = np.asarray(previous_docs, np.int64)
+        block_ends = previous_docs + np.add.reduceat(gaps, starts)
+        gaps[starts[1:]] += previous_docs[1:] - block_ends[:-1]
+        gaps[0] += previous_docs[0]
+        doc_ids = np.cumsum(gaps)
+    return doc_ids.astype(np.int32), np.concatenate(bit_arrays).astype(np.uint16)
+
+
+def decode_position_block(data, offset, previous_doc):
+    """
+    Decode one block of the positions codec starting at offset. Returns (doc_ids, positions), the
+    positions of each document as a tuple of increasing word offsets.
+    """
+    count, gap_width, count_width, position_width = POSITION_BLOCK_HEADER.unpack_from(data, offset)
+    offset += POSITION_BLOCK_HEADER.size
+    gaps = struct.unpack_from(f'<{count}{WIDTH_FORMATS[gap_width]}', data, offset)
+    offset += count * gap_width
+    counts = struct.unpack_from(f'<{count}{WIDTH_FORMATS[count_width]}', data, offset)
+    offset += count * count_width
+    deltas = struct.unpack_from(f'<{sum(counts)}{WIDTH_FORMATS[position_width]}', data, offset)
+    doc_ids = list(accumulate(gaps, initial=previous_doc))
+    del doc_ids[0]
+    positions = []
+    start = 0
+    for position_count in counts:
+        positions.append(tuple(accumulate(deltas[start:start + position_count])))
+        start += position_count
+    return doc_ids, positions
+
+
+def _lookup(list_docs, list_bits, doc_ids):
+    if not len(list_docs):
+        return np.zeros(len(doc_ids), bool), np.zeros(len(doc_ids), np.uint16)
+    index = np.minimum(np.searchsorted(list_docs, doc_ids), len(list_docs) - 1)
+    return list_docs[index] == doc_ids, list_bits[index]
+
+
+class ListCursor:
+    """
+    Forward-only cursor over an in-memory posting list, used for the fixed codec.
+    """
+
+    def __init__(self, postings, bytes_read=0):
+        postings = sorted(postings, key=lambda posting: posting[0])
+        self.count = len(postings)
+        self._docs = [doc_id for doc_id, _ in postings]
+        self._bits = [bit_array for _, bit_array in postings]
+        self._pos = 0
+        self.max_bits = max_bit_array(self._bits)
+        # the whole list is decoded up front
+        self.postings_read = self.count
+        self.bytes_read = bytes_read
+        self.decode_seconds = 0.0
+
+    def fork(self):
+        """
+        A new cursor at the start of the same list, sharing its decoded postings.
+        """
+        fork = copy.copy(self)
+        fork._pos = 0
+        fork.postings_read = 0
+        fork.bytes_read = 0
+        return fork
+
+    def arrays(self):
+        """
+        The whole list as NumPy arrays of int32 doc ids and uint16 bit arrays.
+        """
+        return np.array(self._docs, np.int32), np.array(self._bits, np.uint16)
+
+    def lookup(self, doc_ids):
+        """
+        Find a sorted NumPy array of doc ids in the list: returns a mask of the ones found and
+        their bit arrays (meaningless where not found).
+        """
+        return _lookup(*self.arrays(), doc_ids)
+
+    def doc_bitmap(self):
+        return None
+
+    @property
+    def last_doc(self):
+        return self._docs[-1] if self._docs else -1
+
+    def block_bound(self, doc_id):
+        """
+        The whole list is one block: returns (last doc id, max bit array) if a posting >= doc_id is left, else None.
+        """
+        if not self._docs or self._docs[-1] < doc_id:
+            return None
+        return self._docs[-1], self.max_bits
+
+    def next_geq(self, doc_id):
+        """
+        Advance to the first posting with a doc id >= doc_id and return it as (doc_id, bit_array), or None.
+        """
+        self._pos = bisect_left(self._docs, doc_id, self._pos)
+        if self._pos == len(self._docs):
+            return None
+        return self._docs[self._pos], self._bits[self._pos]
+
+    def __iter__(self):
+        return zip(self._docs, self._bits)
+
+
+class PostingCursor:
+    """
+    Forward-only cursor over one packed posting list. next_geq() finds the target block through
+    the skip table, so blocks that end before the target are never decoded. It counts the
+    postings and bytes it decodes and the time that took, for the query metrics.
+    """
+
+    decode = staticmethod(decode_block)
+
+    def __init__(self, data, offset, count, max_bits, length=None):
+        self.data = data
+        self.count = count
+        self.max_bits = max_bits
+        num_blocks = SKIP_COUNT.unpack_from(data, offset)[0]
+        self.end = offset + length if length is not None else None
+        self.postings_read = 0
+        self.bytes_read = SKIP_COUNT.size + num_blocks * SKIP_ENTRY.size
+        self.decode_seconds = 0.0
+        skips = SKIP_ENTRY.iter_unpack(data[offset + SKIP_COUNT.size:offset + SKIP_COUNT.size + num_blocks * SKIP_ENTRY.size])
+        self.last_docs = []
+        self.block_offsets = []
+        self.block_max_bits = []
+        for last_doc, block_offset, block_max in skips:
+            self.last_docs.append(last_doc)
+            self.block_offsets.append(offset + block_offset)
+            self.block_max_bits.append(block_max)
+        self._block = -1
+        self._docs = []
+        self._bits = ()
+        self._pos = 0
+        self._cache = None  # block -> decoded block, shared with the forks of this cursor
+        self.bitmap_loader = None  # set by BarrelReader for words with a bitmap
+
+    def fork(self):
+        """
+        A new cursor at the start of the same list. A block decoded by any fork is kept and reused
+        by all of them, so queries that read the same list decode each of its blocks once.
+        """
+        if self._cache is None:
+            self._cache = {}
+        fork = copy.copy(self)
+        fork._block = -1
+        fork._docs = []
+        fork._bits = ()
+        fork._pos = 0
+        fork.postings_read = 0
+        fork.bytes_read = 0
+        fork.decode_seconds = 0.0
+        return fork
+
+    def arrays(self):
+        """
+        Decode the whole list at once into NumPy arrays of int32 doc ids and uint16 bit arrays, for
+        scoring every posting with array operations instead of one at a time. Forks share the arrays.
+        """
+        decoded = self._cache.get('arrays') if self._cache is not None else None
+        if decoded is None:
+            started = time.perf_counter()
+            decoded = decode_arrays(self.data, self.block_offsets)
+            if self._cache is not None:
+                self._cache['arrays'] = decoded
+            self.decode_seconds += time.perf_counter() - started
+            self.postings_read += self.count
+            if self.end is not None and self.block_offsets:
+                self.bytes_read += self.end - self.block_offsets[0]
+        return decoded
+
+    def lookup(self, doc_ids):
+        """
+        Find a sorted NumPy array of doc ids in the list, decoding only the blocks that could hold
+        them, as found through the skip table. Returns a mask of the ones found and their bit arrays
+        (meaningless where not found).
+        """
+        started = time.perf_counter()
+        blocks = np.searchsorted(np.array(self.last_docs, np.int64), doc_ids)
+        blocks = np.unique(blocks[blocks < len(self.last_docs)]).tolist()
+        decoded = decode_arrays(self.data, [self.block_offsets[block] for block in blocks],
+                                [self.last_docs[block - 1] if block else 0 for block in blocks])
+        self.decode_seconds += time.perf_counter() - started
+        self.postings_read += len(decoded[0])
+        if self.end is not None:
+            for block in blocks:
+                block_end = self.block_offsets[block + 1] if block + 1 < len(self.block_offsets) else self.end
+                self.bytes_read += block_end - self.block_offsets[block]
+        return _lookup(*decoded, doc_ids)
+
+    def doc_bitmap(self):
+        """
+        The doc ids of the list as a RoaringBitmap, if the barrel stores one for the word; else None.
+        Forks share the bitmap once it is loaded.
+        """
+        if self.bitmap_loader is None:
+            return None
+        bitmap = self._cache.get('bitmap') if self._cache is not None else None
+        if bitmap is None:
+            bitmap = self.bitmap_loader()
+            if self._cache is not None:
+                self._cache['bitmap'] = bitmap
+        return bitmap
+
+    @property
+    def last_doc(self):
+        return self.last_docs[-1] if self.last_docs else -1
+
+    def _load(self, block):
+        decoded = self._cache.get(block) if self._cache is not None else None
+        if decoded is None:
+            started = time.perf_counter()
+            previous = self.last_docs[block - 1] if block else 0
+            decoded = self.decode(self.data, self.block_offsets[block], previous)
+            if self._cache is not None:
+                self._cache[block] = decoded
+            self.decode_seconds += time.perf_counter() - started
+            self.postings_read += len(decoded[0])
+            block_end = self.block_offsets[block + 1] if block + 1 < len(self.block_offsets) else self.end
+            if block_end is not None:
+                self.bytes_read += block_end - self.block_offsets[block]
+        self._docs, self._bits = decoded
+        self._block = block
+        self._pos = 0
+
+    def next_geq(self, doc_id):
+        """
+        Advance to the first posting with a doc id >= doc_id and return it as (doc_id, bit_array), or None.
+        """
+        if self._block == len(self.last_docs):
+            return None  # exhausted
+        if self._block == -1 or self._docs[-1] < doc_id:
+            block = bisect_left(self.last_docs, doc_id, max(self._block, 0))
+            if block == len(self.last_docs):
+                self._block = block
+                return None
+            self._load(block)
+        self._pos = bisect_left(self._docs, doc_id, self._pos)
+        return self._docs[self._pos], self._bits[self._pos]
+
+    def block_bound(self, doc_id):
+        """
+        Look up, in the skip table only, the block that would hold doc_id. Returns its (last doc id,
+        max bit array) or None if the list ends before doc_id. Does not move the cursor.
+        """
+        block = bisect_left(self.last_docs, doc_id, max(self._block, 0))
+        if block == len(self.last_docs):
+            return None
+        return self.last_docs[block], self.block_max_bits[block]
+
+    def __iter__(self):
+        previous = 0
+        for block, block_offset in enumerate(self.block_offsets):
+            doc_ids, bit_arrays = self.decode(self.data, block_offset, previous)
+            yield from zip(doc_ids, bit_arrays)
+            previous = self.last_docs[block]
+
+
+class PositionCursor(PostingCursor):
+    """
+    Cursor over the positions of one word: next_geq() returns (doc_id, positions) pairs, the
+    positions as a tuple of word offsets.
+    """
+
+    decode = staticmethod(decode_position_block)
+
+
+class ChainedCursor:
+    """
+    Cursor over several posting lists whose doc ids follow each other, like a barrel and the
+    segments flushed after it.
+    """
+
+    def __init__(self, cursors):
+        self.cursors = [cursor for cursor in cursors if cursor.count]
+        self.count = sum(cursor.count for cursor in self.cursors)
+        self.max_bits = max_bit_array(cursor.max_bits for cursor in self.cursors)
+        self._current = 0
+
+    def fork(self):
+        return ChainedCursor([cursor.fork() for cursor in self.cursors])
+
+    def arrays(self):
+        if len(self.cursors) == 1:
+            return self.cursors[0].arrays()
+        decoded = [cursor.arrays() for cursor in self.cursors]
+        return (np.concatenate([doc_ids for doc_ids, _ in decoded] or [np.zeros(0, np.int32)]),
+                np.concatenate([bit_arrays for _, bit_arrays in decoded] or [np.zeros(0, np.uint16)]))
+
+    def lookup(self, doc_ids):
+        found = np.zeros(len(doc_ids), bool)
+        bit_arrays = np.zeros(len(doc_ids), np.uint16)
+        first = 0
+        for cursor in self.cursors:
+            # the lists follow each other, each one only looks at the doc ids up to its last one
+            last = int(np.searchsorted(doc_ids, cursor.last_doc, side='right'))
+            if last > first:
+                found[first:last], bit_arrays[first:last] = cursor.lookup(doc_ids[first:last])
+            first = last
+        return found, bit_arrays
+
+    def doc_bitmap(self):
+        """
+        The union of the bitmaps of the lists, if any of them has one (the others are added from
+        their postings); else None.
+        """
+        bitmaps = [cursor.doc_bitmap() for cursor in self.cursors]
+        if all(bitmap is None for bitmap in bitmaps):
+            return None
+        union = RoaringBitmap({})
+        for cursor, bitmap in zip(self.cursors, bitmaps):
+            union = union | (bitmap if bitmap is not None else RoaringBitmap.from_array(cursor.arrays()[0]))
+        return union
+
+    @property
+    def postings_read(self):
+        return sum(cursor.postings_read for cursor in self.cursors)
+
+    @property
+    def bytes_read(self):
+        return sum(cursor.bytes_read for cursor in self.cursors)
+
+    @property
+    def decode_seconds(self):
+        return sum(cursor.decode_seconds for cursor in self.cursors)
+
+    def block_bound(self, doc_id):
+        for cursor in self.cursors[self._current:]:
+            bound = cursor.block_bound(doc_id)
+            if bound is not None:
+                return bound
+        return None
+
+    def next_geq(self, doc_id):
+        while self._current < len(self.cursors):
+            posting = self.cursors[self._current].next_geq(doc_id)
+            if posting is not None:
+                return posting
+            self._current += 1
+        return None
+
+    def __iter__(self):
+        for cursor in self.cursors:
+            yield from cursor
+
+
+class BarrelWriter:
+    """
+    Writes one binary barrel. Words are added one at a time with their full posting list;
+    the directory is written when the writer is closed. Both files are written to temporary
+    names and moved into place on close so readers never see a half written barrel.
+    """
+
+    def __init__(self, path_stem, codec=PACKED):
+        if codec not in VERSIONS:
+            raise ValueError(f"Unknown barrel codec: {codec}")
+        self.codec = codec
+        self.path_stem = Path(path_stem)
+        self.bin_path = self.path_stem.with_suffix('.bin')
+        self.dir_path = self.path_stem.with_suffix('.dir')
+        self.bitmap_path = self.path_stem.with_suffix('.bmp')
+        self._bin_tmp = self.bin_path.with_suffix('.bin.tmp')
+        self._dir_tmp = self.dir_path.with_suffix('.dir.tmp')
+        self._file = open(self._bin_tmp, 'wb')
+        self._directory = {}
+        self._bitmaps = {}  # word_id -> encoded bitmap, for the frequent words of a packed barrel
+        self._offset = 0
+
+    def add(self, word_id, postings):
+        """
+        Append the posting list of one word. postings is an iterable of (doc_id, bit_array).
+        """
+        if word_id in self._directory:
+            raise ValueError(f"Word ID {word_id} was already written to {self.path_stem}")
+        if self.codec == PACKED:
+            postings = list(postings)
+            data, count, max_bits = encode_postings(postings)
+            if count >= BITMAP_MIN_DOCS:
+                self._bitmaps[word_id] = encode_bitmap(sorted({doc_id for doc_id, _ in postings}))
+        elif self.codec == POSITIONS:
+            data, count = encode_positions(postings)
+            max_bits = 0
+        else:
+            data = b''.join(POSTING.pack(doc_id, bit_array) for doc_id, bit_array in postings)
+            count = len(data) // POSTING.size
+            max_bits = 0
+        self._file.write(data)
+        self._directory[word_id] = (self._offset, len(data), count, max_bits)
+        self._offset += len(data)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        dir_entry = DIR_ENTRIES[self.codec]
+        with open(self._dir_tmp, 'wb') as f:
+            f.write(DIR_HEADER.pack(MAGIC, VERSIONS[self.codec], len(self._directory)))
+            for word_id in sorted(self._directory):
+                offset, length, count, max_bits = self._directory[word_id]
+                if self.codec != FIXED:
+                    f.write(dir_entry.pack(word_id, offset, length, count, max_bits))
+                else:
+                    f.write(dir_entry.pack(word_id, offset, count))
+        if self._bitmaps:
+            write_bitmaps(self.bitmap_path, self._bitmaps)
+        elif self.bitmap_path.exists():
+            self.bitmap_path.unlink()  # left from an earlier version of the barrel
+        os.replace(self._bin_tmp, self.bin_path)
+        os.replace(self._dir_tmp, self.dir_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            for tmp in (self._bin_tmp, self._dir_tmp):
+                if tmp.exists():
+                    tmp.unlink()
+
+
+class MappedDirectory:
+    """
+    The directory of a barrel read in place from its memory-mapped .dir file, as a read-only
+    mapping of word_id -> (offset, length, posting count, max bit array). Entries are sorted by
+    word id and found by binary search, so opening a barrel does not parse its directory and only
+    the entries of the words looked up are ever decoded.
+    """
+
+    def __init__(self, dir_path):
+        self._file = open(dir_path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.entries = DIR_HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version not in CODECS:
+            self.close()
+            raise ValueError(f"Unsupported barrel directory format: {dir_path}")
+        self.codec = CODECS[version]
+        self._entry = DIR_ENTRIES[self.codec]
+
+    def _word_id(self, index):
+        return WORD_ID.unpack_from(self._map, DIR_HEADER.size + index * self._entry.size)[0]
+
+    def _find(self, word_id):
+        low, high = 0, self.entries
+        while low < high:
+            middle = (low + high) // 2
+            if self._word_id(middle) < word_id:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < self.entries and self._word_id(low) == word_id else None
+
+    def get(self, word_id, default=None):
+        index = self._find(word_id)
+        if index is None:
+            return default
+        entry = self._entry.unpack_from(self._map, DIR_HEADER.size + index * self._entry.size)
+        if self.codec != FIXED:
+            return entry[1:]
+        _, offset, count = entry
+        return offset, count * POSTING.size, count, None
+
+    def __contains__(self, word_id):
+        return self._find(word_id) is not None
+
+    def __len__(self):
+        return self.entries
+
+    def __iter__(self):
+        for index in range(self.entries):
+            yield self._word_id(index)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+class BarrelReader:
+    """
+    Read-only view of one binary barrel in any codec. The directory and the posting file are both
+    memory-mapped, so opening a barrel reads nothing and fetching a word's postings only touches
+    its own bytes.
+    """
+
+    def __init__(self, path_stem):
+        self.path_stem = Path(path_stem)
+        self.directory = MappedDirectory(self.path_stem.with_suffix('.dir'))
+        self.codec = self.directory.codec
+        self._file = open(self.path_stem.with_suffix('.bin'), 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        # mmap refuses zero-length files, an empty barrel simply has no postings
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._bitmap_file = None
+        self._bitmap_map = None
+        self.bitmaps = {}  # word_id -> (offset, length) in the .bmp file
+        bitmap_path = self.path_stem.with_suffix('.bmp')
+        if np is not None and bitmap_path.exists():
+            self._bitmap_file = open(bitmap_path, 'rb')
+            self._bitmap_map = mmap.mmap(self._bitmap_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.bitmaps = read_bitmap_directory(self._bitmap_map)
+
+    def word_ids(self):
+        return list(self.directory)
+
+    def __contains__(self, word_id):
+        return word_id in self.directory
+
+    def count(self, word_id):
+        """
+        Number of postings of a word, read from the directory without touching the postings.
+        """
+        entry = self.directory.get(word_id)
+        return entry[2] if entry is not None else 0
+
+    def cursor(self, word_id):
+        entry = self.directory.get(word_id)
+        if entry is None or self._map is None:
+            return ListCursor([])
+        offset, length, count, max_bits = entry
+        if self.codec == PACKED:
+            cursor = PostingCursor(self._map, offset, count, max_bits, length)
+            if word_id in self.bitmaps:
+                cursor.bitmap_loader = lambda: self.bitmap(word_id)
+            return cursor
+        if self.codec == POSITIONS:
+            return PositionCursor(self._map, offset, count, max_bits, length)
+        return ListCursor(POSTING.iter_unpack(self._map[offset:offset + length]), length)
+
+    def bitmap(self, word_id):
+        """
+        The doc ids of a word as a RoaringBitmap, or None if the barrel has no bitmap for it.
+        """
+        entry = self.bitmaps.get(word_id)
+        if entry is None or self._bitmap_map is None:
+            return None
+        return RoaringBitmap.from_bytes(self._bitmap_map, entry[0])
+
+    def get_postings(self, word_id):
+        """
+        Return the list of (doc_id, bit_array) tuples for a word, or an empty list. Barrels of the
+        positions codec return (doc_id, positions) tuples.
+        """
+        entry = self.directory.get(word_id)
+        if entry is None or self._map is None:
+            return []
+        offset, length, count, max_bits = entry
+        if self.codec == PACKED:
+            return list(PostingCursor(self._map, offset, count, max_bits))
+        if self.codec == POSITIONS:
+            return list(PositionCursor(self._map, offset, count, max_bits))
+        return list(POSTING.iter_unpack(self._map[offset:offset + length]))
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+        self.directory.close()
+        if self._bitmap_map is not None:
+            self._bitmap_map.close()
+            self._bitmap_map = None
+            self._bitmap_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,225 @@
+import itertools
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Roaring-style compressed bitmaps of the doc ids of frequent words, written by BarrelWriter next
+# to a packed barrel as barrel_<n>.bmp (little endian):
+#   header (magic, version, entry count) followed by one entry per word, sorted by word id:
+#   word id (uint32), byte offset into the file (uint64), byte length (uint32)
+# A bitmap is its container count (uint32), one header per container: the high 16 bits of its doc
+# ids (uint16), its kind (uint8, 0 array or 1 bitmap), a pad byte and its cardinality (uint32);
+# then the containers in the same order. An array container holds the sorted low 16 bits of its
+# doc ids as uint16, a bitmap container 2^16 bits (1024 uint64 words), bit i set for low bits i.
+# A container switches to a bitmap once it holds more than ARRAY_MAX doc ids, where the 8 KB of
+# bits get smaller than the array.
+BITMAP_MAGIC = b'BRLB'
+BITMAP_VERSION = 1
+BITMAP_HEADER = struct.Struct('<4sHI')
+BITMAP_ENTRY = struct.Struct('<IQI')
+CONTAINER_COUNT = struct.Struct('<I')
+CONTAINER_HEADER = struct.Struct('<HBxI')
+ARRAY_CONTAINER = 0
+BITMAP_CONTAINER = 1
+ARRAY_MAX = 4096
+BITMAP_BYTES = 1 << 13
+# Only words in at least this many documents of a barrel get a bitmap, rarer ones are intersected
+# through their sorted posting lists
+BITMAP_MIN_DOCS = 4096
+
+
+def encode_bitmap(doc_ids):
+    """
+    Encode sorted, distinct doc ids as a compressed bitmap. Pure Python, so building an index
+    does not need NumPy.
+    """
+    headers = []
+    containers = []
+    for key, group in itertools.groupby(doc_ids, key=lambda doc_id: doc_id >> 16):
+        lows = [doc_id & 0xFFFF for doc_id in group]
+        if len(lows) > ARRAY_MAX:
+            bits = bytearray(BITMAP_BYTES)
+            for low in lows:
+                bits[low >> 3] |= 1 << (low & 7)
+            headers.append(CONTAINER_HEADER.pack(key, BITMAP_CONTAINER, len(lows)))
+            containers.append(bytes(bits))
+        else:
+            headers.append(CONTAINER_HEADER.pack(key, ARRAY_CONTAINER, len(lows)))
+            containers.append(struct.pack(f'<{len(lows)}H', *lows))
+    return CONTAINER_COUNT.pack(len(headers)) + b''.join(headers) + b''.join(containers)
+
+
+def _cardinality(words):
+    return int(np.unpackbits(words.view(np.uint8)).sum())
+
+
+def _to_bits(lows):
+    words = np.zeros(BITMAP_BYTES // 8, np.uint64)
+    np.bitwise_or.at(words, lows >> 6, np.left_shift(np.uint64(1), (lows & 63).astype(np.uint64)))
+    return words
+
+
+def _bits_to_lows(words):
+    return np.flatnonzero(np.unpackbits(words.view(np.uint8), bitorder='little')).astype(np.uint16)
+
+
+def _compact(container):
+    """
+    Turn a bitmap container that has become sparse back into an array; None if it is empty.
+    """
+    if container.dtype == np.uint64:
+        cardinality = _cardinality(container)
+        if cardinality == 0:
+            return None
+        return _bits_to_lows(container) if cardinality <= ARRAY_MAX else container
+    return container if len(container) else None
+
+
+class RoaringBitmap:
+    """
+    A set of doc ids as containers of their low 16 bits keyed by the high 16 bits, each either a
+    sorted uint16 array (sparse) or 1024 uint64 words of bits (dense). Intersections pick the
+    cheapest method per pair of containers: a word-wise AND of two bitmaps, bit probes of an array
+    against a bitmap, or a sorted merge of two arrays. Needs NumPy.
+    """
+
+    def __init__(self, containers):
+        self.containers = containers  # key -> uint16 array or uint64 bitmap words, keys in increasing order
+
+    @classmethod
+    def from_bytes(cls, data, offset):
+        """
+        Decode an encoded bitmap at offset of data. The containers are copied out, so data can be
+        a memory map that is closed later.
+        """
+        (count,) = CONTAINER_COUNT.unpack_from(data, offset)
+        position = offset + CONTAINER_COUNT.size + count * CONTAINER_HEADER.size
+        containers = {}
+        for key, kind, cardinality in CONTAINER_HEADER.iter_unpack(
+                data[offset + CONTAINER_COUNT.size:offset + CONTAINER_COUNT.size + count * CONTAINER_HEADER.size]):
+            if kind == BITMAP_CONTAINER:
+                containers[key] = np.frombuffer(data, '<u8', BITMAP_BYTES // 8, position).astype(np.uint64)
+                position += BITMAP_BYTES
+            else:
+                containers[key] = np.frombuffer(data, '<u2', cardinality, position).astype(np.uint16)
+                position += 2 * cardinality
+        return cls(containers)
+
+    @classmethod
+    def from_array(cls, doc_ids):
+        """
+        The bitmap of a sorted NumPy array of distinct doc ids.
+        """
+        doc_ids = np.asarray(doc_ids, np.int64)
+        keys = doc_ids >> 16
+        containers = {}
+        if len(doc_ids):
+            starts = np.flatnonzero(np.diff(keys, prepend=-1))
+            for start, end in zip(starts, list(starts[1:]) + [len(doc_ids)]):
+                lows = (doc_ids[start:end] & 0xFFFF).astype(np.uint16)
+                containers[int(keys[start])] = _to_bits(lows) if len(lows) > ARRAY_MAX else lows
+        return cls(containers)
+
+    def __len__(self):
+        return sum(_cardinality(container) if container.dtype == np.uint64 else len(container)
+                   for container in self.containers.values())
+
+    def __and__(self, other):
+        containers = {}
+        for key, mine in self.containers.items():
+            theirs = other.containers.get(key)
+            if theirs is None:
+                continue
+            if mine.dtype == np.uint64 and theirs.dtype == np.uint64:
+                container = _compact(mine & theirs)
+            elif mine.dtype == np.uint64 or theirs.dtype == np.uint64:
+                lows, words = (theirs, mine) if mine.dtype == np.uint64 else (mine, theirs)
+                container = _compact(lows[_probe(words, lows)])
+            else:
+                container = _compact(np.intersect1d(mine, theirs, assume_unique=True))
+            if container is not None:
+                containers[key] = container
+        return RoaringBitmap(containers)
+
+    def __or__(self, other):
+        containers = dict(self.containers)
+        for key, theirs in other.containers.items():
+            mine = containers.get(key)
+            if mine is None:
+                containers[key] = theirs
+                continue
+            words = mine if mine.dtype == np.uint64 else _to_bits(mine)
+            if theirs.dtype == np.uint64:
+                words = words | theirs
+            else:
+                words = words | _to_bits(theirs)
+            containers[key] = _compact(words)
+        return RoaringBitmap(dict(sorted(containers.items())))
+
+    def contains(self, doc_ids):
+        """
+        Boolean mask of which doc ids of a sorted NumPy array are in the bitmap.
+        """
+        doc_ids = np.asarray(doc_ids, np.int64)
+        found = np.zeros(len(doc_ids), bool)
+        keys = doc_ids >> 16
+        starts = np.flatnonzero(np.diff(keys, prepend=-1))
+        for start, end in zip(starts, list(starts[1:]) + [len(doc_ids)]):
+            container = self.containers.get(int(keys[start]))
+            if container is None:
+                continue
+            lows = (doc_ids[start:end] & 0xFFFF).astype(np.uint16)
+            if container.dtype == np.uint64:
+                found[start:end] = _probe(container, lows)
+            else:
+                index = np.minimum(np.searchsorted(container, lows), len(container) - 1)
+                found[start:end] = container[index] == lows
+        return found
+
+    def to_array(self):
+        """
+        The doc ids as a sorted int32 NumPy array.
+        """
+        parts = []
+        for key, container in self.containers.items():
+            lows = _bits_to_lows(container) if container.dtype == np.uint64 else container
+            parts.append(lows.astype(np.int32) + np.int32(key << 16))
+        return np.concatenate(parts) if parts else np.zeros(0, np.int32)
+
+
+def _probe(words, lows):
+    """
+    Boolean mask of which low 16 bits are set in a bitmap container.
+    """
+    lows = lows.astype(np.uint64)
+    return ((words[(lows >> np.uint64(6)).astype(np.intp)] >> (lows & np.uint64(63))) & np.uint64(1)).astype(bool)
+
+
+def write_bitmaps(path, bitmaps):
+    """
+    Write word_id -> encoded bitmap as a bitmap file, through a temporary name.
+    """
+    tmp_path = path.with_suffix(path.suffix + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(BITMAP_HEADER.pack(BITMAP_MAGIC, BITMAP_VERSION, len(bitmaps)))
+        offset = BITMAP_HEADER.size + len(bitmaps) * BITMAP_ENTRY.size
+        for word_id in sorted(bitmaps):
+            f.write(BITMAP_ENTRY.pack(word_id, offset, len(bitmaps[word_id])))
+            offset += len(bitmaps[word_id])
+        for word_id in sorted(bitmaps):
+            f.write(bitmaps[word_id])
+    tmp_path.replace(path)
+
+
+def read_bitmap_directory(data):
+    """
+    word_id -> (offset, length) of the bitmaps in the contents of a bitmap file.
+    """
+    magic, version, entries = BITMAP_HEADER.unpack_from(data, 0)
+    if magic != BITMAP_MAGIC or version != BITMAP_VERSION:
+        raise ValueError("Unsupported bitmap file format")
+    return {word_id: (offset, length) for word_id, offset, length in
+            BITMAP_ENTRY.iter_unpack(data[BITMAP_HEADER.size:BITMAP_HEADER.size + entries * BITMAP_ENTRY.size])}
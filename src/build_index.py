@@ -0,0 +1,261 @@
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from analyzer import get_analyzer
+from bundle import write_manifest
+from compact_lexicon import LEXICON_FILE, write_lexicon
+from doc_store import DocStoreWriter
+from external_index import DEFAULT_MEMORY_MB, PositionSpiller, RunSpiller, write_barrels, write_positions
+from forward_index import format_entry, process_document
+from lexicon import Lexicon, iter_chunks
+from progress import Progress
+from shards import remove_shards, split_index
+from spelling import write_spelling
+from term_stats import STATS_FILE, TermStats
+
+csv.field_size_limit(10**9)
+
+
+class StageTimer:
+    """
+    Accumulates wall time per pipeline stage. Stages run interleaved on a stream of articles,
+    so each stage is timed every time it runs and the totals are reported at the end.
+    """
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + time.perf_counter() - start
+
+    def report(self):
+        total = sum(self.timings.values())
+        for name, seconds in self.timings.items():
+            share = seconds / total if total else 0.0
+            print(f"  {name:<12} {seconds:8.2f}s  {share:6.1%}")
+
+
+def read_articles(data_file):
+    """
+    Stream (doc_id, title, text, url, tags) from data.csv. Doc IDs are row numbers, as in forward_index.py.
+    """
+    with open(data_file, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)  # Skip header row
+        for doc_id, row in enumerate(reader, 1):
+            if len(row) >= 3:
+                yield doc_id, row[0], row[1], row[2], row[5] if len(row) > 5 else ""
+            else:
+                print(f"Skipping line {doc_id} due to insufficient columns.")
+
+
+def analyze_batch(articles):
+    """
+    Tokenize a batch of articles, in the pool workers or inline. The title and text are
+    tokenized separately so the lexicon sees them in the same order as title + '\\n' + text.
+    """
+    analyzer = get_analyzer()
+    titles = analyzer.tokenize_many([article[1] for article in articles])
+    texts = analyzer.tokenize_many([article[2] for article in articles])
+    return [(article, title_tokens + text_tokens) for article, title_tokens, text_tokens in zip(articles, titles, texts)]
+
+
+class IndexBuilder:
+    """
+    One pass from data.csv to a servable index directory: tokenization, lexicon assignment,
+    forward postings, inversion through an external sort and barrel writing run as stages over
+    a single stream of articles, and the document metadata is written in the same pass. With
+    positions, the word positions of every document are sorted in a second external sort and
+    written to the positions barrels. The binary files are listed in a bundle manifest last.
+    """
+
+    def __init__(self, output_dir, num_barrels=50, memory_budget=DEFAULT_MEMORY_MB * 1024 * 1024,
+                 workers=1, batch_size=500, write_intermediate=False, impacts=False, shards=1, positions=False):
+        self.output_dir = Path(output_dir)
+        self.num_barrels = num_barrels
+        self.memory_budget = memory_budget
+        self.workers = workers
+        self.batch_size = batch_size
+        self.write_intermediate = write_intermediate
+        self.impacts = impacts
+        self.shards = shards
+        self.positions = positions
+        self.timer = StageTimer()
+        self.lexicon = Lexicon()
+        self.lexicon_map = {}  # word -> (word_id, lemma_id), in the shape forward_index.process_document expects
+        self.stats = TermStats()
+
+    def _analyzed(self, articles):
+        batches = iter_chunks(articles, self.batch_size)
+        if self.workers > 1:
+            with multiprocessing.Pool(self.workers) as pool:
+                results = pool.imap(analyze_batch, batches)
+                while True:
+                    with self.timer.stage('tokenize'):
+                        batch = next(results, None)
+                    if batch is None:
+                        return
+                    yield from batch
+        else:
+            for articles_batch in batches:
+                with self.timer.stage('tokenize'):
+                    batch = analyze_batch(articles_batch)
+                yield from batch
+
+    def _update_lexicon(self, tokens):
+        self.lexicon.process_tokens(tokens)
+        word_ids = self.lexicon.wordID
+        word_to_lemma = self.lexicon.wordToLemmaID
+        for word, _ in tokens:
+            if word not in self.lexicon_map:
+                word_id = word_ids[word]
+                self.lexicon_map[word] = (word_id, word_to_lemma[word_id])
+
+    def build(self, data_file, total_articles=None):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        barrels_dir = self.output_dir / 'barrels'
+        progress = Progress(total_articles)
+        last_doc_id = 0
+
+        with tempfile.TemporaryDirectory(prefix='build_runs_', dir=self.output_dir) as run_dir, \
+                open(self.output_dir / 'newdata.csv', 'w', encoding='utf-8', newline='') as metadata_file, \
+                DocStoreWriter(self.output_dir) as doc_store:
+            spiller = RunSpiller(run_dir, self.memory_budget)
+            position_spiller = PositionSpiller(run_dir, self.memory_budget) if self.positions else None
+            metadata = csv.writer(metadata_file)
+            metadata.writerow(['document_id', 'title', 'url', 'tags'])
+            forward_file = None
+            if self.write_intermediate:
+                forward_file = open(self.output_dir / 'forward_index.csv', 'w', encoding='utf-8', newline='')
+                forward_writer = csv.writer(forward_file)
+                forward_writer.writerow(['document_id', 'word_metadata'])
+
+            try:
+                for (doc_id, title, text, url, tags), tokens in self._analyzed(read_articles(data_file)):
+                    with self.timer.stage('lexicon'):
+                        self._update_lexicon(tokens)
+                    with self.timer.stage('forward'):
+                        word_info = process_document([title, text, tags], self.lexicon_map, positions=self.positions)
+                        if forward_file is not None:
+                            forward_writer.writerow([doc_id, ' '.join(format_entry(info) for info in word_info)])
+                    with self.timer.stage('invert'):
+                        for info in word_info:
+                            spiller.add(info[1], doc_id, info[2])
+                            if position_spiller is not None:
+                                position_spiller.add(info[1], doc_id, info[3])
+                        self.stats.add_document(doc_id, ((info[1], info[2]) for info in word_info))
+                    with self.timer.stage('metadata'):
+                        metadata.writerow([doc_id, title, url, tags])
+                        doc_store.add(doc_id, title, url, tags)
+                    last_doc_id = doc_id
+                    progress.update()
+            finally:
+                if forward_file is not None:
+                    forward_file.close()
+            progress.done()
+
+            with self.timer.stage('barrels'):
+                records = spiller.merged()
+                if self.write_intermediate:
+                    records = self._tee_inverted_index(records)
+                if self.impacts:
+                    self.stats.set_impact_scale()
+                terms = write_barrels(records, barrels_dir, self.num_barrels,
+                                      self.output_dir / 'impacts' if self.impacts else None, self.stats)
+                spiller.cleanup()
+            # Positions of a previous build no longer match the barrels either
+            shutil.rmtree(self.output_dir / 'positions', ignore_errors=True)
+            if position_spiller is not None:
+                with self.timer.stage('positions'):
+                    write_positions(position_spiller.merged(), self.output_dir / 'positions', self.num_barrels)
+                    position_spiller.cleanup()
+            self.stats.save(self.output_dir / STATS_FILE)
+
+        # Shards of a previous build no longer match the barrels
+        with self.timer.stage('shards'):
+            if self.shards > 1:
+                split_index(self.output_dir, self.shards, self.num_barrels)
+            else:
+                remove_shards(self.output_dir)
+
+        with self.timer.stage('lexicon'):
+            num_words = self.lexicon.save_lexicon(self.output_dir / 'lexicon.csv')
+            doc_frequency = self.stats.doc_frequency
+            write_lexicon(self.output_dir / LEXICON_FILE,
+                          ((word, word_id, lemma_id, doc_frequency.get(lemma_id, 0)) for word, (word_id, lemma_id) in self.lexicon_map.items()))
+        with self.timer.stage('spelling'):
+            write_spelling(self.output_dir)
+        # Uploads continue numbering after the last document of the build
+        with open(self.output_dir / 'doc_id.txt', 'w') as f:
+            f.write(str(last_doc_id))
+        # The binary files are complete, list them so servers can open the index as a prebuilt bundle
+        with self.timer.stage('bundle'):
+            write_manifest(self.output_dir)
+
+        summary = {
+            "documents": progress.count,
+            "words": num_words,
+            "terms": terms,
+            "timings": self.timer.timings,
+        }
+        with open(self.output_dir / 'build_timings.json', 'w') as f:
+            json.dump(summary, f, indent=2)
+        print(f"Indexed {progress.count} documents, {num_words} words and {terms} posting lists into {self.output_dir}")
+        self.timer.report()
+        return summary
+
+    def _tee_inverted_index(self, records):
+        """
+        Pass the sorted records through while also writing the debugging inverted_index.csv.
+        """
+        with open(self.output_dir / 'inverted_index.csv', 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['word_id', 'doc_info'])
+            current, postings = None, []
+            for record in records:
+                if record[0] != current:
+                    if postings:
+                        writer.writerow([current, ' '.join(postings)])
+                    current, postings = record[0], []
+                postings.append(f"{record[1]}:{record[2]}")
+                yield record
+            if postings:
+                writer.writerow([current, ' '.join(postings)])
+
+
+def main(argv=None):
+    base_dir = Path(__file__).resolve().parent.parent
+    parser = argparse.ArgumentParser(description="Build the search index from data.csv in one streaming pass")
+    parser.add_argument('--data', default=str(base_dir / 'engine_data' / 'data.csv'))
+    parser.add_argument('--output', default=str(base_dir / 'engine_data'), help="index directory to write")
+    parser.add_argument('--num-barrels', type=int, default=50)
+    parser.add_argument('--memory-mb', type=int, default=DEFAULT_MEMORY_MB, help="postings buffered before spilling a sorted run")
+    parser.add_argument('--workers', type=int, default=1, help="tokenizer processes, 0 = one per core")
+    parser.add_argument('--batch-size', type=int, default=500, help="articles per tokenizer batch")
+    parser.add_argument('--total', type=int, default=None, help="expected number of articles, for the progress ETA")
+    parser.add_argument('--write-intermediate', action='store_true', help="also write forward_index.csv and inverted_index.csv for debugging")
+    parser.add_argument('--impacts', action='store_true', help="also write quantized BM25 impact barrels")
+    parser.add_argument('--shards', type=int, default=1, help="also split the index into this many document shards, searched in parallel")
+    parser.add_argument('--positions', action='store_true', help="also store word positions, for phrase and proximity queries")
+    args = parser.parse_args(argv)
+
+    builder = IndexBuilder(args.output, args.num_barrels, args.memory_mb * 1024 * 1024,
+                           args.workers or os.cpu_count(), args.batch_size, args.write_intermediate, args.impacts, args.shards,
+                           args.positions)
+    builder.build(args.data, args.total)
+
+
+if __name__ == "__main__":
+    main()
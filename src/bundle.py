@@ -0,0 +1,145 @@
+import argparse
+import json
+import os
+import time
+import zlib
+from pathlib import Path
+from term_stats import STATS_FILE, TermStats
+
+# A prebuilt index bundle is the set of binary files a query server opens without parsing anything:
+# it memory-maps the lexicon and its spelling index, the document store and the barrels with their
+# directories, and only reads the header and term table of the statistics. The build lists them in
+# manifest.json:
+#   version   bundle format version
+#   created   when the manifest was written
+#   documents, barrels, shards   what the index holds, for a quick look without opening it
+#   files     relative path -> {"size": bytes, "crc32": hex CRC-32 of the contents}
+# Servers check the sizes before loading a snapshot, which catches a bundle copied or written only
+# partly; the checksums are verified on demand (bundle.py --verify, or VERIFY_INDEX=1 for the backend).
+MANIFEST_FILE = 'manifest.json'
+BUNDLE_VERSION = 1
+# What belongs to the bundle in an index directory; the CSV files and the segments of uploads do not
+BUNDLE_ENTRIES = ('lexicon.bin', 'spelling.bin', STATS_FILE, 'docs.bin', 'docs.idx', 'barrels', 'impacts', 'positions', 'shards')
+REQUIRED_ENTRIES = ('lexicon.bin', STATS_FILE, 'docs.bin', 'docs.idx', 'barrels')
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_checksum(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+    return f"{crc:08x}"
+
+
+def bundle_files(index_dir):
+    """
+    Relative paths of the files of the bundle in an index directory, sorted.
+    """
+    index_dir = Path(index_dir)
+    paths = []
+    for name in BUNDLE_ENTRIES:
+        entry = index_dir / name
+        if entry.is_dir():
+            paths.extend(path for path in entry.rglob('*') if path.is_file() and not path.name.endswith('.tmp'))
+        elif entry.is_file():
+            paths.append(entry)
+    return sorted(path.relative_to(index_dir).as_posix() for path in paths)
+
+
+def write_manifest(index_dir):
+    """
+    List the bundle files of an index with their sizes and checksums in its manifest.json,
+    written under a temporary name. Returns the manifest.
+    """
+    index_dir = Path(index_dir)
+    missing = [name for name in REQUIRED_ENTRIES if not (index_dir / name).exists()]
+    if missing:
+        raise ValueError(f"{index_dir} has no {', '.join(missing)}: rebuild it with build_index.py")
+    shards_dir = index_dir / 'shards'
+    files = {}
+    for name in bundle_files(index_dir):
+        files[name] = {"size": (index_dir / name).stat().st_size, "crc32": file_checksum(index_dir / name)}
+    manifest = {
+        "version": BUNDLE_VERSION,
+        "created": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "documents": TermStats.load(index_dir / STATS_FILE, doc_lengths=False).num_docs,
+        "barrels": sum(1 for name in files if name.startswith('barrels/') and name.endswith('.dir')),
+        "shards": sum(1 for path in shards_dir.iterdir() if path.is_dir()) if shards_dir.is_dir() else 0,
+        "files": files,
+    }
+    tmp_path = index_dir / f"{MANIFEST_FILE}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, index_dir / MANIFEST_FILE)
+    return manifest
+
+
+def refresh_manifest(index_dir):
+    """
+    Rewrite the manifest of an index built as a bundle, after its files were changed in place
+    (compaction, resharding, a rewritten lexicon or document store). Indexes without one are left as they are.
+    """
+    if (Path(index_dir) / MANIFEST_FILE).exists():
+        write_manifest(index_dir)
+
+
+def read_manifest(index_dir):
+    """
+    The manifest of an index directory, or None if it was not built as a bundle.
+    """
+    try:
+        with open(Path(index_dir) / MANIFEST_FILE, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    if manifest.get("version") != BUNDLE_VERSION:
+        raise ValueError(f"Unsupported index bundle version in {index_dir}")
+    return manifest
+
+
+def verify_bundle(index_dir, checksums=False):
+    """
+    Check the files of an index against its manifest: each has to exist with the listed size, and
+    with checksums also the listed CRC-32. Returns the problems found, empty if the bundle is intact
+    or the index has no manifest.
+    """
+    index_dir = Path(index_dir)
+    manifest = read_manifest(index_dir)
+    if manifest is None:
+        return []
+    problems = []
+    for name, expected in manifest["files"].items():
+        path = index_dir / name
+        if not path.is_file():
+            problems.append(f"{name} is missing")
+        elif path.stat().st_size != expected["size"]:
+            problems.append(f"{name} has {path.stat().st_size} bytes instead of {expected['size']}")
+        elif checksums and file_checksum(path) != expected["crc32"]:
+            problems.append(f"{name} does not match its checksum")
+    return problems
+
+
+def main(argv=None):
+    base_dir = Path(__file__).resolve().parent.parent
+    parser = argparse.ArgumentParser(description="Write or verify the manifest of a prebuilt index bundle")
+    parser.add_argument('--index', default=str(base_dir / 'engine_data'), help="index directory")
+    parser.add_argument('--verify', action='store_true', help="check the files against the manifest instead of writing it")
+    args = parser.parse_args(argv)
+    if args.verify:
+        problems = verify_bundle(args.index, checksums=True)
+        for problem in problems:
+            print(problem)
+        print(f"{len(problems)} problems found in {args.index}")
+        if problems:
+            raise SystemExit(1)
+        return
+    manifest = write_manifest(args.index)
+    print(f"Wrote the manifest of {len(manifest['files'])} files to {Path(args.index) / MANIFEST_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+import argparse
+import csv
+import heapq
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from bundle import refresh_manifest
+from term_stats import STATS_FILE, TermStats
+
+# lexicon.bin, the read-only lexicon the services map (little endian):
+#   header   magic, version, word count n, size of the word blob (uint32 each)
+#   arrays   n + 1 word offsets into the blob, then n word ids, n lemma ids and n document
+#            frequencies (uint32 each), all in word order
+#   blob     the UTF-8 bytes of every word, sorted bytewise, without separators
+# Words sharing a prefix are adjacent, so prefix searches are a range of the arrays. The document
+# frequency is the one of the word's lemma at build time, used to rank completions.
+LEXICON_FILE = 'lexicon.bin'
+LEXICON_MAGIC = b'LEXC'
+LEXICON_VERSION = 1
+LEXICON_HEADER = struct.Struct('<4sIII')
+# Prefixes matching more words than this are ranked once and their completions remembered
+SCAN_LIMIT = 2000
+
+
+def encode_lexicon(entries):
+    """
+    Encode (word, word_id, lemma_id, doc_frequency) entries into the lexicon.bin layout.
+    """
+    entries = sorted((word.encode('utf-8'), word_id, lemma_id, frequency) for word, word_id, lemma_id, frequency in entries)
+    offsets = array('I', [0])
+    word_ids = array('I')
+    lemma_ids = array('I')
+    frequencies = array('I')
+    for word, word_id, lemma_id, frequency in entries:
+        offsets.append(offsets[-1] + len(word))
+        word_ids.append(word_id)
+        lemma_ids.append(lemma_id)
+        frequencies.append(frequency)
+    parts = [offsets, word_ids, lemma_ids, frequencies]
+    if sys.byteorder != 'little':
+        for part in parts:
+            part.byteswap()
+    blob = b''.join(word for word, _, _, _ in entries)
+    header = LEXICON_HEADER.pack(LEXICON_MAGIC, LEXICON_VERSION, len(entries), len(blob))
+    return header + b''.join(part.tobytes() for part in parts) + blob
+
+
+def write_lexicon(path, entries):
+    path = Path(path)
+    tmp_path = path.with_suffix('.bin.tmp')
+    with open(tmp_path, 'wb') as f:
+        f.write(encode_lexicon(entries))
+    os.replace(tmp_path, path)
+
+
+def read_lexicon_csv(lexicon_file, doc_frequency=None):
+    """
+    Yield (word, word_id, lemma_id, doc_frequency) from lexicon.csv; doc_frequency maps lemma ids.
+    """
+    doc_frequency = doc_frequency or {}
+    with open(lexicon_file, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)  # Skip header row
+        for row in reader:
+            if len(row) >= 3:
+                lemma_id = int(row[2])
+                yield row[0], int(row[1]), lemma_id, doc_frequency.get(lemma_id, 0)
+
+
+class CompactLexicon:
+    """
+    Sorted, array-backed lexicon over a lexicon.bin buffer, memory-mapped from disk or built in
+    memory. Lookups binary search the sorted words, so it costs a few bytes per word instead of a
+    dict entry, and it answers prefix queries. Behaves like a read-only dict of
+    word -> (word_id, lemma_id).
+    """
+
+    def __init__(self, data, source=None):
+        self._data = data
+        self._file = source
+        magic, version, count, blob_size = LEXICON_HEADER.unpack_from(data, 0)
+        if magic != LEXICON_MAGIC or version != LEXICON_VERSION:
+            raise ValueError("Unsupported lexicon format")
+        self.count = count
+        view = memoryview(data)
+        offset = LEXICON_HEADER.size
+        arrays = []
+        for length in (count + 1, count, count, count):
+            arrays.append(self._uint32_array(view[offset:offset + 4 * length]))
+            offset += 4 * length
+        self.offsets, self.word_ids, self.lemma_ids, self.doc_frequencies = arrays
+        self.blob = view[offset:offset + blob_size]
+        self._completions = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _uint32_array(view):
+        if sys.byteorder == 'little':
+            return view.cast('I')
+        values = array('I', view.tobytes())
+        values.byteswap()
+        return values
+
+    @classmethod
+    def open(cls, path):
+        f = open(path, 'rb')
+        return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), f)
+
+    @classmethod
+    def from_csv(cls, lexicon_file, doc_frequency=None):
+        return cls(encode_lexicon(read_lexicon_csv(lexicon_file, doc_frequency)))
+
+    def __len__(self):
+        return self.count
+
+    def word_bytes(self, index):
+        return self.blob[self.offsets[index]:self.offsets[index + 1]].tobytes()
+
+    def word(self, index):
+        return self.word_bytes(index).decode('utf-8')
+
+    def find(self, word):
+        """
+        Index of a word in sort order, or -1 if it is not in the lexicon.
+        """
+        key = word.encode('utf-8')
+        index = bisect_left(range(self.count), key, key=self.word_bytes)
+        if index < self.count and self.word_bytes(index) == key:
+            return index
+        return -1
+
+    def get(self, word, default=None):
+        index = self.find(word)
+        if index < 0:
+            return default
+        return self.word_ids[index], self.lemma_ids[index]
+
+    def __getitem__(self, word):
+        entry = self.get(word)
+        if entry is None:
+            raise KeyError(word)
+        return entry
+
+    def __contains__(self, word):
+        return self.find(word) >= 0
+
+    def __iter__(self):
+        return (self.word(index) for index in range(self.count))
+
+    def prefix_range(self, prefix):
+        """
+        Return (start, end) such that the words in [start, end) are exactly those starting with prefix.
+        """
+        key = prefix.encode('utf-8')
+        start = bisect_left(range(self.count), key, key=self.word_bytes)
+        # 0xff never occurs in UTF-8, so it sorts after every continuation of the prefix
+        end = bisect_left(range(start, self.count), key + b'\xff', key=self.word_bytes) + start
+        return start, end
+
+    def complete(self, prefix, limit=10):
+        """
+        The limit most frequent words starting with prefix as (word, doc_frequency), most frequent
+        first and alphabetical among equals.
+        """
+        start, end = self.prefix_range(prefix)
+        if end - start > SCAN_LIMIT:
+            with self._lock:
+                cached = self._completions.get((prefix, limit))
+            if cached is not None:
+                return cached
+        frequencies = self.doc_frequencies
+        best = heapq.nsmallest(limit, range(start, end), key=lambda index: (-frequencies[index], index))
+        completions = [(self.word(index), frequencies[index]) for index in best]
+        if end - start > SCAN_LIMIT:
+            with self._lock:
+                self._completions[(prefix, limit)] = completions
+        return completions
+
+    def close(self):
+        if self._file is None:
+            return
+        for values in (self.offsets, self.word_ids, self.lemma_ids, self.doc_frequencies, self.blob):
+            if isinstance(values, memoryview):
+                values.release()
+        self._data.close()
+        self._file.close()
+        self._file = None
+
+
+def load_lexicon(index_dir, doc_frequency=None):
+    """
+    Map lexicon.bin if the index has one, otherwise build the same structure in memory from lexicon.csv.
+    """
+    index_dir = Path(index_dir)
+    if (index_dir / LEXICON_FILE).exists():
+        return CompactLexicon.open(index_dir / LEXICON_FILE)
+    return CompactLexicon.from_csv(index_dir / 'lexicon.csv', doc_frequency)
+
+
+def main(argv=None):
+    base_dir = Path(__file__).resolve().parent.parent
+    parser = argparse.ArgumentParser(description="Write lexicon.bin for an index from its lexicon.csv")
+    parser.add_argument('--index', default=str(base_dir / 'engine_data'), help="index directory with lexicon.csv and term_stats.bin")
+    args = parser.parse_args(argv)
+    index_dir = Path(args.index)
+    stats_path = index_dir / STATS_FILE
+    doc_frequency = TermStats.load(stats_path, doc_lengths=False).doc_frequency if stats_path.exists() else None
+    entries = list(read_lexicon_csv(index_dir / 'lexicon.csv', doc_frequency))
+    write_lexicon(index_dir / LEXICON_FILE, entries)
+    # the spelling index points into the lexicon, so it is rebuilt with it (spelling.py imports this module)
+    from spelling import SPELLING_FILE, write_spelling
+    if (index_dir / SPELLING_FILE).exists():
+        write_spelling(index_dir)
+    refresh_manifest(index_dir)
+    print(f"Wrote {len(entries)} words to {index_dir / LEXICON_FILE}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+import argparse
+import csv
+import mmap
+import os
+import struct
+from pathlib import Path
+from bundle import refresh_manifest
+
+csv.field_size_limit(10**9)
+
+# Binary document store, written next to newdata.csv:
+#   docs.bin  packed records: title, url and tags lengths (uint32 each) followed by the UTF-8 bytes of each
+#   docs.idx  header (magic, version, first doc id) followed by one entry per doc id from the first one
+#             on: byte offset into docs.bin (uint64) and record length (uint32), length 0 for a missing doc
+# Uploads write a small store of their own into their segment; compaction writes a new store
+# with the documents of the index followed by those of the segments.
+DOCS_BIN = 'docs.bin'
+DOCS_IDX = 'docs.idx'
+STORE_MAGIC = b'DOCS'
+STORE_VERSION = 1
+STORE_HEADER = struct.Struct('<4sHI')
+INDEX_ENTRY = struct.Struct('<QI')
+RECORD_HEADER = struct.Struct('<III')
+
+
+def encode_record(title, url, tags):
+    fields = [field.encode('utf-8') for field in (title, url, tags)]
+    return RECORD_HEADER.pack(*(len(field) for field in fields)) + b''.join(fields)
+
+
+def decode_record(data):
+    lengths = RECORD_HEADER.unpack_from(data, 0)
+    fields = []
+    offset = RECORD_HEADER.size
+    for length in lengths:
+        fields.append(bytes(data[offset:offset + length]).decode('utf-8'))
+        offset += length
+    return tuple(fields)
+
+
+class DocStoreWriter:
+    """
+    Writes documents to the store in increasing doc id order. The store is written to temporary
+    files and moved into place on close, so readers never see a half written store.
+    """
+
+    def __init__(self, index_dir, first_doc_id=1):
+        index_dir = Path(index_dir)
+        self.bin_path = index_dir / DOCS_BIN
+        self.idx_path = index_dir / DOCS_IDX
+        self.first_doc_id = first_doc_id
+        self.next_doc_id = first_doc_id
+        self._bin_tmp = self.bin_path.with_suffix('.bin.tmp')
+        self._idx_tmp = self.idx_path.with_suffix('.idx.tmp')
+        self._bin = open(self._bin_tmp, 'wb')
+        self._idx = open(self._idx_tmp, 'wb')
+        self._idx.write(STORE_HEADER.pack(STORE_MAGIC, STORE_VERSION, first_doc_id))
+        self._offset = 0
+
+    def add(self, doc_id, title, url, tags):
+        self.add_record(doc_id, encode_record(title, url, tags))
+
+    def add_record(self, doc_id, record):
+        """
+        Add an already encoded record, as returned by DocStore.record().
+        """
+        if doc_id < self.next_doc_id:
+            raise ValueError(f"Document {doc_id} is out of order, expected {self.next_doc_id} or later")
+        # Doc ids skipped by the build (rows with missing columns) get empty entries
+        self._idx.write(INDEX_ENTRY.pack(0, 0) * (doc_id - self.next_doc_id))
+        self._bin.write(record)
+        self._idx.write(INDEX_ENTRY.pack(self._offset, len(record)))
+        self._offset += len(record)
+        self.next_doc_id = doc_id + 1
+
+    def close(self):
+        if self._idx.closed:
+            return
+        self._bin.close()
+        self._idx.close()
+        # The records are in place before the entries pointing at them
+        os.replace(self._bin_tmp, self.bin_path)
+        os.replace(self._idx_tmp, self.idx_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._bin.close()
+            self._idx.close()
+            for tmp in (self._bin_tmp, self._idx_tmp):
+                if tmp.exists():
+                    tmp.unlink()
+
+
+class DocStore:
+    """
+    Read-only, memory-mapped view of the document store. Opening it only maps the two files, and
+    get() decodes a single record, so the cost of startup and of a result page does not depend
+    on the size of the corpus.
+    """
+
+    def __init__(self, index_dir):
+        index_dir = Path(index_dir)
+        self._idx_file = open(index_dir / DOCS_IDX, 'rb')
+        self._bin_file = open(index_dir / DOCS_BIN, 'rb')
+        self._idx = mmap.mmap(self._idx_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.first_doc_id = STORE_HEADER.unpack_from(self._idx, 0)
+        if magic != STORE_MAGIC or version != STORE_VERSION:
+            raise ValueError(f"Unsupported document store format: {index_dir / DOCS_IDX}")
+        self.num_entries = (len(self._idx) - STORE_HEADER.size) // INDEX_ENTRY.size
+        # mmap refuses zero-length files, a store without documents has nothing to map
+        bin_size = os.fstat(self._bin_file.fileno()).st_size
+        self._bin = mmap.mmap(self._bin_file.fileno(), 0, access=mmap.ACCESS_READ) if bin_size else None
+
+    @staticmethod
+    def exists(index_dir):
+        return (Path(index_dir) / DOCS_IDX).exists() and (Path(index_dir) / DOCS_BIN).exists()
+
+    def __len__(self):
+        """
+        Number of doc ids covered by the index, including ids without a document.
+        """
+        return self.num_entries
+
+    def record(self, doc_id):
+        """
+        The encoded record of a document, or None.
+        """
+        slot = doc_id - self.first_doc_id
+        if slot < 0 or slot >= self.num_entries:
+            return None
+        offset, length = INDEX_ENTRY.unpack_from(self._idx, STORE_HEADER.size + slot * INDEX_ENTRY.size)
+        if not length or self._bin is None:
+            return None
+        return self._bin[offset:offset + length]
+
+    def get(self, doc_id, default=None):
+        """
+        Return (title, url, tags) of a document, or default if the store does not have it.
+        """
+        record = self.record(doc_id)
+        if record is None:
+            return default
+        return decode_record(record)
+
+    def doc_ids(self):
+        return (doc_id for doc_id in range(self.first_doc_id, self.first_doc_id + self.num_entries)
+                if self.record(doc_id) is not None)
+
+    def __contains__(self, doc_id):
+        return self.get(doc_id) is not None
+
+    def close(self):
+        for mapped in (self._idx, self._bin):
+            if mapped is not None:
+                mapped.close()
+        self._idx = self._bin = None
+        self._idx_file.close()
+        self._bin_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def merge_stores(index_dir, source_dirs):
+    """
+    Rewrite the store in index_dir with the documents of the stores in source_dirs appended, in order.
+    """
+    index_dir = Path(index_dir)
+    stores = [DocStore(index_dir)] + [DocStore(source) for source in source_dirs]
+    with DocStoreWriter(index_dir, first_doc_id=stores[0].first_doc_id) as writer:
+        # the sources are closed before the new files replace the old ones
+        try:
+            for store in stores:
+                for doc_id in store.doc_ids():
+                    writer.add_record(doc_id, store.record(doc_id))
+        finally:
+            for store in stores:
+                store.close()
+
+
+def build_from_newdata(newdata_file, index_dir):
+    """
+    Write the document store for an existing newdata.csv (document_id, title, url, tags).
+    """
+    count = 0
+    with open(newdata_file, 'r', encoding='utf-8', newline='') as f, DocStoreWriter(index_dir) as writer:
+        reader = csv.reader(f)
+        next(reader)  # Skip header row
+        for row in reader:
+            if len(row) >= 4:
+                writer.add(int(row[0]), row[1], row[2], row[3])
+                count += 1
+    return count
+
+
+def build_from_data(data_file, index_dir):
+    """
+    Write the document store straight from data.csv, numbering rows like forward_index.py.
+    Titles keep their commas, unlike in the newdata.csv written by clean_data.py.
+    """
+    count = 0
+    with open(data_file, 'r', encoding='utf-8', newline='') as f, DocStoreWriter(index_dir) as writer:
+        reader = csv.reader(f)
+        next(reader)  # Skip header row
+        for doc_id, row in enumerate(reader, 1):
+            if len(row) >= 3:
+                writer.add(doc_id, row[0], row[2], row[5] if len(row) > 5 else "")
+                count += 1
+    return count
+
+
+def main(argv=None):
+    base_dir = Path(__file__).resolve().parent.parent
+    parser = argparse.ArgumentParser(description="Write the binary document store of an existing index")
+    parser.add_argument('--data', default=None, help="data.csv to read the documents from")
+    parser.add_argument('--newdata', default=None, help="or an existing newdata.csv")
+    parser.add_argument('--output', default=str(base_dir / 'engine_data'), help="index directory to write")
+    args = parser.parse_args(argv)
+    if args.data:
+        count = build_from_data(args.data, args.output)
+    else:
+        count = build_from_newdata(args.newdata or Path(args.output) / 'newdata.csv', args.output)
+    refresh_manifest(args.output)
+    print(f"Wrote {count} documents to {Path(args.output) / DOCS_BIN}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import argparse
+import csv
+import heapq
+import itertools
+import struct
+import tempfile
+from operator import itemgetter
+from pathlib import Path
+from binary_barrel import POSITIONS, BarrelWriter, barrel_path
+from term_stats import STATS_FILE, TermStats
+
+csv.field_size_limit(10**9)
+
+# Sorted runs hold (term id, doc id, bit array) records
+RUN_RECORD = struct.Struct('<IIH')
+# Position runs hold (term id, doc id, position count) followed by the positions as uint32
+POSITION_RECORD = struct.Struct('<III')
+# Rough size of one buffered (term, doc, bits) tuple in a Python list, used to turn the memory budget into a record count
+RECORD_COST = 120
+POSITION_COST = 36
+READ_BLOCK = 8192 * RUN_RECORD.size
+DEFAULT_MEMORY_MB = 256
+
+by_term_and_doc = itemgetter(0, 1)
+
+
+class RunSpiller:
+    """
+    Buffers postings up to a memory budget, then sorts them by (term, doc) and spills them to a
+    run file. merged() k-way merges all runs back into one sorted stream, so memory use depends
+    on the budget and not on the size of the corpus.
+    """
+
+    def __init__(self, tmp_dir, memory_budget=DEFAULT_MEMORY_MB * 1024 * 1024, prefix='run'):
+        self.tmp_dir = Path(tmp_dir)
+        self.max_records = max(1, memory_budget // RECORD_COST)
+        self.prefix = prefix
+        self.buffer = []
+        self.runs = []
+
+    def add(self, term_id, doc_id, bit_array):
+        self.buffer.append((term_id, doc_id, bit_array))
+        if len(self.buffer) >= self.max_records:
+            self.spill()
+
+    def spill(self):
+        if not self.buffer:
+            return
+        # Stable sort on (term, doc) keeps duplicate postings in input order
+        self.buffer.sort(key=by_term_and_doc)
+        run_path = self.tmp_dir / f"{self.prefix}_{len(self.runs):05d}.bin"
+        with open(run_path, 'wb') as f:
+            self._write_run(f, self.buffer)
+        self.runs.append(run_path)
+        self.buffer = []
+
+    @staticmethod
+    def _write_run(f, records):
+        pack = RUN_RECORD.pack
+        f.write(b''.join(pack(*record) for record in records))
+
+    @staticmethod
+    def _read_run(run_path):
+        with open(run_path, 'rb') as f:
+            while True:
+                block = f.read(READ_BLOCK)
+                if not block:
+                    break
+                yield from RUN_RECORD.iter_unpack(block)
+
+    def merged(self):
+        """
+        Yield every buffered and spilled record in (term, doc) order.
+        """
+        if not self.runs:
+            self.buffer.sort(key=by_term_and_doc)
+            yield from self.buffer
+            return
+        self.spill()
+        yield from heapq.merge(*(self._read_run(run) for run in self.runs), key=by_term_and_doc)
+
+    def cleanup(self):
+        for run in self.runs:
+            if run.exists():
+                run.unlink()
+        self.runs = []
+
+
+class PositionSpiller(RunSpiller):
+    """
+    RunSpiller for (term id, doc id, positions) records. Records vary in size, so the buffer is
+    spilled once the estimated size of its positions reaches the memory budget.
+    """
+
+    def __init__(self, tmp_dir, memory_budget=DEFAULT_MEMORY_MB * 1024 * 1024, prefix='positions'):
+        super().__init__(tmp_dir, memory_budget, prefix)
+        self.memory_budget = memory_budget
+        self.buffered = 0
+
+    def add(self, term_id, doc_id, positions):
+        self.buffer.append((term_id, doc_id, positions))
+        self.buffered += RECORD_COST + POSITION_COST * len(positions)
+        if self.buffered >= self.memory_budget:
+            self.spill()
+
+    def spill(self):
+        super().spill()
+        self.buffered = 0
+
+    @staticmethod
+    def _write_run(f, records):
+        for term_id, doc_id, positions in records:
+            f.write(POSITION_RECORD.pack(term_id, doc_id, len(positions)))
+            f.write(struct.pack(f'<{len(positions)}I', *positions))
+
+    @staticmethod
+    def _read_run(run_path):
+        with open(run_path, 'rb') as f:
+            while True:
+                header = f.read(POSITION_RECORD.size)
+                if not header:
+                    break
+                term_id, doc_id, count = POSITION_RECORD.unpack(header)
+                yield term_id, doc_id, struct.unpack(f'<{count}I', f.read(count * 4))
+
+
+def read_forward_index(forward_index_file):
+    """
+    Stream (lemma_id, doc_id, bit_array) postings from forward_index.csv one row at a time.
+    """
+    with open(forward_index_file, 'r', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)  # Skip header row
+        for row in reader:
+            doc_id = int(row[0])
+            for entry in row[1].split():
+                word_id, lemma_id, bit_array = entry.split(':')[:3]
+                yield int(lemma_id), doc_id, int(bit_array)
+
+
+def read_forward_positions(forward_index_file):
+    """
+    Stream (lemma_id, doc_id, positions) from a forward_index.csv written with positions.
+    Entries without positions are skipped.
+    """
+    with open(forward_index_file, 'r', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)  # Skip header row
+        for row in reader:
+            doc_id = int(row[0])
+            for entry in row[1].split():
+                fields = entry.split(':')
+                if len(fields) > 3:
+                    yield int(fields[1]), doc_id, [int(position) for position in fields[3].split('.')]
+
+
+def write_barrels(records, barrels_dir, num_barrels=50, impacts_dir=None, stats=None):
+    """
+    Write records sorted by term into the binary barrels, one posting list in memory at a time.
+    With impacts_dir and complete statistics, the BM25 impact of every posting is written to a
+    second set of barrels in the same layout. Returns the number of terms written.
+    """
+    barrels_dir = Path(barrels_dir)
+    barrels_dir.mkdir(parents=True, exist_ok=True)
+    writers = [BarrelWriter(barrel_path(barrels_dir, barrel_index)) for barrel_index in range(num_barrels)]
+    impact_writers = []
+    if impacts_dir is not None:
+        Path(impacts_dir).mkdir(parents=True, exist_ok=True)
+        impact_writers = [BarrelWriter(barrel_path(impacts_dir, barrel_index)) for barrel_index in range(num_barrels)]
+    terms = 0
+    try:
+        for term_id, group in itertools.groupby(records, key=itemgetter(0)):
+            postings = [(doc_id, bit_array) for _, doc_id, bit_array in group]
+            writers[term_id % num_barrels].add(term_id, postings)
+            if impact_writers:
+                impact_writers[term_id % num_barrels].add(term_id, stats.impact_postings(term_id, postings))
+            terms += 1
+    finally:
+        for writer in writers + impact_writers:
+            writer.close()
+    return terms
+
+
+def write_positions(records, positions_dir, num_barrels=50):
+    """
+    Write (term id, doc id, positions) records sorted by term into the positions barrels, laid out
+    like the posting barrels. Returns the number of terms written.
+    """
+    positions_dir = Path(positions_dir)
+    positions_dir.mkdir(parents=True, exist_ok=True)
+    writers = [BarrelWriter(barrel_path(positions_dir, barrel_index), POSITIONS) for barrel_index in range(num_barrels)]
+    terms = 0
+    try:
+        for term_id, group in itertools.groupby(records, key=itemgetter(0)):
+            writers[term_id % num_barrels].add(term_id, [(doc_id, positions) for _, doc_id, positions in group])
+            terms += 1
+    finally:
+        for writer in writers:
+            writer.close()
+    return terms
+
+
+def forward_index_stats(forward_index_file):
+    """
+    Collect the term statistics of a forward index; its rows are one document each.
+    """
+    stats = TermStats()
+    for doc_id, postings in itertools.groupby(read_forward_index(forward_index_file), key=itemgetter(1)):
+        stats.add_document(doc_id, ((term_id, bit_array) for term_id, _, bit_array in postings))
+    return stats
+
+
+def build_barrels(forward_index_file, barrels_dir, num_barrels=50, memory_budget=DEFAULT_MEMORY_MB * 1024 * 1024, tmp_dir=None,
+                  impacts=False, positions=False):
+    """
+    Build the binary barrels from the forward index with an external sort under memory_budget bytes.
+    The term statistics are written next to the barrels directory, and with impacts the impact
+    barrels as well. With positions, the positions of a forward index written with them go into the
+    positions barrels, sorted separately.
+    """
+    index_dir = Path(barrels_dir).parent
+    stats = forward_index_stats(forward_index_file)
+    if impacts:
+        stats.set_impact_scale()
+    with tempfile.TemporaryDirectory(prefix='inverted_runs_', dir=tmp_dir) as run_dir:
+        spiller = RunSpiller(run_dir, memory_budget)
+        for term_id, doc_id, bit_array in read_forward_index(forward_index_file):
+            spiller.add(term_id, doc_id, bit_array)
+        try:
+            terms = write_barrels(spiller.merged(), barrels_dir, num_barrels,
+                                  index_dir / 'impacts' if impacts else None, stats)
+            runs = len(spiller.runs) or 1
+        finally:
+            spiller.cleanup()
+        if positions:
+            spiller = PositionSpiller(run_dir, memory_budget)
+            for term_id, doc_id, offsets in read_forward_positions(forward_index_file):
+                spiller.add(term_id, doc_id, offsets)
+            try:
+                write_positions(spiller.merged(), index_dir / 'positions', num_barrels)
+            finally:
+                spiller.cleanup()
+    stats.save(index_dir / STATS_FILE)
+    print(f"Wrote {terms} posting lists to {num_barrels} barrels from {runs} sorted runs.")
+    return terms
+
+
+def main(argv=None):
+    base_dir = Path(__file__).resolve().parent.parent
+    parser = argparse.ArgumentParser(description="Build binary barrels from forward_index.csv with bounded memory")
+    parser.add_argument('--forward-index', default='forward_index.csv')
+    parser.add_argument('--barrels', default=str(base_dir / 'engine_data' / 'barrels'))
+    parser.add_argument('--num-barrels', type=int, default=50)
+    parser.add_argument('--memory-mb', type=int, default=DEFAULT_MEMORY_MB, help="postings buffered in memory before spilling a sorted run")
+    parser.add_argument('--tmp-dir', default=None, help="directory for the sorted runs (default: system temp)")
+    parser.add_argument('--impacts', action='store_true', help="also write quantized BM25 impact barrels")
+    parser.add_argument('--positions', action='store_true', help="also write the positions barrels (forward_index.py --positions)")
+    args = parser.parse_args(argv)
+    build_barrels(args.forward_index, args.barrels, args.num_barrels, args.memory_mb * 1024 * 1024, args.tmp_dir,
+                  args.impacts, args.positions)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import re
 import csv
+import argparse
 
 def load_lexicon(lexicon_file):
     """
@@ -13,9 +14,23 @@ def load_lexicon(lexicon_file):
             lexicon[Word] = (int(Word_ID), int(Lemma_id))  # Store word_id and Lemma_id as a tuple
     return lexicon
 
-def process_document(doc, lexicon, max_frequency=255):
+def word_positions(title, text, lexicon):
+    """
+    Offsets of the lexicon words in the title followed by the text, as word -> [positions]. Every
+    word is counted, so two words with a stop word between them are not adjacent, and the text
+    starts one offset after the end of the title so that no phrase spans both.
+    """
+    words = re.findall(r'\w+', title.lower()) + [None] + re.findall(r'\w+', text.lower())
+    positions = {}
+    for position, word in enumerate(words):
+        if word is not None and word in lexicon:
+            positions.setdefault(word, []).append(position)
+    return positions
+
+def process_document(doc, lexicon, max_frequency=255, positions=False):
     """
     Process a single document to generate the word IDs, lexicon IDs, and their bit arrays.
+    With positions, each entry also gets the word's offsets (see word_positions).
     """
     # Unpack the 6 values in the document (title, text, url, authors, timestamp, tags)
     title, text, tags = doc
@@ -32,6 +47,7 @@ def process_document(doc, lexicon, max_frequency=255):
     for word in text_words:
         if word in lexicon:
             word_frequency[word] = word_frequency.get(word, 0) + 1
+    offsets = word_positions(title, text, lexicon) if positions else None
 
     # Process each word's information
     for word, freq in word_frequency.items():
@@ -50,11 +66,23 @@ def process_document(doc, lexicon, max_frequency=255):
             # 8 bits for frequency (0-255)
             frequency_bits = frequency  # Frequency encoded as an 8-bit number
             bit_array = (title_presence << 9) | (tag_presence << 8) | frequency_bits
-            word_info.append((word_id, Lemma_id, bit_array))
+            if offsets is not None:
+                word_info.append((word_id, Lemma_id, bit_array, offsets[word]))
+            else:
+                word_info.append((word_id, Lemma_id, bit_array))
     
     return word_info
 
-def process_data(data_file, lexicon_file, max_frequency=255):
+def format_entry(info):
+    """
+    One forward index entry: word_id:Lemma_id:bit_array, followed by :position.position... if it has positions.
+    """
+    entry = f"{info[0]}:{info[1]}:{info[2]}"
+    if len(info) > 3:
+        entry += ':' + '.'.join(map(str, info[3]))
+    return entry
+
+def process_data(data_file, lexicon_file, max_frequency=255, positions=False):
     """
     Process the data file to create the forward index.
     Returns data formatted for two-column output.
@@ -73,9 +101,9 @@ def process_data(data_file, lexicon_file, max_frequency=255):
                 tags = row[5] if len(row) > 5 else ""
                 
                 reduced_doc = [title, text, tags]
-                word_info = process_document(reduced_doc, lexicon, max_frequency)
+                word_info = process_document(reduced_doc, lexicon, max_frequency, positions)
                 
-                metadata = [f"{word_id}:{Lemma_id}:{bit_array}" for word_id, Lemma_id, bit_array in word_info]
+                metadata = [format_entry(info) for info in word_info]
                 output_line = str(document_id) + '\t' + ' '.join(metadata)
                 output_data.append(output_line)
             else:
@@ -89,7 +117,7 @@ def save_output(output_file, output_data):
     """
     Save the processed output to a file with 2 columns:
     1. document_id
-    2. word_metadata (comma-separated list of word_id:Lemma_id:bit_array)
+    2. word_metadata (comma-separated list of word_id:Lemma_id:bit_array[:positions])
     """
     with open(output_file, 'w', encoding='utf-8', newline='') as f:
         writer = csv.writer(f)
@@ -109,10 +137,14 @@ def save_output(output_file, output_data):
 
 
 # Example usage:
-data_file = 'data.csv'  # File containing document data (title, text, url, authors, timestamp, tags)
-lexicon_file = 'lexicon.csv'  # File containing lexicon (word, word_id, Lemma_id)
-output_file = 'forward_index.csv'    # File to save the results
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build forward_index.csv from data.csv and lexicon.csv")
+    parser.add_argument('--positions', action='store_true', help="also store the word positions, for phrase queries")
+    args = parser.parse_args()
+    data_file = 'data.csv'  # File containing document data (title, text, url, authors, timestamp, tags)
+    lexicon_file = 'lexicon.csv'  # File containing lexicon (word, word_id, Lemma_id)
+    output_file = 'forward_index.csv'    # File to save the results
 
-# Process the data and save the output
-output_data = process_data(data_file, lexicon_file)
-save_output(output_file, output_data)
\ No newline at end of file
+    # Process the data and save the output
+    output_data = process_data(data_file, lexicon_file, positions=args.positions)
+    save_output(output_file, output_data)
\ No newline at end of file
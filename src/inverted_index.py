@@ -24,7 +24,7 @@ for doc_id, word_metadata in forward_index:
 
     # Step 4: Process each word metadata
     for entry in entries:
-        word_id, lemma_id, bitarray = entry.split(':')
+        word_id, lemma_id, bitarray = entry.split(':')[:3]  # positions, if any, only go into the binary barrels
         
         word_id = int(lemma_id)  # Convert word_id to an integer
 
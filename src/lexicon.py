@@ -1,10 +1,8 @@
-import pandas as pd
-import re
-import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize
-from nltk.stem import WordNetLemmatizer
-import cProfile
+import os
+import argparse
+import multiprocessing
+from analyzer import get_analyzer
+from progress import Progress
 
 class Lexicon:
     """Class to build and manage lexicon mappings and save them to a file."""
@@ -17,25 +15,12 @@ class Lexicon:
         self.lemma_counter = 0
         self.number_lemma_id = number_lemma_id
         
-        # Initialize NLTK resources
-        self.stop_words = set(stopwords.words('english'))
-        self.lemmatizer = WordNetLemmatizer()
+        # Shared analyzer (NLTK tokenizer, stop words and cached lemmatizer)
+        self.analyzer = get_analyzer()
     
     def clean_and_tokenize(self, text):
         """Cleans and tokenizes the text."""
-        # Clean text using regex
-        text = re.sub(r'http[s]?://\S+|[^a-zA-Z0-9\s]+|\s+', ' ', text).strip()
-        
-        # Tokenize using NLTK
-        tokens = word_tokenize(text.lower())
-        
-        # Lemmatize and filter stop words and punctuation
-        tokens = [
-            (word, self.lemmatizer.lemmatize(word))
-            for word in tokens
-            if word not in self.stop_words and word.isalpha()
-        ]
-        return tokens
+        return self.analyzer.tokenize(text)
     
     def process_tokens(self, tokens):
         """Processes tokens to create mappings."""
@@ -65,6 +50,7 @@ class Lexicon:
     
     def build_lexicon(self):
         """Builds a lexicon DataFrame."""
+        import pandas as pd  # only the build needs pandas, not the processes that import this module for Lexicon
         lexicon_data = [
             (word, word_id, self.wordToLemmaID[word_id])
             for word, word_id in self.wordID.items()
@@ -77,32 +63,87 @@ class Lexicon:
         lexicon_df.to_csv(file_path, index=False)
         return len(self.wordID)
 
-def main():
+# Lexicon used by each worker process of the parallel build
+_worker_lexicon = None
+
+def _init_worker():
+    global _worker_lexicon
+    _worker_lexicon = Lexicon()
+
+def tokenize_chunk(contents):
+    """
+    Tokenize a chunk of articles in a worker process. Returns the distinct (word, lemma) pairs
+    in order of first occurrence, which is all process_tokens needs to assign the same IDs as
+    a serial run, and the number of articles in the chunk.
+    """
+    pairs = {}
+    for tokens in _worker_lexicon.analyzer.tokenize_many(contents):
+        for pair in tokens:
+            pairs.setdefault(pair, None)
+    return list(pairs), len(contents)
+
+def iter_chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def build_lexicon_parallel(contents, total_articles, workers, chunk_size=500):
+    """
+    Build the lexicon with a pool of worker processes tokenizing chunks of articles.
+    Chunks are merged in input order, so word IDs and lemma IDs match the serial build.
+    """
+    lexicon = Lexicon()
+    progress = Progress(total_articles)
+    with multiprocessing.Pool(workers, initializer=_init_worker) as pool:
+        for pairs, count in pool.imap(tokenize_chunk, iter_chunks(contents, chunk_size)):
+            lexicon.process_tokens(pairs)
+            progress.update(count)
+    progress.done()
+    return lexicon
+
+def build_lexicon_serial(contents, total_articles):
+    lexicon = Lexicon()
+    progress = Progress(total_articles)
+    for content in contents:
+        tokens = lexicon.clean_and_tokenize(content)
+        lexicon.process_tokens(tokens)
+        progress.update()
+    progress.done()
+    stats = lexicon.analyzer.cache_stats()
+    print(f"Lemma cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.1%} hit rate)")
+    return lexicon
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the lexicon from data.csv")
+    parser.add_argument('--data', default='data.csv', help="articles CSV to read")
+    parser.add_argument('--output', default='lexicon.csv', help="lexicon CSV to write")
+    parser.add_argument('--workers', type=int, default=1, help="worker processes for tokenization, 0 = one per core")
+    parser.add_argument('--chunk-size', type=int, default=500, help="articles per worker task")
+    args = parser.parse_args(argv)
+
     # Load dataset
-    df = pd.read_csv('data.csv', encoding='utf-8')
+    import pandas as pd
+    df = pd.read_csv(args.data, encoding='utf-8')
     df['content'] = df['title'] + '\n' + df['text']
     df['content'] = df['content'].fillna('').astype(str)
-    
-    # Initialize classes
-    lexicon = Lexicon()
 
     # Process the content
     total_articles = len(df)
-    for idx, content in enumerate(df['content']):
-        tokens = lexicon.clean_and_tokenize(content)
-        lexicon.process_tokens(tokens)
-
-        # Print progress every 500 articles
-        if (idx + 1) % 500 == 0:
-            print(f"Processed {idx + 1}/{total_articles} articles.")
+    workers = args.workers or os.cpu_count()
+    if workers > 1:
+        lexicon = build_lexicon_parallel(df['content'], total_articles, workers, args.chunk_size)
+    else:
+        lexicon = build_lexicon_serial(df['content'], total_articles)
 
     # Save lexicon to file
-    num_unique_words = lexicon.save_lexicon('lexicon.csv')
-    print("Lexicon with Word IDs and Lemma IDs saved to lexicon.csv")
+    num_unique_words = lexicon.save_lexicon(args.output)
+    print(f"Lexicon with Word IDs and Lemma IDs saved to {args.output}")
     print(f"Number of unique words: {num_unique_words}")
 
-def profile_main():
-    main()
-
 if __name__ == "__main__":
-    cProfile.run("profile_main()", filename='profile_output.prof')
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,250 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Process-wide latency histograms and counters for the query and ingest paths, rendered in the
+# Prometheus text format by the backend's /metrics. Recording a value is a bisect and a few additions
+# under a lock, so the instrumentation stays on in production.
+# Stages of a query: lexicon (query parsing and lookup), postings (opening the cursors: barrel
+# directories and skip tables), decode (unpacking posting blocks from the mapped barrels, including
+# the page faults that read them), rank (top-k scoring without the decoding, phrase checks included),
+# proximity (the optional proximity reranking), metadata (joining titles, urls and tags); the
+# backend adds cache and serialize.
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+METRIC_PREFIX = 'search_'
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Histogram:
+    """
+    Distribution of observed values over fixed buckets, one series per combination of label values.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.series = {}  # label values -> [count per bucket (the last one is +Inf), sum, count]
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {labels: (list(counts), total, count) for labels, (counts, total, count) in self.series.items()}
+
+    def render(self):
+        lines = []
+        for label_values, (counts, total, count) in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, label_values, [('le', _format_value(bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, label_values)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, label_values)} {count}")
+        return lines
+
+
+class Counter:
+    """
+    Monotonically increasing totals, one per combination of label values.
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, *label_values):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        with self.lock:
+            return self.values.get(label_values, 0)
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return [f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}" for label_values, value in values]
+
+
+class Gauge:
+    """
+    A value read from a callback when the metrics are rendered, like the size of a cache.
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, read):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception:
+            return []
+        return [] if value is None else [f"{self.name} {_format_value(value)}"]
+
+
+class Registry:
+    """
+    The metrics of one process. Asking twice for the same name returns the same metric.
+    """
+
+    def __init__(self, prefix=METRIC_PREFIX):
+        self.prefix = prefix
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def _get(self, cls, name, *args, **kwargs):
+        name = self.prefix + name
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def histogram(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        return self._get(Histogram, name, help_text, labels, buckets)
+
+    def counter(self, name, help_text, labels=()):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, read):
+        # a gauge registered again (a reloaded component) reads from the new callback
+        with self.lock:
+            gauge = self.metrics[self.prefix + name] = Gauge(self.prefix + name, help_text, read)
+        return gauge
+
+    def render(self):
+        with self.lock:
+            metrics = sorted(self.metrics.items())
+        lines = []
+        for name, metric in metrics:
+            lines.append(f"# HELP {name} {metric.help_text}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+QUERY_STAGE_SECONDS = REGISTRY.histogram('query_stage_seconds', "Time spent in each stage of a query", ('stage',))
+QUERY_SECONDS = REGISTRY.histogram('query_seconds', "Total time to answer a query request", ('status',))
+POSTINGS_SCANNED = REGISTRY.counter('postings_scanned_total', "Postings decoded from posting lists by queries")
+BYTES_READ = REGISTRY.counter('posting_bytes_read_total', "Bytes of posting blocks and skip tables read by queries")
+DOCUMENTS_SCORED = REGISTRY.counter('documents_scored_total', "Documents fully scored by queries")
+SLOW_QUERIES = REGISTRY.counter('slow_queries_total', "Queries slower than the slow query threshold")
+INGEST_STAGE_SECONDS = REGISTRY.histogram('ingest_stage_seconds', "Time spent in each stage of indexing an upload", ('stage',))
+INGEST_DOCUMENTS = REGISTRY.counter('ingest_documents_total', "Documents indexed from uploads")
+
+
+class Trace:
+    """
+    The stage timings and counters of one request, kept to explain it if it turns out to be slow.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.counters = {}
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def count(self, name, amount):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def to_dict(self):
+        return {
+            "request": self.name,
+            "total_ms": round(self.elapsed * 1000, 3),
+            "stages_ms": {stage: round(seconds * 1000, 3) for stage, seconds in self.stages.items()},
+            "counters": dict(self.counters),
+        }
+
+
+_local = threading.local()
+
+
+def start_trace(name):
+    trace = Trace(name)
+    _local.trace = trace
+    return trace
+
+
+def end_trace():
+    trace = getattr(_local, 'trace', None)
+    _local.trace = None
+    return trace
+
+
+def current_trace():
+    return getattr(_local, 'trace', None)
+
+
+def record(histogram, stage, seconds):
+    """
+    Record the time of one stage in a histogram and in the trace of the current request, if any.
+    """
+    histogram.observe(seconds, stage)
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.add(stage, seconds)
+
+
+def count(counter, amount, name=None):
+    """
+    Add to a counter and to the same counter in the trace of the current request, if any.
+    """
+    if not amount:
+        return
+    counter.inc(amount)
+    trace = getattr(_local, 'trace', None)
+    if trace is not None:
+        trace.count(name or counter.name[len(METRIC_PREFIX):], amount)
+
+
+@contextmanager
+def span(stage, histogram=QUERY_STAGE_SECONDS):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(histogram, stage, time.perf_counter() - started)
@@ -0,0 +1,39 @@
+import sys
+import time
+
+
+class Progress:
+    """
+    Prints build progress at most once every `interval` seconds with the rate and an ETA,
+    instead of a line every fixed number of items.
+    """
+
+    def __init__(self, total, label='articles', interval=5.0, stream=None):
+        self.total = total
+        self.label = label
+        self.interval = interval
+        self.stream = stream or sys.stdout
+        self.count = 0
+        self.start = time.perf_counter()
+        self._last_report = self.start
+
+    def update(self, n=1):
+        self.count += n
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self._report(now)
+
+    def done(self):
+        self._report(time.perf_counter(), final=True)
+
+    def _report(self, now, final=False):
+        elapsed = now - self.start
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        message = f"Processed {self.count}"
+        if self.total:
+            message += f"/{self.total}"
+        message += f" {self.label} in {elapsed:.1f}s ({rate:.0f}/s)"
+        if not final and self.total and rate > 0:
+            message += f", ETA {(self.total - self.count) / rate:.0f}s"
+        print(message, file=self.stream, flush=True)
@@ -0,0 +1,755 @@
+import csv
+import heapq
+import math
+import multiprocessing
+import os
+import re
+import time
+from itertools import islice
+from pathlib import Path
+from binary_barrel import BarrelReader, ChainedCursor, barrel_path
+from compact_lexicon import load_lexicon
+from doc_store import DocStore
+from metrics import BYTES_READ, DOCUMENTS_SCORED, POSTINGS_SCANNED, QUERY_STAGE_SECONDS, count, record, span
+from segments import list_segments, segment_impacts_path, segment_positions_path, segment_postings_path, segment_stats_path
+from shards import list_shards
+from spelling import load_spelling
+from term_stats import STATS_FILE, load_stats
+from top_k import QueryTerm, TopK, prefers_arrays, top_k_arrays, top_k_conjunctive, top_k_disjunctive
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+csv.field_size_limit(10**7)
+
+
+def load_documents(data_file):
+    """
+    Load the document metadata file (doc_id, title, url, tags) into a dict of doc_id -> (title, url, tags).
+    """
+    documents = {}
+    with open(data_file, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        next(reader)  # Skip header row
+        for row in reader:
+            if len(row) >= 4:
+                try:
+                    documents[int(row[0])] = (row[1], row[2], row[3])
+                except ValueError:
+                    continue
+    return documents
+
+
+class BarrelSet:
+    """
+    All binary barrels of an index plus the segments flushed by uploads, opened once.
+    Lookups only read the memory-mapped files, so one BarrelSet can be shared by any number of threads.
+    segment_path picks the barrel inside each segment directory (postings or impacts).
+    """
+
+    def __init__(self, barrels_dir, num_barrels=50, segment_dirs=(), segment_path=segment_postings_path):
+        self.num_barrels = num_barrels
+        self.readers = {}
+        for barrel_index in range(num_barrels):
+            path_stem = barrel_path(barrels_dir, barrel_index)
+            if path_stem.with_suffix('.dir').exists():
+                self.readers[barrel_index] = BarrelReader(path_stem)
+        self.segments = [BarrelReader(segment_path(segment)) for segment in segment_dirs]
+
+    def get_postings(self, word_id):
+        """
+        Postings of a word from its barrel followed by those of every segment, oldest first.
+        """
+        reader = self.readers.get(word_id % self.num_barrels)
+        postings = reader.get_postings(word_id) if reader is not None else []
+        for segment in self.segments:
+            postings.extend(segment.get_postings(word_id))
+        return postings
+
+    def cursor(self, word_id):
+        """
+        Cursor over the postings of a word in its barrel and every segment, in doc id order.
+        """
+        sources = [self.readers.get(word_id % self.num_barrels)] + self.segments
+        return ChainedCursor([reader.cursor(word_id) for reader in sources if reader is not None])
+
+    def close(self):
+        for reader in list(self.readers.values()) + self.segments:
+            reader.close()
+        self.readers = {}
+        self.segments = []
+
+
+class SharedCursors:
+    """
+    Cursors over a BarrelSet for a batch of queries. Each word is looked up once for the whole
+    batch and every cursor handed out is a fork of that first one, so a block of postings is read
+    and decoded once however many queries of the batch need it.
+    """
+
+    def __init__(self, barrel_set):
+        self.barrel_set = barrel_set
+        self.lists = {}  # word_id -> the cursor every fork is made from
+
+    def cursor(self, word_id):
+        cursor = self.lists.get(word_id)
+        if cursor is None:
+            cursor = self.lists[word_id] = self.barrel_set.cursor(word_id)
+        return cursor.fork()
+
+    def work(self):
+        """
+        The work of the lookups themselves (skip tables read); the forks count their own decoding.
+        """
+        return _cursor_work(self.lists.values())
+
+
+class DocumentSources:
+    """
+    Document metadata of the index followed by the document stores of its segments.
+    """
+
+    def __init__(self, sources):
+        self.sources = sources
+
+    def __len__(self):
+        return sum(len(source) for source in self.sources)
+
+    def get(self, doc_id, default=None):
+        for source in self.sources:
+            metadata = source.get(doc_id)
+            if metadata is not None:
+                return metadata
+        return default
+
+    def close(self):
+        for source in self.sources:
+            if isinstance(source, DocStore):
+                source.close()
+
+
+# A quoted phrase, "words"~N matches its words in any order within N more words than the phrase spans
+PHRASE_PATTERN = re.compile(r'"([^"]*)"(?:~(\d+))?')
+WORD_PATTERN = re.compile(r'\w+')
+# With a proximity weight, this many times k results are ranked, then reordered by term proximity
+PROXIMITY_CANDIDATES = 4
+
+
+def min_window(position_lists):
+    """
+    Length in words of the shortest stretch of text holding a position from every list, or None if
+    a list is empty.
+    """
+    if not position_lists or not all(position_lists):
+        return None
+    heap = [(positions[0], i, 0) for i, positions in enumerate(position_lists)]
+    heapq.heapify(heap)
+    high = max(positions[0] for positions in position_lists)
+    best = None
+    while True:
+        low, i, j = heapq.heappop(heap)
+        window = high - low + 1
+        best = window if best is None else min(best, window)
+        if j + 1 == len(position_lists[i]):
+            return best
+        position = position_lists[i][j + 1]
+        high = max(high, position)
+        heapq.heappush(heap, (position, i, j + 1))
+
+
+class Phrase:
+    """
+    A quoted phrase of a query as (offset, word_id) pairs. Offsets count every word of the phrase,
+    stop words included, like document positions do. Without slop the words have to appear at
+    exactly these distances from each other; with slop, in any order within a window of slop more
+    words than the phrase spans.
+    """
+
+    def __init__(self, terms, slop=None):
+        self.terms = terms
+        self.slop = slop
+        self.word_ids = list(dict.fromkeys(word_id for _, word_id in terms))
+
+    def matches(self, positions):
+        """
+        Whether a document matches, given word_id -> positions of each phrase word in it.
+        """
+        if self.slop is not None:
+            window = min_window([positions[word_id] for word_id in self.word_ids])
+            return window is not None and window <= self.terms[-1][0] - self.terms[0][0] + 1 + self.slop
+        (first_offset, first_word), others = self.terms[0], self.terms[1:]
+        others = [(offset - first_offset, set(positions[word_id])) for offset, word_id in others]
+        return any(all(start + distance in found for distance, found in others) for start in positions[first_word])
+
+
+def _document_positions(cursors, doc_id):
+    """
+    word_id -> positions in doc_id, for every word_id -> position cursor. The cursors only move
+    forward, so documents have to be asked for in increasing doc id order.
+    """
+    positions = {}
+    for word_id, cursor in cursors.items():
+        posting = cursor.next_geq(doc_id)
+        positions[word_id] = posting[1] if posting is not None and posting[0] == doc_id else ()
+    return positions
+
+
+def _cursor_work(cursors, scored=0):
+    return (sum(cursor.postings_read for cursor in cursors), sum(cursor.bytes_read for cursor in cursors),
+            scored, sum(cursor.decode_seconds for cursor in cursors))
+
+
+def _rank_terms(terms, k, match_all, phrases=(), positions=None):
+    """
+    Top k (doc_id, score) pairs of the query terms, with the work it took as (postings decoded,
+    bytes read, documents scored, seconds spent decoding). With phrases, a document only enters
+    the top k if it matches all of them; their positions are read from the positions BarrelSet,
+    only for the documents that score high enough. Long lists without phrases are ranked with
+    NumPy instead (see top_k_arrays).
+    """
+    position_cursors = {}
+    accept = None
+    if phrases:
+        for phrase in phrases:
+            for word_id in phrase.word_ids:
+                if word_id not in position_cursors:
+                    position_cursors[word_id] = positions.cursor(word_id)
+
+        def accept(doc_id):
+            document_positions = _document_positions(position_cursors, doc_id)
+            return all(phrase.matches(document_positions) for phrase in phrases)
+    if not phrases and prefers_arrays(terms, match_all):
+        results, scored = top_k_arrays(terms, k, match_all)
+        return results, _cursor_work([term.cursor for term in terms], scored)
+    top = TopK(k, accept)
+    if match_all:
+        results = top_k_conjunctive(terms, k, top)
+    else:
+        results = top_k_disjunctive(terms, k, top)
+    return results, _cursor_work([term.cursor for term in terms] + list(position_cursors.values()), top.offered)
+
+
+def _proximity_rerank(results, word_ids, positions, weight, k):
+    """
+    Boost every result by how close together the query words are in it, by 1 + weight * (words
+    found / shortest window holding them all), so a document with all of them side by side gets
+    1 + weight. Returns the best k and the work of reading the positions.
+    """
+    cursors = {word_id: positions.cursor(word_id) for word_id in word_ids}
+    boosted = []
+    for doc_id, score in sorted(results):
+        found = [offsets for offsets in _document_positions(cursors, doc_id).values() if offsets]
+        if len(found) > 1:
+            score *= 1 + weight * len(found) / min_window(found)
+        boosted.append((doc_id, score))
+    boosted.sort(key=_best_first)
+    return boosted[:k], _cursor_work(cursors.values())
+
+
+def _count_work(work):
+    postings, bytes_read, scored, _ = work
+    count(POSTINGS_SCANNED, postings)
+    count(BYTES_READ, bytes_read)
+    count(DOCUMENTS_SCORED, scored)
+
+
+class QueryEngine:
+    """
+    In-process replacement for ProcessQuery.exe: lexicon lookup, posting fetch, TF-IDF ranking
+    and the document metadata join. All index structures are loaded in the constructor and only
+    read afterwards, so search() is safe to call from many request threads at once.
+
+    Document frequencies and the collection size come from the term statistics of the index and
+    its segments. If the index was built with impact barrels (and use_impacts is set), queries are
+    scored by summing the precomputed BM25 impacts instead.
+
+    If the index has positions barrels, quoted phrases are checked against the word positions, and
+    with a proximity_weight the results are boosted by how close together the query words are.
+
+    With NumPy installed (and vectorized set), queries over long posting lists decode and score
+    them as arrays instead of one posting at a time.
+
+    If the index has a spelling.bin, query words missing from the lexicon are corrected to the
+    closest lexicon word and the answer names the corrected query.
+    """
+
+    def __init__(self, index_dir, num_barrels=50, total_docs=None, max_results=100, analyzer=None, use_impacts=True,
+                 proximity_weight=0.0, vectorized=True):
+        index_dir = Path(index_dir)
+        self.index_dir = index_dir
+        self.analyzer = analyzer
+        self.max_results = max_results
+        segment_dirs = list_segments(index_dir / 'segments')
+        # The memory-mapped store only decodes the documents of a result page; older indexes load newdata.csv
+        if DocStore.exists(index_dir):
+            documents = DocStore(index_dir)
+        else:
+            documents = load_documents(index_dir / 'newdata.csv')
+        self.documents = DocumentSources([documents] + [DocStore(segment) for segment in segment_dirs if DocStore.exists(segment)])
+        self.barrels = BarrelSet(index_dir / 'barrels', num_barrels, segment_dirs)
+        # Indexes built before statistics were recorded fall back to the posting counts
+        self.stats = load_stats([index_dir / STATS_FILE] + [segment_stats_path(segment) for segment in segment_dirs],
+                                doc_lengths=False)
+        self.lexicon = load_lexicon(index_dir, self.stats.doc_frequency if self.stats else None)
+        self.spelling = load_spelling(index_dir, self.lexicon)
+        self.total_docs = total_docs or (self.stats.num_docs if self.stats else len(self.documents)) or 1
+        self.impacts = None
+        if (use_impacts and self.stats is not None and self.stats.impact_scale and (index_dir / 'impacts').is_dir()
+                and all(segment_impacts_path(segment).with_suffix('.dir').exists() for segment in segment_dirs)):
+            self.impacts = BarrelSet(index_dir / 'impacts', num_barrels, segment_dirs, segment_impacts_path)
+        self.positions = None
+        if ((index_dir / 'positions').is_dir()
+                and all(segment_positions_path(segment).with_suffix('.dir').exists() for segment in segment_dirs)):
+            self.positions = BarrelSet(index_dir / 'positions', num_barrels, segment_dirs, segment_positions_path)
+        self.proximity_weight = proximity_weight
+        self.vectorized = vectorized and np is not None
+
+    @staticmethod
+    def calculate_tf(bit_array):
+        """
+        Term frequency with weightage for title/tag, decoded from the 10-bit array
+        (1 bit title, 1 bit tag, 8 bits frequency).
+        """
+        frequency = bit_array & 0xFF
+        base_tf = 1 + math.log10(frequency) if frequency > 0 else 0
+        if bit_array & (1 << 9):
+            base_tf *= 1.5  # Increased weight if in title
+        elif bit_array & (1 << 8):
+            base_tf *= 1.2  # Increased weight if in tag
+        return base_tf
+
+    def calculate_idf(self, doc_frequency):
+        return math.log10(self.total_docs / max(doc_frequency, 1))
+
+    def document_frequency(self, word_id, cursor):
+        if self.stats is not None:
+            return self.stats.doc_frequency.get(word_id, cursor.count)
+        return cursor.count
+
+    def lookup(self, word, lemma, corrections=None):
+        """
+        The (word_id, lemma_id) of a query word, falling back to its lemma and then to the spelling
+        correction of the word, which is recorded in corrections as word -> corrected word. None if
+        none of them is in the lexicon.
+        """
+        entry = self.lexicon.get(word) or self.lexicon.get(lemma)
+        if entry is None and self.spelling is not None:
+            correction = self.spelling.correct(word)
+            if correction is not None:
+                entry = self.lexicon.get(correction[0])
+                if corrections is not None:
+                    corrections[word] = correction[0]
+        return entry
+
+    def parse_query(self, query, corrections=None):
+        """
+        Split the query into words and return the unique lemma IDs found in the lexicon, in query order.
+        With an analyzer the query is normalized like indexed text, and a word missing from the
+        lexicon falls back to its lemma and then to its spelling correction (see lookup).
+        """
+        if self.analyzer is not None:
+            terms = self.analyzer.tokenize(query)
+        else:
+            terms = [(word, word) for word in query.lower().split()]
+
+        word_ids = []
+        for word, lemma in terms:
+            entry = self.lookup(word, lemma, corrections)
+            if entry is not None and entry[1] not in word_ids:
+                word_ids.append(entry[1])
+        return word_ids
+
+    def parse_phrases(self, query, corrections=None):
+        """
+        The quoted phrases of the query as Phrase objects, looked up like parse_query does. Stop
+        words keep their offset but are not matched. A phrase with a word missing from the lexicon
+        can match no document and is returned as None; phrases of fewer than two words are left out.
+        """
+        phrases = []
+        for match in PHRASE_PATTERN.finditer(query):
+            terms = []
+            for offset, word in enumerate(WORD_PATTERN.findall(match.group(1).lower())):
+                tokens = self.analyzer.tokenize(word) if self.analyzer is not None else [(word, word)]
+                if not tokens:
+                    continue  # stop word
+                word, lemma = tokens[0]
+                entry = self.lookup(word, lemma, corrections)
+                if entry is None:
+                    terms = None
+                    break
+                terms.append((offset, entry[1]))
+            if terms is None:
+                phrases.append(None)
+            elif len(terms) > 1:
+                phrases.append(Phrase(terms, int(match.group(2)) if match.group(2) is not None else None))
+        return phrases
+
+    def suggest(self, prefix, limit=10):
+        """
+        Complete a prefix to the most frequent lexicon words, as (word, doc_frequency) pairs.
+        """
+        prefix = prefix.strip().lower()
+        if not prefix:
+            return []
+        return self.lexicon.complete(prefix, limit)
+
+    def rank_documents(self, query_word_ids, k=None, match_all=True, phrases=()):
+        """
+        Return the top k (doc_id, score) pairs, best first. With match_all only documents containing
+        every query word are ranked (block-max AND), otherwise any of them (MaxScore OR). Both keep
+        a bounded heap and skip documents whose upper bound cannot enter the top k. Documents also
+        have to match every phrase, which needs the positions barrels.
+        """
+        k = k or self.max_results
+        with span('postings'):
+            terms = self._query_terms(query_word_ids, self.barrels, self.impacts)
+        return self._rank(terms, query_word_ids, k, match_all, phrases, self.positions)
+
+    def rank_batch(self, queries, k=None, match_all=True):
+        """
+        rank_documents for a list of (query_word_ids, phrases) queries, returning their results in
+        the same order. The posting lists are looked up once per word for the whole batch and each
+        block is decoded at most once, however many of the queries read it (see SharedCursors).
+        """
+        k = k or self.max_results
+        barrels = SharedCursors(self.barrels)
+        impacts = SharedCursors(self.impacts) if self.impacts is not None else None
+        positions = SharedCursors(self.positions) if self.positions is not None else None
+        results = []
+        for query_word_ids, phrases in queries:
+            with span('postings'):
+                terms = self._query_terms(query_word_ids, barrels, impacts)
+            results.append(self._rank(terms, query_word_ids, k, match_all, phrases, positions))
+        for shared in (barrels, impacts, positions):
+            if shared is not None:
+                _count_work(shared.work())
+        return results
+
+    def _query_terms(self, query_word_ids, barrels, impacts):
+        terms = []
+        for word_id in query_word_ids:
+            if impacts is not None:
+                # Impacts are already weighted scores, the max impact of a list or block is its exact bound
+                terms.append(QueryTerm(impacts.cursor(word_id), 1, int, impact_array if self.vectorized else None))
+            else:
+                cursor = barrels.cursor(word_id)
+                idf = self.calculate_idf(self.document_frequency(word_id, cursor))
+                terms.append(QueryTerm(cursor, idf, self.calculate_tf, tf_array if self.vectorized else None))
+        return terms
+
+    def _rank(self, terms, query_word_ids, k, match_all, phrases, positions):
+        proximity = self._uses_proximity(query_word_ids)
+        started = time.perf_counter()
+        results, work = _rank_terms(terms, k * PROXIMITY_CANDIDATES if proximity else k, match_all, phrases, positions)
+        # blocks are decoded lazily while ranking, their time is reported apart
+        decode_seconds = work[3]
+        record(QUERY_STAGE_SECONDS, 'decode', decode_seconds)
+        record(QUERY_STAGE_SECONDS, 'rank', max(time.perf_counter() - started - decode_seconds, 0.0))
+        _count_work(work)
+        if proximity:
+            results = self._proximity_rerank(results, query_word_ids, k, positions)
+        return results
+
+    def _uses_proximity(self, query_word_ids):
+        return self.proximity_weight > 0 and self.positions is not None and len(query_word_ids) > 1
+
+    def _proximity_rerank(self, results, query_word_ids, k, positions):
+        with span('proximity'):
+            results, work = _proximity_rerank(results, query_word_ids, positions, self.proximity_weight, k)
+        _count_work(work)
+        return results
+
+    def _parse(self, query, output):
+        """
+        The (query_word_ids, phrases) to rank for a query, or None with the answer filled into output
+        if there is nothing to rank.
+        """
+        if not query.split():
+            output["status"] = "error"
+            output["message"] = "Empty query received."
+            return None
+
+        corrections = {}
+        with span('lexicon'):
+            # the words of a phrase are also plain query words, without the quotes and slop
+            query_word_ids = self.parse_query(PHRASE_PATTERN.sub(r' \1 ', query), corrections)
+            phrases = self.parse_phrases(query, corrections)
+        if corrections:
+            output["corrected_query"] = correct_query(query, corrections)
+        if not query_word_ids:
+            output["status"] = "error"
+            output["message"] = "No valid words found in the lexicon."
+            return None
+        if phrases and self.positions is None:
+            output["status"] = "error"
+            output["message"] = "Phrase queries need an index built with --positions."
+            return None
+        if None in phrases:
+            output["status"] = "success"
+            output["results"] = []
+            return None
+        return query_word_ids, phrases
+
+    def search(self, query, match_all=True):
+        """
+        Run a query and return the same structure ProcessQuery.exe used to print as JSON.
+        """
+        output, ranked = self.rank_query(query, self.max_results, match_all)
+        if ranked is not None:
+            self._add_results(output, ranked)
+        return output
+
+    def rank_query(self, query, k=None, match_all=True):
+        """
+        The best k (doc_id, score) pairs of a query, without reading their metadata, for callers that
+        page through them with describe(). Returns (output, ranked); ranked is None if there is
+        nothing to rank, with the answer in output as search() would give it.
+        """
+        output = {"query": query}
+        parsed = self._parse(query, output)
+        if parsed is None:
+            return output, None
+        query_word_ids, phrases = parsed
+        return output, self.rank_documents(query_word_ids, k or self.max_results, match_all, phrases)
+
+    def search_batch(self, queries, match_all=True):
+        """
+        search() for a list of queries, answered in the same order. The queries are ranked together
+        by rank_batch, so the words they share are read once for the batch, and queries that look
+        up the same words and phrases are only ranked once.
+        """
+        outputs = [{"query": query} for query in queries]
+        batch, unique, pending = [], {}, []
+        for output in outputs:
+            parsed = self._parse(output["query"], output)
+            if parsed is None:
+                continue
+            query_word_ids, phrases = parsed
+            key = (tuple(query_word_ids), tuple((tuple(phrase.terms), phrase.slop) for phrase in phrases))
+            if key not in unique:
+                unique[key] = len(batch)
+                batch.append(parsed)
+            pending.append((output, unique[key]))
+        ranked = self.rank_batch(batch, self.max_results, match_all)
+        for output, index in pending:
+            self._add_results(output, ranked[index])
+        return outputs
+
+    def describe(self, ranked):
+        """
+        Join the document metadata to ranked (doc_id, score) pairs, giving the results search() returns.
+        """
+        results = []
+        with span('metadata'):
+            for doc_id, score in ranked:
+                doc = {"doc_id": doc_id, "score": score}
+                metadata = self.documents.get(doc_id)
+                if metadata is not None:
+                    doc["title"], doc["url"], doc["tags"] = metadata
+                results.append(doc)
+        return results
+
+    def _add_results(self, output, ranked):
+        output["status"] = "success"
+        output["results"] = self.describe(ranked)
+
+    def close(self):
+        self.barrels.close()
+        if self.spelling is not None:
+            self.spelling.close()
+        self.lexicon.close()
+        self.documents.close()
+        if self.impacts is not None:
+            self.impacts.close()
+        if self.positions is not None:
+            self.positions.close()
+
+
+def correct_query(query, corrections):
+    """
+    The query with its misspelled words replaced by their corrections, keeping everything else.
+    """
+    return WORD_PATTERN.sub(lambda match: corrections.get(match.group(0).lower(), match.group(0)), query)
+
+
+# calculate_tf of every 10-bit bit array, for tf_array
+TF_TABLE = np.array([QueryEngine.calculate_tf(bit_array) for bit_array in range(1 << 10)]) if np is not None else None
+
+
+def tf_array(bit_arrays):
+    """
+    QueryEngine.calculate_tf of a NumPy array of bit arrays, looked up in TF_TABLE so that every
+    value is exactly the one calculate_tf gives.
+    """
+    return TF_TABLE[bit_arrays]
+
+
+def impact_array(impacts):
+    return impacts.astype(np.float64)
+
+
+# Barrels of every shard, opened once by each worker process of a ShardedQueryEngine
+_worker_shards = None
+_worker_vectorized = False
+
+
+def _open_shards(shard_dirs, segment_dirs, num_barrels, use_impacts, use_positions, vectorized=False):
+    """
+    Worker initializer. Segments are not split by document, segment i is searched with shard
+    i % number of shards instead, which keeps every document in exactly one shard.
+    """
+    global _worker_shards, _worker_vectorized
+    _worker_vectorized = vectorized and np is not None
+    _worker_shards = []
+    for shard, shard_dir in enumerate(shard_dirs):
+        segments = segment_dirs[shard::len(shard_dirs)]
+        barrels = BarrelSet(Path(shard_dir) / 'barrels', num_barrels, segments)
+        impacts = BarrelSet(Path(shard_dir) / 'impacts', num_barrels, segments, segment_impacts_path) if use_impacts else None
+        positions = BarrelSet(Path(shard_dir) / 'positions', num_barrels, segments, segment_positions_path) if use_positions else None
+        _worker_shards.append((barrels, impacts, positions))
+
+
+def _rank_shard(shard, terms, k, match_all, phrases=()):
+    """
+    Top k (doc_id, score) pairs of one shard and the work it took, in a worker process. terms are
+    (word_id, weight) pairs weighted with the statistics of the whole index, so scores of different
+    shards compare.
+    """
+    barrels, impacts, positions = _worker_shards[shard]
+    return _rank_terms(_shard_terms(barrels, impacts, terms), k, match_all, phrases, positions)
+
+
+def _rank_shard_batch(shard, queries, match_all):
+    """
+    _rank_shard for part of a batch, given as (terms, phrases, k) per query. The queries share
+    their posting lists (see SharedCursors). Returns the results of each query and the work of all.
+    """
+    barrels, impacts, positions = [SharedCursors(barrel_set) if barrel_set is not None else None
+                                   for barrel_set in _worker_shards[shard]]
+    results, works = [], []
+    for terms, phrases, k in queries:
+        ranked, work = _rank_terms(_shard_terms(barrels, impacts, terms), k, match_all, phrases, positions)
+        results.append(ranked)
+        works.append(work)
+    works.extend(shared.work() for shared in (barrels, impacts, positions) if shared is not None)
+    return results, tuple(sum(values) for values in zip(*works))
+
+
+def _shard_terms(barrels, impacts, terms):
+    if impacts is not None:
+        return [QueryTerm(impacts.cursor(word_id), 1, int, impact_array if _worker_vectorized else None) for word_id, _ in terms]
+    return [QueryTerm(barrels.cursor(word_id), weight, QueryEngine.calculate_tf, tf_array if _worker_vectorized else None)
+            for word_id, weight in terms]
+
+
+def _best_first(result):
+    return -result[1], result[0]
+
+
+class ShardedQueryEngine(QueryEngine):
+    """
+    QueryEngine for an index split into document-partitioned shards (see shards.py). Every query
+    is sent to all shards at once and ranked by a pool of worker processes, which any number of
+    request threads share; the per-shard top k lists are merged into the global top k. The
+    lexicon, statistics and document metadata stay in this process, so IDFs are global and the
+    results are the same as those of an unsharded engine. A batch of queries is cut into one part
+    per worker and shard, so its queries are ranked in parallel as well.
+    """
+
+    def __init__(self, index_dir, num_barrels=50, total_docs=None, max_results=100, analyzer=None, use_impacts=True, workers=None,
+                 proximity_weight=0.0, vectorized=True):
+        super().__init__(index_dir, num_barrels, total_docs, max_results, analyzer, use_impacts, proximity_weight, vectorized)
+        self.shard_dirs = list_shards(self.index_dir)
+        if self.impacts is not None and not all((shard / 'impacts').is_dir() for shard in self.shard_dirs):
+            self.impacts.close()
+            self.impacts = None
+        # phrases are checked in the shards, the proximity boost here
+        if self.positions is not None and not all((shard / 'positions').is_dir() for shard in self.shard_dirs):
+            self.positions.close()
+            self.positions = None
+        segment_dirs = list_segments(self.index_dir / 'segments')
+        self.workers = workers or os.cpu_count()
+        # spawned rather than forked, the request threads of the server may hold locks at any time
+        context = multiprocessing.get_context('spawn')
+        self.pool = context.Pool(self.workers, initializer=_open_shards,
+                                 initargs=([str(shard) for shard in self.shard_dirs], [str(segment) for segment in segment_dirs],
+                                           num_barrels, self.impacts is not None, self.positions is not None, self.vectorized))
+
+    def rank_documents(self, query_word_ids, k=None, match_all=True, phrases=()):
+        k = k or self.max_results
+        proximity = self._uses_proximity(query_word_ids)
+        shard_k = k * PROXIMITY_CANDIDATES if proximity else k
+        with span('postings'):
+            if self.impacts is not None:
+                terms = [(word_id, 1) for word_id in query_word_ids]
+            else:
+                terms = [(word_id, self.calculate_idf(self.document_frequency(word_id, self.barrels.cursor(word_id))))
+                         for word_id in query_word_ids]
+        # The shards decode in parallel, so rank is the wall time of the scatter and gather, decoding included
+        with span('rank'):
+            pending = [self.pool.apply_async(_rank_shard, (shard, terms, shard_k, match_all, phrases))
+                       for shard in range(len(self.shard_dirs))]
+            ranked = [result.get() for result in pending]
+        for _, work in ranked:
+            _count_work(work)
+        results = list(islice(heapq.merge(*(results for results, _ in ranked), key=_best_first), shard_k))
+        if proximity:
+            results = self._proximity_rerank(results, query_word_ids, k, self.positions)
+        return results
+
+    def rank_batch(self, queries, k=None, match_all=True):
+        k = k or self.max_results
+        if not queries:
+            return []
+        weights = {}
+        with span('postings'):
+            for query_word_ids, _ in queries:
+                for word_id in query_word_ids:
+                    if word_id in weights:
+                        continue
+                    if self.impacts is not None:
+                        weights[word_id] = 1
+                    else:
+                        weights[word_id] = self.calculate_idf(self.document_frequency(word_id, self.barrels.cursor(word_id)))
+        batch = [([(word_id, weights[word_id]) for word_id in query_word_ids], phrases,
+                  k * PROXIMITY_CANDIDATES if self._uses_proximity(query_word_ids) else k)
+                 for query_word_ids, phrases in queries]
+        # every shard ranks the batch in as many parts as it takes to give all workers some of it
+        parts = max(1, self.workers // len(self.shard_dirs))
+        part_size = -(-len(batch) // parts)
+        shard_results = [[] for _ in batch]
+        with span('rank'):
+            pending = [(start, self.pool.apply_async(_rank_shard_batch, (shard, batch[start:start + part_size], match_all)))
+                       for shard in range(len(self.shard_dirs)) for start in range(0, len(batch), part_size)]
+            for start, result in pending:
+                ranked, work = result.get()
+                _count_work(work)
+                for offset, results in enumerate(ranked):
+                    shard_results[start + offset].append(results)
+        positions = SharedCursors(self.positions) if self.positions is not None else None
+        results = []
+        for (query_word_ids, _), (_, _, shard_k), ranked in zip(queries, batch, shard_results):
+            merged = list(islice(heapq.merge(*ranked, key=_best_first), shard_k))
+            if self._uses_proximity(query_word_ids):
+                merged = self._proximity_rerank(merged, query_word_ids, k, positions)
+            results.append(merged)
+        if positions is not None:
+            _count_work(positions.work())
+        return results
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        super().close()
+
+
+def open_engine(index_dir, workers=None, **options):
+    """
+    The query engine for an index: a ShardedQueryEngine with workers processes if the index was
+    split into shards, a QueryEngine otherwise.
+    """
+    if list_shards(index_dir):
+        return ShardedQueryEngine(index_dir, workers=workers, **options)
+    return QueryEngine(index_dir, **options)
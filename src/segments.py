@@ -0,0 +1,237 @@
+import csv
+import os
+import re
+import shutil
+from pathlib import Path
+from binary_barrel import PACKED, POSITIONS, BarrelReader, BarrelWriter, barrel_path
+from bundle import refresh_manifest
+from doc_store import DocStore, DocStoreWriter, merge_stores
+from shards import list_shards, partition_postings, partition_stats
+from term_stats import STATS_FILE, TermStats
+
+# Incremental ingest writes each upload as an immutable segment directory next to the barrels:
+#   segments/seg_<n>/postings.bin, postings.dir   one binary barrel holding every word of the upload
+#   segments/seg_<n>/term_stats.bin               the statistics of the uploaded documents
+#   segments/seg_<n>/impacts.bin, impacts.dir     their BM25 impacts, if the index has impact barrels
+#   segments/seg_<n>/positions.bin, positions.dir their word positions, if the index has positions barrels
+#   segments/seg_<n>/docs.bin, docs.idx           their titles, urls and tags (see doc_store.py)
+# Queries read the barrels plus all segments; compact() folds the segments back into the barrels.
+SEGMENT_PATTERN = re.compile(r'^seg_(\d+)$')
+MAX_SEGMENTS = 10
+MAX_SEGMENT_BYTES = 32 * 1024 * 1024
+
+
+def list_segments(segments_dir):
+    """
+    Return the segment directories in the order they were written.
+    """
+    segments_dir = Path(segments_dir)
+    if not segments_dir.exists():
+        return []
+    segments = []
+    for path in segments_dir.iterdir():
+        match = SEGMENT_PATTERN.match(path.name)
+        if match and path.is_dir():
+            segments.append((int(match.group(1)), path))
+    return [path for _, path in sorted(segments)]
+
+
+def segment_postings_path(segment_dir):
+    return Path(segment_dir) / 'postings'
+
+
+def segment_impacts_path(segment_dir):
+    return Path(segment_dir) / 'impacts'
+
+
+def segment_positions_path(segment_dir):
+    return Path(segment_dir) / 'positions'
+
+
+def segment_stats_path(segment_dir):
+    return Path(segment_dir) / STATS_FILE
+
+
+def segment_size(segment_dir):
+    return sum(path.stat().st_size for path in Path(segment_dir).iterdir() if path.is_file())
+
+
+def write_segment(segments_dir, postings, stats=None, impacts=None, documents=None, positions=None):
+    """
+    Flush an in-memory delta of word_id -> [(doc_id, bit_array), ...] as a new segment, with the
+    TermStats of its documents, their word_id -> [(doc_id, impact), ...], their
+    (doc_id, title, url, tags) records and their word_id -> [(doc_id, positions), ...] if given.
+    The segment is written under a temporary name and renamed into place, so readers only
+    ever see complete segments. Returns the segment directory.
+    """
+    segments_dir = Path(segments_dir)
+    segments_dir.mkdir(parents=True, exist_ok=True)
+    existing = list_segments(segments_dir)
+    sequence = int(SEGMENT_PATTERN.match(existing[-1].name).group(1)) + 1 if existing else 1
+
+    tmp_dir = segments_dir / f".seg_{sequence:06d}.{os.getpid()}.tmp"
+    tmp_dir.mkdir()
+    with BarrelWriter(segment_postings_path(tmp_dir)) as writer:
+        for word_id in sorted(postings):
+            writer.add(word_id, postings[word_id])
+    if impacts is not None:
+        with BarrelWriter(segment_impacts_path(tmp_dir)) as writer:
+            for word_id in sorted(impacts):
+                writer.add(word_id, impacts[word_id])
+    if positions is not None:
+        with BarrelWriter(segment_positions_path(tmp_dir), POSITIONS) as writer:
+            for word_id in sorted(positions):
+                writer.add(word_id, positions[word_id])
+    if stats is not None:
+        stats.save(segment_stats_path(tmp_dir))
+    if documents:
+        with DocStoreWriter(tmp_dir, first_doc_id=documents[0][0]) as writer:
+            for doc_id, title, url, tags in documents:
+                writer.add(doc_id, title, url, tags)
+
+    # Another writer may have claimed the sequence number meanwhile, take the next free one
+    while True:
+        segment_dir = segments_dir / f"seg_{sequence:06d}"
+        try:
+            os.rename(tmp_dir, segment_dir)
+            return segment_dir
+        except OSError:
+            if not segment_dir.exists():
+                raise
+            sequence += 1
+
+
+def needs_compaction(segments_dir, max_segments=MAX_SEGMENTS, max_bytes=MAX_SEGMENT_BYTES):
+    segments = list_segments(segments_dir)
+    if len(segments) > max_segments:
+        return True
+    return sum(segment_size(segment) for segment in segments) > max_bytes
+
+
+def _read_segments(segment_paths):
+    """
+    Read the segment barrels at segment_paths into word_id -> postings, oldest segment first.
+    """
+    postings = {}
+    for path_stem in segment_paths:
+        with BarrelReader(path_stem) as reader:
+            for word_id in reader.word_ids():
+                postings.setdefault(word_id, []).extend(reader.get_postings(word_id))
+    return postings
+
+
+def _merge_postings(barrels_dir, postings, num_barrels, codec=PACKED):
+    """
+    Merge word_id -> postings into the barrels in barrels_dir, rewriting each touched barrel once.
+    """
+    # barrel index -> word_id -> postings
+    delta = {}
+    for word_id, entries in postings.items():
+        delta.setdefault(word_id % num_barrels, {})[word_id] = entries
+
+    Path(barrels_dir).mkdir(parents=True, exist_ok=True)
+    for barrel_index, barrel_postings in delta.items():
+        path_stem = barrel_path(barrels_dir, barrel_index)
+        merged = {}
+        if path_stem.with_suffix('.dir').exists():
+            with BarrelReader(path_stem) as reader:
+                for word_id in reader.word_ids():
+                    merged[word_id] = reader.get_postings(word_id)
+        for word_id, entries in barrel_postings.items():
+            merged.setdefault(word_id, []).extend(entries)
+        with BarrelWriter(path_stem, codec) as writer:
+            for word_id in sorted(merged):
+                writer.add(word_id, merged[word_id])
+
+
+def _merge_into_shards(shard_dirs, postings, impacts, positions, stats, num_barrels):
+    """
+    Merge the postings, impacts, positions and statistics of the compacted segments into the shards
+    of the index, each document into the shard its doc id belongs to.
+    """
+    shard_postings = partition_postings(postings, len(shard_dirs))
+    shard_impacts = partition_postings(impacts, len(shard_dirs)) if impacts else [None] * len(shard_dirs)
+    shard_positions = partition_postings(positions, len(shard_dirs)) if positions else [None] * len(shard_dirs)
+    shard_stats = partition_stats(stats, shard_postings)
+    for shard_dir, part_postings, part_impacts, part_positions, part_stats in zip(shard_dirs, shard_postings, shard_impacts,
+                                                                                   shard_positions, shard_stats):
+        _merge_postings(shard_dir / 'barrels', part_postings, num_barrels)
+        if part_impacts is not None and (shard_dir / 'impacts').is_dir():
+            _merge_postings(shard_dir / 'impacts', part_impacts, num_barrels)
+        if part_positions is not None and (shard_dir / 'positions').is_dir():
+            _merge_postings(shard_dir / 'positions', part_positions, num_barrels, POSITIONS)
+        stats_path = shard_dir / STATS_FILE
+        if stats_path.exists():
+            TermStats.load(stats_path).merge(part_stats).save(stats_path)
+
+
+def _merge_documents(index_dir, segments):
+    """
+    Move the document records of the segments into the document store of the index, or into its
+    newdata.csv if it has no store. Either file is rewritten under a new name, never appended to.
+    """
+    segments = [segment for segment in segments if DocStore.exists(segment)]
+    if not segments:
+        return
+    if DocStore.exists(index_dir):
+        merge_stores(index_dir, segments)
+        return
+    newdata_file = index_dir / 'newdata.csv'
+    tmp_file = newdata_file.with_suffix('.csv.tmp')
+    if newdata_file.exists():
+        shutil.copyfile(newdata_file, tmp_file)
+    else:
+        with open(tmp_file, 'w', encoding='utf-8', newline='') as f:
+            csv.writer(f).writerow(['document_id', 'title', 'url', 'tags'])
+    with open(tmp_file, 'a', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        for segment in segments:
+            with DocStore(segment) as store:
+                for doc_id in store.doc_ids():
+                    writer.writerow([doc_id, *store.get(doc_id)])
+    os.replace(tmp_file, newdata_file)
+
+
+def compact(barrels_dir, segments_dir, num_barrels=50, max_segments=MAX_SEGMENTS, max_bytes=MAX_SEGMENT_BYTES, force=False):
+    """
+    Fold the current segments into the barrels once there are more than max_segments of them
+    or they take more than max_bytes. Each touched barrel is rewritten once and the merged
+    segments are removed afterwards; segments written while compacting are left for the next run.
+    Impacts, positions, term statistics and documents next to the barrels directory, and the shards
+    of a sharded index, are merged the same way; impacts keep the values computed at upload time
+    until the next full build. The bundle manifest of the index, if it has one, is rewritten.
+    Returns the number of segments compacted.
+    """
+    segments = list_segments(segments_dir)
+    if not segments or not (force or needs_compaction(segments_dir, max_segments, max_bytes)):
+        return 0
+
+    index_dir = Path(barrels_dir).parent
+    postings = _read_segments([segment_postings_path(segment) for segment in segments])
+    _merge_postings(barrels_dir, postings, num_barrels)
+    impact_paths = [segment_impacts_path(segment) for segment in segments
+                    if segment_impacts_path(segment).with_suffix('.dir').exists()]
+    impacts = _read_segments(impact_paths) if impact_paths else None
+    if impacts:
+        _merge_postings(index_dir / 'impacts', impacts, num_barrels)
+    position_paths = [segment_positions_path(segment) for segment in segments
+                      if segment_positions_path(segment).with_suffix('.dir').exists()]
+    positions = _read_segments(position_paths) if position_paths else None
+    if positions and (index_dir / 'positions').is_dir():
+        _merge_postings(index_dir / 'positions', positions, num_barrels, POSITIONS)
+    segment_stats = TermStats()
+    for segment in segments:
+        if segment_stats_path(segment).exists():
+            segment_stats.merge(TermStats.load(segment_stats_path(segment)))
+    stats_path = index_dir / STATS_FILE
+    if stats_path.exists():
+        TermStats.load(stats_path).merge(segment_stats).save(stats_path)
+    shard_dirs = list_shards(index_dir)
+    if shard_dirs:
+        _merge_into_shards(shard_dirs, postings, impacts, positions, segment_stats, num_barrels)
+    _merge_documents(index_dir, segments)
+    refresh_manifest(index_dir)
+
+    for segment in segments:
+        shutil.rmtree(segment)
+    return len(segments)
@@ -0,0 +1,143 @@
+import argparse
+import os
+import re
+import shutil
+from pathlib import Path
+from binary_barrel import PACKED, POSITIONS, BarrelReader, BarrelWriter, barrel_path
+from bundle import refresh_manifest
+from term_stats import STATS_FILE, TermStats
+
+# Document-partitioned shards of an index, written next to its barrels:
+#   shards/shard_<i>/barrels/         the postings of the documents with doc_id % num_shards == i
+#   shards/shard_<i>/impacts/         their BM25 impacts, if the index has impact barrels
+#   shards/shard_<i>/positions/       their word positions, if the index has positions barrels
+#   shards/shard_<i>/term_stats.bin   the statistics of the shard's documents
+# Every shard uses the word ids of the shared lexicon and the barrel numbering of the index. The
+# lexicon, document store and full barrels stay as they are, uploads and compaction keep using them.
+# Impacts are copied from the index, so they are scored with the statistics of the whole collection.
+SHARDS_DIR = 'shards'
+SHARD_PATTERN = re.compile(r'^shard_(\d+)$')
+
+
+def shard_path(index_dir, shard):
+    return Path(index_dir) / SHARDS_DIR / f"shard_{shard:03d}"
+
+
+def list_shards(index_dir):
+    """
+    Return the shard directories of an index in shard order, or [] if it is not sharded.
+    """
+    shards_dir = Path(index_dir) / SHARDS_DIR
+    if not shards_dir.exists():
+        return []
+    shards = []
+    for path in shards_dir.iterdir():
+        match = SHARD_PATTERN.match(path.name)
+        if match and path.is_dir():
+            shards.append((int(match.group(1)), path))
+    return [path for _, path in sorted(shards)]
+
+
+def partition_postings(postings, num_shards):
+    """
+    Split word_id -> [(doc_id, bit_array), ...] into one such dict per shard, keeping posting order.
+    """
+    shards = [{} for _ in range(num_shards)]
+    for word_id, entries in postings.items():
+        for entry in entries:
+            shards[entry[0] % num_shards].setdefault(word_id, []).append(entry)
+    return shards
+
+
+def partition_stats(stats, shard_postings):
+    """
+    Split the TermStats of a collection by document. The document frequencies of each shard are
+    counted from its part of the postings, as given by partition_postings.
+    """
+    num_shards = len(shard_postings)
+    shard_stats = [TermStats(stats.impact_scale) for _ in range(num_shards)]
+    for doc_id, length in stats.doc_lengths.items():
+        part = shard_stats[doc_id % num_shards]
+        part.doc_lengths[doc_id] = length
+        part.num_docs += 1
+        part.total_length += length
+    for part, postings in zip(shard_stats, shard_postings):
+        for word_id, entries in postings.items():
+            part.doc_frequency[word_id] = len({doc_id for doc_id, _ in entries})
+    return shard_stats
+
+
+def _split_barrels(source_dir, shard_dirs, num_barrels, codec=PACKED):
+    """
+    Split every barrel in source_dir over the shard directories, one barrel in memory at a time.
+    Returns the document frequency of every word in every shard.
+    """
+    doc_frequencies = [{} for _ in shard_dirs]
+    for shard_dir in shard_dirs:
+        shard_dir.mkdir(parents=True, exist_ok=True)
+    for barrel_index in range(num_barrels):
+        path_stem = barrel_path(source_dir, barrel_index)
+        if not path_stem.with_suffix('.dir').exists():
+            continue
+        with BarrelReader(path_stem) as reader:
+            postings = {word_id: reader.get_postings(word_id) for word_id in reader.word_ids()}
+        for shard_dir, frequencies, shard_postings in zip(shard_dirs, doc_frequencies, partition_postings(postings, len(shard_dirs))):
+            with BarrelWriter(barrel_path(shard_dir, barrel_index), codec) as writer:
+                for word_id in sorted(shard_postings):
+                    writer.add(word_id, shard_postings[word_id])
+                    frequencies[word_id] = len({doc_id for doc_id, _ in shard_postings[word_id]})
+    return doc_frequencies
+
+
+def split_index(index_dir, num_shards, num_barrels=50):
+    """
+    Write the shards of a built index, replacing any previous ones. The segments of the index are
+    not split; a sharded engine hands each of them to one shard until compaction merges them.
+    Returns the shard directories.
+    """
+    index_dir = Path(index_dir)
+    shards_dir = index_dir / SHARDS_DIR
+    tmp_dir = index_dir / f".{SHARDS_DIR}.{os.getpid()}.tmp"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_shards = [tmp_dir / shard_path(index_dir, shard).name for shard in range(num_shards)]
+
+    doc_frequencies = _split_barrels(index_dir / 'barrels', [shard / 'barrels' for shard in tmp_shards], num_barrels)
+    if (index_dir / 'impacts').is_dir():
+        _split_barrels(index_dir / 'impacts', [shard / 'impacts' for shard in tmp_shards], num_barrels)
+    if (index_dir / 'positions').is_dir():
+        _split_barrels(index_dir / 'positions', [shard / 'positions' for shard in tmp_shards], num_barrels, POSITIONS)
+    if (index_dir / STATS_FILE).exists():
+        stats = TermStats.load(index_dir / STATS_FILE)
+        # the postings were split barrel by barrel, their document frequencies were counted on the way
+        for shard_dir, part, frequencies in zip(tmp_shards, partition_stats(stats, [{} for _ in tmp_shards]), doc_frequencies):
+            part.doc_frequency = frequencies
+            part.save(shard_dir / STATS_FILE)
+
+    remove_shards(index_dir)
+    os.rename(tmp_dir, shards_dir)
+    return list_shards(index_dir)
+
+
+def remove_shards(index_dir):
+    shutil.rmtree(Path(index_dir) / SHARDS_DIR, ignore_errors=True)
+
+
+def main(argv=None):
+    base_dir = Path(__file__).resolve().parent.parent
+    parser = argparse.ArgumentParser(description="Split a built index into document-partitioned shards")
+    parser.add_argument('--index', default=str(base_dir / 'engine_data'), help="index directory with barrels and term_stats.bin")
+    parser.add_argument('--shards', type=int, default=os.cpu_count(), help="number of shards, 1 removes the shards")
+    parser.add_argument('--num-barrels', type=int, default=50)
+    args = parser.parse_args(argv)
+    if args.shards <= 1:
+        remove_shards(args.index)
+        refresh_manifest(args.index)
+        print(f"Removed the shards of {args.index}")
+        return
+    shards = split_index(args.index, args.shards, args.num_barrels)
+    refresh_manifest(args.index)
+    print(f"Split {args.index} into {len(shards)} shards")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+import argparse
+import os
+import re
+import shutil
+from pathlib import Path
+
+# Versioned index snapshots under the index root (engine_data):
+#   snapshots/<version>/   one complete, immutable index directory (barrels, segments, lexicon, docs, ...)
+#   CURRENT                the name of the snapshot being served, replaced atomically on publish
+# A change to the index is made in a staging copy of the current snapshot and published as the next
+# version. The copy hard-links every file, which is safe because index files are never modified in
+# place: writers always create a new file and os.replace it over the old name, which only changes
+# the link in the staging directory.
+SNAPSHOTS_DIR = 'snapshots'
+CURRENT_FILE = 'CURRENT'
+VERSION_PATTERN = re.compile(r'^(\d{6})$')
+KEEP_SNAPSHOTS = 3
+# What belongs to an index in a flat directory written by the build scripts
+INDEX_ENTRIES = ('barrels', 'impacts', 'positions', 'shards', 'segments', 'lexicon.csv', 'lexicon.bin', 'spelling.bin', 'term_stats.bin',
+                 'newdata.csv', 'docs.bin', 'docs.idx', 'doc_id.txt', 'manifest.json')
+
+
+def link_tree(source, target):
+    """
+    Recreate the directory tree at source under target, hard-linking the files (copying them
+    where the file system cannot link).
+    """
+    source = Path(source)
+    target = Path(target)
+    target.mkdir(parents=True, exist_ok=True)
+    for entry in source.iterdir():
+        if entry.is_dir():
+            link_tree(entry, target / entry.name)
+        else:
+            try:
+                os.link(entry, target / entry.name)
+            except OSError:
+                shutil.copy2(entry, target / entry.name)
+
+
+class SnapshotStore:
+    """
+    The snapshots of one index root. Staging and publishing are not synchronized here; callers
+    that change the index from several threads serialize begin() ... publish() themselves.
+    """
+
+    def __init__(self, root, keep=KEEP_SNAPSHOTS):
+        self.root = Path(root)
+        self.snapshots_dir = self.root / SNAPSHOTS_DIR
+        self.keep = keep
+
+    def versions(self):
+        if not self.snapshots_dir.exists():
+            return []
+        return sorted(path.name for path in self.snapshots_dir.iterdir() if VERSION_PATTERN.match(path.name) and path.is_dir())
+
+    def current(self):
+        """
+        Name of the published snapshot, or None if nothing was published yet.
+        """
+        try:
+            with open(self.root / CURRENT_FILE, 'r') as f:
+                version = f.read().strip()
+        except FileNotFoundError:
+            return None
+        return version or None
+
+    def path(self, version):
+        return self.snapshots_dir / version
+
+    def current_path(self):
+        version = self.current()
+        return self.path(version) if version else None
+
+    def begin(self, source=None):
+        """
+        Stage a new snapshot as a hard-linked copy of the current one (or of the flat index
+        directory source) and return its directory. Nothing in it is visible until publish().
+        """
+        self.snapshots_dir.mkdir(parents=True, exist_ok=True)
+        staging = self.snapshots_dir / f".staging.{os.getpid()}.{len(self.versions())}"
+        while staging.exists():
+            staging = staging.with_name(staging.name + '_')
+        if source is not None:
+            staging.mkdir()
+            for name in INDEX_ENTRIES:
+                entry = Path(source) / name
+                if entry.is_dir():
+                    link_tree(entry, staging / name)
+                elif entry.exists():
+                    # the build scripts rewrite these files in place, so a snapshot gets its own copy
+                    shutil.copy2(entry, staging / name)
+        elif self.current() is not None:
+            link_tree(self.current_path(), staging)
+        else:
+            staging.mkdir()
+        return staging
+
+    def publish(self, staging):
+        """
+        Turn a staged directory into the next version and point CURRENT at it atomically.
+        Returns the new version name.
+        """
+        versions = self.versions()
+        number = int(versions[-1]) + 1 if versions else 1
+        while True:
+            version = f"{number:06d}"
+            try:
+                os.rename(staging, self.path(version))
+                break
+            except OSError:
+                if not self.path(version).exists():
+                    raise
+                number += 1
+        tmp_file = self.root / f"{CURRENT_FILE}.{os.getpid()}.tmp"
+        with open(tmp_file, 'w') as f:
+            f.write(version)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.root / CURRENT_FILE)
+        self.prune()
+        return version
+
+    def abort(self, staging):
+        shutil.rmtree(staging, ignore_errors=True)
+
+    def prune(self):
+        """
+        Remove all but the newest keep snapshots. Servers open every file of a snapshot when they
+        load it, so they keep reading an old one until they release it; where open files cannot be
+        deleted the removal is retried on the next publish.
+        """
+        current = self.current()
+        for version in self.versions()[:-self.keep]:
+            if version != current:
+                shutil.rmtree(self.path(version), ignore_errors=True)
+
+    def import_index(self, source):
+        """
+        Publish the flat index directory written by the build scripts as a new snapshot.
+        """
+        staging = self.begin(source)
+        try:
+            return self.publish(staging)
+        except BaseException:
+            self.abort(staging)
+            raise
+
+    def rebase(self, staging, base_version):
+        """
+        Carry uploads published since base_version over into staging: segments that are in the
+        current snapshot but were not in the base one are linked in, with the doc id counter.
+        Used by compaction, which works on a copy of base_version for a long time.
+        """
+        current = self.current()
+        if current is None or current == base_version:
+            return
+        current_path = self.path(current)
+        base_segments = self.path(base_version) / 'segments'
+        current_segments = current_path / 'segments'
+        if current_segments.exists():
+            for segment in current_segments.iterdir():
+                if not (base_segments / segment.name).exists():
+                    link_tree(segment, staging / 'segments' / segment.name)
+        if (current_path / 'doc_id.txt').exists():
+            shutil.copy2(current_path / 'doc_id.txt', staging / 'doc_id.txt')
+
+
+def main(argv=None):
+    base_dir = Path(__file__).resolve().parent.parent
+    parser = argparse.ArgumentParser(description="Publish a freshly built index as the snapshot the backend serves")
+    parser.add_argument('--root', default=str(base_dir / 'engine_data'), help="index root holding the snapshots")
+    parser.add_argument('--source', default=None, help="flat index directory to publish (default: the root)")
+    args = parser.parse_args(argv)
+    store = SnapshotStore(args.root)
+    version = store.import_index(args.source or args.root)
+    print(f"Published snapshot {version} in {store.snapshots_dir}")
+
+
+if __name__ == "__main__":
+    main()
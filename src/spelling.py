@@ -0,0 +1,269 @@
+import argparse
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_left
+from pathlib import Path
+from bundle import refresh_manifest
+from compact_lexicon import LEXICON_FILE, CompactLexicon
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# spelling.bin, the deletion index used to correct misspelled query words (SymSpell), written next
+# to lexicon.bin and only valid for the lexicon.bin it was built from (little endian):
+#   header   magic, version, max edit distance, prefix length, entry count n, word count and word
+#            blob size of the lexicon (uint32 each)
+#   arrays   n CRC-32 hashes of deletes, sorted, then the n lexicon indexes (sort order positions
+#            in lexicon.bin) of the words they were made from (uint32 each)
+# A delete is what is left of the first prefix length letters of a word after removing up to max
+# edit distance of them. Two words within that distance share a delete, so the candidates of a query
+# word are the words under the hashes of its own deletes; hashes that collide only add candidates,
+# which are all checked with the real edit distance.
+SPELLING_FILE = 'spelling.bin'
+SPELLING_MAGIC = b'SPEL'
+SPELLING_VERSION = 1
+SPELLING_HEADER = struct.Struct('<4sIIIIII')
+MAX_DISTANCE = 2
+# Longer words only index the deletes of their first PREFIX_LENGTH letters, which bounds the size of
+# the index. A shorter prefix makes it smaller, but more words then share their deletes and every
+# one of them has to be checked (7 letters, as SymSpell suggests, gave over a thousand per lookup)
+PREFIX_LENGTH = 12
+# Words in fewer documents are left out: most of them are misspellings in the corpus themselves,
+# and they would make up the larger part of the index
+MIN_DOC_FREQUENCY = 2
+# Shorter query words are not corrected, and words shorter than SHORT_WORD get at most one edit,
+# two edits turn them into too many other words
+MIN_WORD_LENGTH = 3
+SHORT_WORD = 5
+
+
+def delete_levels(word, max_distance):
+    """
+    The strings left after removing 0, 1, ... max_distance letters of word, one set per number removed.
+    """
+    level = {word}
+    levels = [level]
+    for _ in range(max_distance):
+        level = {part[:i] + part[i + 1:] for part in level for i in range(len(part))}
+        levels.append(level)
+    return levels
+
+
+def deletes(word, max_distance):
+    """
+    Every string left after removing up to max_distance letters of word, the word itself included.
+    """
+    return set().union(*delete_levels(word, max_distance))
+
+
+def delete_hash(delete):
+    return zlib.crc32(delete.encode('utf-8'))
+
+
+def edit_distance(a, b, max_distance):
+    """
+    Optimal string alignment distance between a and b (insertions, deletions, substitutions and
+    transpositions of adjacent letters), or None if it is more than max_distance.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return None
+    # a common prefix and suffix cost nothing, only what lies between them is compared
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+    if not a or not b:
+        return max(len(a), len(b))
+    before_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            distance = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                distance = min(distance, before_previous[j - 2] + 1)
+            current[j] = distance
+        if min(current) > max_distance:
+            return None
+        before_previous, previous = previous, current
+    return previous[-1] if previous[-1] <= max_distance else None
+
+
+def encode_spelling(lexicon, min_doc_frequency=MIN_DOC_FREQUENCY, max_distance=MAX_DISTANCE, prefix_length=PREFIX_LENGTH):
+    """
+    Encode the deletion index of the alphabetic words of a CompactLexicon in at least
+    min_doc_frequency documents into the spelling.bin layout.
+    """
+    keys = array('Q')  # hash << 32 | lexicon index, sorted below
+    frequencies = lexicon.doc_frequencies
+    for index in range(len(lexicon)):
+        if frequencies[index] < min_doc_frequency:
+            continue
+        word = lexicon.word(index)
+        if not word.isalpha():
+            continue
+        keys.extend(delete_hash(delete) << 32 | index for delete in deletes(word[:prefix_length], max_distance))
+    # a large lexicon has tens of millions of deletes, NumPy sorts them without a Python int each
+    if np is not None:
+        keys = np.sort(np.frombuffer(keys, np.uint64))
+        hashes, indexes = (keys >> np.uint64(32)).astype('<u4'), (keys & np.uint64(0xFFFFFFFF)).astype('<u4')
+        arrays = hashes.tobytes() + indexes.tobytes()
+    else:
+        keys = sorted(keys)
+        hashes, indexes = array('I', (key >> 32 for key in keys)), array('I', (key & 0xFFFFFFFF for key in keys))
+        if sys.byteorder != 'little':
+            hashes.byteswap()
+            indexes.byteswap()
+        arrays = hashes.tobytes() + indexes.tobytes()
+    header = SPELLING_HEADER.pack(SPELLING_MAGIC, SPELLING_VERSION, max_distance, prefix_length, len(keys),
+                                  len(lexicon), len(lexicon.blob))
+    return header + arrays
+
+
+def write_spelling(index_dir, min_doc_frequency=MIN_DOC_FREQUENCY):
+    """
+    Write the spelling.bin of an index from its lexicon.bin, under a temporary name. Returns the
+    number of deletes indexed.
+    """
+    index_dir = Path(index_dir)
+    lexicon = CompactLexicon.open(index_dir / LEXICON_FILE)
+    try:
+        data = encode_spelling(lexicon, min_doc_frequency)
+    finally:
+        lexicon.close()
+    tmp_path = index_dir / f"{SPELLING_FILE}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, index_dir / SPELLING_FILE)
+    return SPELLING_HEADER.unpack_from(data, 0)[4]
+
+
+def _uint32_array(view):
+    if sys.byteorder == 'little':
+        return view.cast('I')
+    values = array('I', view.tobytes())
+    values.byteswap()
+    return values
+
+
+class SpellingIndex:
+    """
+    Corrects words missing from the lexicon to the lexicon word within the smallest edit distance,
+    preferring the word in the most documents among equally close ones. A lookup hashes the few
+    dozen deletes of the word and binary searches each in the memory-mapped index, so it never
+    scans the lexicon.
+    """
+
+    def __init__(self, data, lexicon, source=None):
+        self._data = data
+        self._file = source
+        magic, version, max_distance, prefix_length, count, words, blob_size = SPELLING_HEADER.unpack_from(data, 0)
+        if magic != SPELLING_MAGIC or version != SPELLING_VERSION:
+            raise ValueError("Unsupported spelling index format")
+        if words != len(lexicon) or blob_size != len(lexicon.blob):
+            raise ValueError("The spelling index was built from another lexicon")
+        self.lexicon = lexicon
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.count = count
+        view = memoryview(data)
+        offset = SPELLING_HEADER.size
+        self.hashes = _uint32_array(view[offset:offset + 4 * count])
+        self.indexes = _uint32_array(view[offset + 4 * count:offset + 8 * count])
+
+    @classmethod
+    def open(cls, path, lexicon):
+        f = open(path, 'rb')
+        try:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), lexicon, f)
+        except ValueError:
+            f.close()
+            raise
+
+    def candidates(self, word_deletes):
+        """
+        Lexicon indexes of the words sharing one of word_deletes, each once.
+        """
+        hashes, indexes, count = self.hashes, self.indexes, self.count
+        found = set()
+        for delete in word_deletes:
+            key = delete_hash(delete)
+            position = bisect_left(hashes, key)
+            while position < count and hashes[position] == key:
+                found.add(indexes[position])
+                position += 1
+        return found
+
+    def correct(self, word):
+        """
+        The lexicon word closest to word as (word, edit distance), or None if there is none within
+        the edit distance allowed for its length.
+        """
+        if len(word) < MIN_WORD_LENGTH or not word.isalpha():
+            return None
+        max_distance = min(self.max_distance, 1 if len(word) < SHORT_WORD else 2)
+        frequencies = self.lexicon.doc_frequencies
+        best = None  # (distance, -doc_frequency, index)
+        checked = set()
+        for removed, level in enumerate(delete_levels(word[:self.prefix_length], max_distance)):
+            # a word within distance d shares a delete with at most d letters removed from the query
+            # word, so once one at a distance below the letters removed is found, no closer one is left
+            if best is not None and best[0] < removed:
+                break
+            for index in self.candidates(level) - checked:
+                checked.add(index)
+                distance = edit_distance(word, self.lexicon.word(index), best[0] if best is not None else max_distance)
+                if distance is not None and (best is None or (distance, -frequencies[index], index) < best):
+                    best = (distance, -frequencies[index], index)
+        if best is None:
+            return None
+        return self.lexicon.word(best[2]), best[0]
+
+    def close(self):
+        if self._file is None:
+            return
+        for values in (self.hashes, self.indexes):
+            if isinstance(values, memoryview):
+                values.release()
+        self._data.close()
+        self._file.close()
+        self._file = None
+
+
+def load_spelling(index_dir, lexicon):
+    """
+    The SpellingIndex of an index for its lexicon, or None if the index has no spelling.bin or the
+    file is out of date with the lexicon (rebuild it with spelling.py).
+    """
+    path = Path(index_dir) / SPELLING_FILE
+    if not path.exists():
+        return None
+    try:
+        return SpellingIndex.open(path, lexicon)
+    except ValueError as e:
+        print(f"Not correcting query words: {e}")
+        return None
+
+
+def main(argv=None):
+    base_dir = Path(__file__).resolve().parent.parent
+    parser = argparse.ArgumentParser(description="Write spelling.bin, the deletion index for query spelling correction, from lexicon.bin")
+    parser.add_argument('--index', default=str(base_dir / 'engine_data'), help="index directory with lexicon.bin")
+    parser.add_argument('--min-df', type=int, default=MIN_DOC_FREQUENCY, help="leave out words in fewer documents than this")
+    args = parser.parse_args(argv)
+    deletes_indexed = write_spelling(args.index, args.min_df)
+    refresh_manifest(args.index)
+    print(f"Wrote {deletes_indexed} deletes to {Path(args.index) / SPELLING_FILE}")
+
+
+if __name__ == "__main__":
+    main()
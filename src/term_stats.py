@@ -0,0 +1,234 @@
+import math
+import os
+import struct
+import sys
+from array import array
+from pathlib import Path
+
+# term_stats.bin holds the collection statistics ranking needs, written by the index build and by every upload:
+#   header   magic, version, document count (uint32), total document length (uint64), first doc id of the
+#            length table (uint32), length table size (uint32), term count (uint32), impact scale (float64)
+#   terms    term id (uint32) and document frequency (uint32) per term, sorted by term id
+#   lengths  one document length (uint32) per doc id from the first doc id on, 0 for ids without a document
+# A document's length is the sum of the frequencies in its bit arrays. The impact scale is 0 when the
+# index has no impact barrels, otherwise the factor BM25 scores were multiplied with before rounding.
+STATS_FILE = 'term_stats.bin'
+STATS_MAGIC = b'TSTA'
+STATS_VERSION = 1
+STATS_HEADER = struct.Struct('<4sHIQIIId')
+TERM_ENTRY = struct.Struct('<II')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Impacts are stored in the bit array column of a packed barrel, and must stay below 256 so that
+# max_bit_array() of a list of impacts is simply their maximum
+IMPACT_LEVELS = 255
+TITLE_WEIGHT = 1.5
+TAG_WEIGHT = 1.2
+
+
+def bm25_idf(doc_frequency, num_docs):
+    return math.log(1 + (num_docs - doc_frequency + 0.5) / (doc_frequency + 0.5))
+
+
+def weighted_frequency(bit_array):
+    """
+    Frequency of a posting with the same title/tag weighting calculate_tf applies.
+    """
+    frequency = bit_array & 0xFF
+    if bit_array & (1 << 9):
+        return frequency * TITLE_WEIGHT
+    if bit_array & (1 << 8):
+        return frequency * TAG_WEIGHT
+    return frequency
+
+
+def _zeros(count):
+    return array('I', bytes(4 * count))
+
+
+class DocLengths:
+    """
+    Document lengths in the layout of the length table of term_stats.bin: uint32 lengths indexed by
+    doc_id - first_doc, 0 for ids without a document. Doc ids are handed out in order, so the table
+    only grows at its end and a build keeps 4 bytes per document rather than a dict entry.
+    """
+
+    def __init__(self, first_doc=0, lengths=None):
+        self.first_doc = first_doc
+        self.lengths = lengths if lengths is not None else array('I')
+
+    def get(self, doc_id, default=0):
+        index = doc_id - self.first_doc
+        if 0 <= index < len(self.lengths):
+            return self.lengths[index]
+        return default
+
+    def __setitem__(self, doc_id, length):
+        if not self.lengths:
+            self.first_doc = doc_id
+        elif doc_id < self.first_doc:
+            self.lengths[:0] = _zeros(self.first_doc - doc_id)
+            self.first_doc = doc_id
+        index = doc_id - self.first_doc
+        if index < len(self.lengths):
+            self.lengths[index] = length
+            return
+        if index > len(self.lengths):
+            self.lengths.extend(_zeros(index - len(self.lengths)))
+        self.lengths.append(length)
+
+    def items(self):
+        """
+        (doc_id, length) of every document with a length, in doc id order.
+        """
+        first_doc = self.first_doc
+        return ((first_doc + i, length) for i, length in enumerate(self.lengths) if length)
+
+    def update(self, other):
+        end = self.first_doc + len(self.lengths)
+        if other.lengths and (not self.lengths or other.first_doc >= end):
+            # the lengths of an upload or segment follow those of the index, they are copied as a whole
+            if not self.lengths:
+                self.first_doc = end = other.first_doc
+            self.lengths.extend(_zeros(other.first_doc - end))
+            self.lengths.extend(other.lengths)
+            return
+        for doc_id, length in other.items():
+            self[doc_id] = length
+
+    def to_bytes(self):
+        if sys.byteorder == 'little':
+            return self.lengths.tobytes()
+        lengths = array('I', self.lengths)
+        lengths.byteswap()
+        return lengths.tobytes()
+
+    @classmethod
+    def from_bytes(cls, first_doc, data):
+        lengths = array('I', data)
+        if sys.byteorder != 'little':
+            lengths.byteswap()
+        return cls(first_doc, lengths)
+
+
+class TermStats:
+    """
+    Document frequency per term, collection size and document lengths. Each build or upload records
+    the documents it indexed; the statistics of the index and its segments are merged when loaded.
+    """
+
+    def __init__(self, impact_scale=0.0):
+        self.num_docs = 0
+        self.total_length = 0
+        self.doc_frequency = {}
+        self.doc_lengths = DocLengths()
+        self.impact_scale = impact_scale
+
+    def add_document(self, doc_id, postings):
+        """
+        Count one document given its (term_id, bit_array) postings; a term may appear more than once.
+        """
+        length = 0
+        terms = set()
+        for term_id, bit_array in postings:
+            length += bit_array & 0xFF
+            terms.add(term_id)
+        for term_id in terms:
+            self.doc_frequency[term_id] = self.doc_frequency.get(term_id, 0) + 1
+        self.doc_lengths[doc_id] = length
+        self.num_docs += 1
+        self.total_length += length
+
+    def merge(self, other):
+        self.num_docs += other.num_docs
+        self.total_length += other.total_length
+        for term_id, frequency in other.doc_frequency.items():
+            self.doc_frequency[term_id] = self.doc_frequency.get(term_id, 0) + frequency
+        self.doc_lengths.update(other.doc_lengths)
+        if not self.impact_scale:
+            self.impact_scale = other.impact_scale
+        return self
+
+    @property
+    def average_length(self):
+        return self.total_length / self.num_docs if self.num_docs else 0.0
+
+    def bm25(self, term_id, doc_id, bit_array):
+        frequency = weighted_frequency(bit_array)
+        if not frequency:
+            return 0.0
+        idf = bm25_idf(self.doc_frequency.get(term_id, 1), max(self.num_docs, 1))
+        length_ratio = self.doc_lengths.get(doc_id, 0) / self.average_length if self.average_length else 1.0
+        return idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * length_ratio))
+
+    def set_impact_scale(self):
+        """
+        Map the highest BM25 score a posting can reach in this collection (a term in a single
+        document, with the frequency part at its limit k1 + 1) to the top impact level.
+        """
+        self.impact_scale = IMPACT_LEVELS / (bm25_idf(1, max(self.num_docs, 1)) * (BM25_K1 + 1))
+        return self.impact_scale
+
+    def impact(self, term_id, doc_id, bit_array):
+        """
+        Quantized BM25 score of a posting, between 1 and IMPACT_LEVELS so every posting still counts.
+        """
+        return max(1, min(IMPACT_LEVELS, round(self.bm25(term_id, doc_id, bit_array) * self.impact_scale)))
+
+    def impact_postings(self, term_id, postings):
+        """
+        Turn (doc_id, bit_array) postings into (doc_id, impact) postings, one per document with
+        the last one winning like in the barrels.
+        """
+        by_doc = {}
+        for doc_id, bit_array in postings:
+            by_doc[doc_id] = bit_array
+        return [(doc_id, self.impact(term_id, doc_id, bit_array)) for doc_id, bit_array in by_doc.items()]
+
+    def save(self, path):
+        path = Path(path)
+        first_doc = self.doc_lengths.first_doc
+        table_size = len(self.doc_lengths.lengths)
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(STATS_HEADER.pack(STATS_MAGIC, STATS_VERSION, self.num_docs, self.total_length,
+                                      first_doc, table_size, len(self.doc_frequency), self.impact_scale))
+            f.write(b''.join(TERM_ENTRY.pack(term_id, self.doc_frequency[term_id]) for term_id in sorted(self.doc_frequency)))
+            f.write(self.doc_lengths.to_bytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, doc_lengths=True):
+        """
+        Read a statistics file. Ranking only needs the document frequencies, so the query engine
+        skips the document length table (one entry per document) with doc_lengths=False.
+        """
+        with open(path, 'rb') as f:
+            header = f.read(STATS_HEADER.size)
+            magic, version, num_docs, total_length, first_doc, table_size, num_terms, impact_scale = STATS_HEADER.unpack_from(header, 0)
+            if magic != STATS_MAGIC or version != STATS_VERSION:
+                raise ValueError(f"Unsupported term statistics format: {path}")
+            stats = cls(impact_scale)
+            stats.num_docs = num_docs
+            stats.total_length = total_length
+            stats.doc_frequency = dict(TERM_ENTRY.iter_unpack(f.read(num_terms * TERM_ENTRY.size)))
+            # the length table is left unread when it is not needed
+            if doc_lengths:
+                stats.doc_lengths = DocLengths.from_bytes(first_doc, f.read(4 * table_size))
+        return stats
+
+
+def load_stats(paths, doc_lengths=True):
+    """
+    Merge the statistics files of an index and its segments. Returns None if the index itself has
+    none (built before statistics were recorded), as segment statistics alone would be misleading.
+    """
+    paths = [Path(path) for path in paths]
+    if not paths or not paths[0].exists():
+        return None
+    stats = TermStats.load(paths[0], doc_lengths)
+    for path in paths[1:]:
+        if path.exists():
+            stats.merge(TermStats.load(path, doc_lengths))
+    return stats
@@ -0,0 +1,301 @@
+import heapq
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Documents that contain every query term get their score boosted, as in TFIDFRanker
+ALL_TERMS_BOOST = 1.5
+# Bounds and scores add the same terms in different orders, so rounding can differ in the last bits;
+# only prune when the bound is below the threshold by more than that
+PRUNE_SLACK = 1e-9
+# Below this many postings in all lists of an OR query, the skipping of MaxScore does better than
+# decoding and scoring every posting as arrays. AND always uses arrays: intersect_arrays only decodes
+# the rarest list and the blocks of the others its doc ids fall into.
+ARRAY_MIN_POSTINGS = 4096
+
+
+def cannot_beat(bound, threshold):
+    return bound + PRUNE_SLACK * max(1.0, threshold) <= threshold
+
+
+class QueryTerm:
+    """
+    One query term during evaluation: its posting cursor and its weight (idf). A posting scores
+    weight * tf(bit_array); upper bounds score the max bit arrays stored with the list and its blocks.
+    tf_array, if given, is tf for a whole NumPy array of bit arrays at once (see top_k_arrays).
+    """
+
+    def __init__(self, cursor, weight, tf, tf_array=None):
+        self.cursor = cursor
+        self.weight = weight
+        self.tf = tf
+        self.tf_array = tf_array
+        self.upper_bound = weight * tf(cursor.max_bits)
+
+    def score(self, bit_array):
+        return self.weight * self.tf(bit_array)
+
+    def score_array(self, bit_arrays):
+        return self.weight * self.tf_array(bit_arrays)
+
+    def block_upper_bound(self, max_bits):
+        return self.weight * self.tf(max_bits)
+
+
+class TopK:
+    """
+    Bounded min-heap of the best k (score, doc_id) results. Ties go to the smaller doc id, which is
+    the order an exhaustive sort by (-score, doc_id) produces. Documents are offered in increasing
+    doc id order, so a later document has to beat the threshold strictly to get in. accept(doc_id),
+    if given, is asked only about documents that would get in, for checks too costly to run on every
+    candidate (like phrase positions); rejected documents leave the threshold as it was.
+    """
+
+    def __init__(self, k, accept=None):
+        self.k = k
+        self.accept = accept
+        self.heap = []  # (score, -doc_id), the worst result at the root
+        self.offered = 0  # documents scored, for the query metrics
+
+    @property
+    def threshold(self):
+        """
+        Score a document must exceed to enter; 0 while the heap is not full (zero scores never enter).
+        """
+        return self.heap[0][0] if len(self.heap) == self.k else 0.0
+
+    def offer(self, doc_id, score):
+        self.offered += 1
+        if score <= self.threshold:
+            return
+        if self.accept is not None and not self.accept(doc_id):
+            return
+        if len(self.heap) == self.k:
+            heapq.heapreplace(self.heap, (score, -doc_id))
+        else:
+            heapq.heappush(self.heap, (score, -doc_id))
+
+    def results(self):
+        return [(-neg_doc_id, score) for score, neg_doc_id in sorted(self.heap, key=lambda item: (-item[0], -item[1]))]
+
+
+def top_k_conjunctive(terms, k, top=None):
+    """
+    Block-max AND: the best k documents containing every term. Each candidate from the shortest list
+    is first bounded with the max bit arrays of the blocks it would fall into, read from the skip
+    tables only; if that bound cannot beat the current k-th score, every list jumps past the
+    smallest of those blocks without decoding them. A TopK passed as top is filled instead of a new one.
+    """
+    top = top if top is not None else TopK(k)
+    terms = sorted(terms, key=lambda term: term.cursor.count)
+    if not terms or terms[0].cursor.count == 0:
+        return []
+    lead, others = terms[0], terms[1:]
+    max_score = ALL_TERMS_BOOST * sum(term.upper_bound for term in terms)
+
+    posting = lead.cursor.next_geq(0)
+    while posting is not None:
+        threshold = top.threshold
+        if cannot_beat(max_score, threshold):
+            break  # no document can beat the current top k any more
+        doc_id = posting[0]
+
+        if len(top.heap) == top.k:
+            bound = 0.0
+            block_end = None
+            for term in terms:
+                block = term.cursor.block_bound(doc_id)
+                if block is None:
+                    return top.results()
+                last_doc, max_bits = block
+                bound += term.block_upper_bound(max_bits)
+                block_end = last_doc if block_end is None else min(block_end, last_doc)
+            if cannot_beat(ALL_TERMS_BOOST * bound, threshold):
+                posting = lead.cursor.next_geq(block_end + 1)
+                continue
+
+        score = lead.score(posting[1])
+        for term in others:
+            other = term.cursor.next_geq(doc_id)
+            if other is None:
+                return top.results()
+            if other[0] != doc_id:
+                doc_id = other[0]
+                break
+            score += term.score(other[1])
+        else:
+            top.offer(doc_id, ALL_TERMS_BOOST * score)
+            doc_id += 1
+        posting = lead.cursor.next_geq(doc_id)
+
+    return top.results()
+
+
+def top_k_disjunctive(terms, k, top=None):
+    """
+    MaxScore OR: the best k documents containing any term, boosted when they contain all of them.
+    Terms are ordered by upper bound; the low ones whose bounds together cannot beat the k-th score
+    are non-essential, so candidates only come from the essential lists and the non-essential lists
+    are only probed while the candidate can still make it into the top k.
+    """
+    top = top if top is not None else TopK(k)
+    query_terms = len(terms)
+    terms = sorted((term for term in terms if term.cursor.count), key=lambda term: term.upper_bound)
+    if not terms:
+        return []
+    num_terms = len(terms)
+    # No document contains a term whose list is empty (as in a shard without it), so none gets the boost
+    boost = ALL_TERMS_BOOST if num_terms == query_terms else 1.0
+    prefix_bounds = []
+    running = 0.0
+    for term in terms:
+        running += term.upper_bound
+        prefix_bounds.append(running)
+
+    current = [term.cursor.next_geq(0) for term in terms]
+    first_essential = 0
+    while True:
+        threshold = top.threshold
+        # Documents only in non-essential lists miss an essential term and get no boost, unless every list is non-essential
+        while first_essential < num_terms:
+            bound = prefix_bounds[first_essential]
+            if first_essential == num_terms - 1:
+                bound *= boost
+            if not cannot_beat(bound, threshold):
+                break
+            first_essential += 1
+        if first_essential == num_terms:
+            break
+
+        doc_id = min((posting[0] for posting in current[first_essential:] if posting is not None), default=None)
+        if doc_id is None:
+            break
+
+        score = 0.0
+        matched = 0
+        for i in range(first_essential, num_terms):
+            posting = current[i]
+            if posting is not None and posting[0] == doc_id:
+                score += terms[i].score(posting[1])
+                matched += 1
+                current[i] = terms[i].cursor.next_geq(doc_id + 1)
+
+        for i in range(first_essential - 1, -1, -1):
+            all_matched_so_far = matched == num_terms - 1 - i
+            bound = score + prefix_bounds[i]
+            if all_matched_so_far:
+                bound *= boost
+            if cannot_beat(bound, threshold):
+                break
+            posting = terms[i].cursor.next_geq(doc_id)
+            current[i] = posting
+            if posting is not None and posting[0] == doc_id:
+                score += terms[i].score(posting[1])
+                matched += 1
+        else:
+            top.offer(doc_id, score * boost if matched == num_terms else score)
+
+    return top.results()
+
+
+def prefers_arrays(terms, match_all):
+    """
+    Whether top_k_arrays should rank these terms: NumPy is installed, every term can score arrays
+    and, for OR, there are enough postings for whole-list array operations to beat skipping.
+    """
+    if np is None or not terms or any(term.tf_array is None for term in terms):
+        return False
+    return match_all or sum(term.cursor.count for term in terms) >= ARRAY_MIN_POSTINGS
+
+
+def top_k_arrays(terms, k, match_all):
+    """
+    The same top k as top_k_conjunctive (match_all) or top_k_disjunctive, computed with NumPy. For
+    AND the lists are intersected by intersect_arrays; for OR every list is decoded into doc id and
+    bit array arrays, scored with tf_array, and the scores of a document are summed with bincount.
+    The k best are picked by partial selection instead of a full sort. Returns (results, documents scored).
+    """
+    if match_all:
+        doc_ids, scores = intersect_arrays(terms)
+        scores = ALL_TERMS_BOOST * scores
+    else:
+        arrays = []
+        for term in terms:
+            doc_ids, bit_arrays = term.cursor.arrays()
+            if len(doc_ids):
+                arrays.append((doc_ids, term.score_array(bit_arrays)))
+        if not arrays:
+            return [], 0
+        size = max(int(doc_ids[-1]) for doc_ids, _ in arrays) + 1
+        totals = np.zeros(size)
+        matched = np.zeros(size, np.int32)
+        for term_docs, term_scores in arrays:
+            totals += np.bincount(term_docs, term_scores, size)
+            matched[term_docs] += 1
+        doc_ids = np.flatnonzero(matched)
+        scores = totals[doc_ids]
+        # as in top_k_disjunctive, no document gets the boost if a term has no postings at all
+        if len(arrays) == len(terms):
+            scores[matched[doc_ids] == len(terms)] *= ALL_TERMS_BOOST
+    return select_top_k(doc_ids, scores, k), len(doc_ids)
+
+
+def intersect_arrays(terms):
+    """
+    The doc ids in every term's list and their summed scores, as arrays. Adaptive: the lists are
+    intersected shortest first, so the candidates never outnumber the rarest list. When every list
+    has a bitmap, the bitmaps are ANDed container by container; otherwise the rarest list is
+    decoded and the candidates are probed against the bitmaps of the frequent terms and looked up
+    in the other lists through their skip tables, decoding only the blocks they fall into. Bit
+    arrays are only fetched for the documents left at the end, and the scores are added shortest
+    list first like top_k_conjunctive does.
+    """
+    order = sorted(terms, key=lambda term: term.cursor.count)
+    if not order[0].cursor.count:
+        return np.zeros(0, np.int32), np.zeros(0)
+    bitmaps = [term.cursor.doc_bitmap() for term in order]
+    bit_arrays = {}  # position in order -> bit arrays of the candidates
+    if all(bitmap is not None for bitmap in bitmaps):
+        candidates = bitmaps[0]
+        for bitmap in bitmaps[1:]:
+            candidates = candidates & bitmap
+            if not candidates.containers:
+                break
+        doc_ids = candidates.to_array()
+    else:
+        doc_ids, bit_arrays[0] = order[0].cursor.arrays()
+        for i, term in enumerate(order[1:], 1):
+            if not len(doc_ids):
+                break
+            if bitmaps[i] is not None:
+                matched = bitmaps[i].contains(doc_ids)
+            else:
+                matched, bit_arrays[i] = term.cursor.lookup(doc_ids)
+            doc_ids = doc_ids[matched]
+            bit_arrays = {j: bits[matched] for j, bits in bit_arrays.items()}
+    scores = np.zeros(len(doc_ids))
+    if not len(doc_ids):
+        return doc_ids, scores
+    for i, term in enumerate(order):
+        bits = bit_arrays.get(i)
+        if bits is None:
+            bits = term.cursor.lookup(doc_ids)[1]
+        scores = scores + term.score_array(bits) if i else term.score_array(bits)
+    return doc_ids, scores
+
+
+def select_top_k(doc_ids, scores, k):
+    """
+    The k best (doc_id, score) pairs of two arrays, best first, ties to the smaller doc id as in
+    TopK; zero scores never enter. Only the documents scoring at least the k-th score are sorted.
+    """
+    keep = scores > 0
+    doc_ids, scores = doc_ids[keep], scores[keep]
+    if len(scores) > k:
+        kth = np.partition(scores, len(scores) - k)[len(scores) - k]
+        keep = scores >= kth
+        doc_ids, scores = doc_ids[keep], scores[keep]
+    best = np.lexsort((doc_ids, -scores))[:k]
+    return list(zip(doc_ids[best].tolist(), scores[best].tolist()))
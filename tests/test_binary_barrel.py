@@ -0,0 +1,98 @@
+import random
+import pytest
+from binary_barrel import BLOCK_SIZE, FIXED, PACKED, POSITIONS, BarrelReader, BarrelWriter, barrel_path, max_bit_array
+
+
+def random_postings(rng, count, max_doc):
+    """
+    (doc_id, bit_array) postings in random order, some documents more than once.
+    """
+    return [(rng.randrange(max_doc), rng.randrange(1 << 10)) for _ in range(count)]
+
+
+def expected_packed(postings):
+    # sorted by doc id, one posting per document, the last one written wins
+    by_doc = {}
+    for doc_id, bit_array in postings:
+        by_doc[doc_id] = bit_array
+    return sorted(by_doc.items())
+
+
+def write_barrel(path_stem, lists, codec=PACKED):
+    with BarrelWriter(path_stem, codec) as writer:
+        for word_id in sorted(lists):
+            writer.add(word_id, lists[word_id])
+
+
+@pytest.fixture
+def lists():
+    rng = random.Random(8)
+    # empty, single, one block exactly, many blocks, and doc ids needing every gap width
+    return {
+        1: [],
+        2: [(7, 3)],
+        3: random_postings(rng, BLOCK_SIZE, 10 ** 3),
+        4: random_postings(rng, 10 * BLOCK_SIZE + 5, 10 ** 4),
+        5: [(doc_id, rng.randrange(1 << 10)) for doc_id in (0, 1, 300, 70000, 2 ** 31)],
+    }
+
+
+def test_packed_round_trip(tmp_path, lists):
+    path_stem = barrel_path(tmp_path, 0)
+    write_barrel(path_stem, lists)
+    with BarrelReader(path_stem) as reader:
+        assert reader.codec == PACKED
+        assert reader.word_ids() == sorted(lists)
+        for word_id, postings in lists.items():
+            expected = expected_packed(postings)
+            assert reader.get_postings(word_id) == expected
+            assert reader.count(word_id) == len(expected)
+            assert reader.cursor(word_id).max_bits == max_bit_array(bit_array for _, bit_array in expected)
+        assert reader.get_postings(99) == []
+
+
+def test_fixed_round_trip(tmp_path, lists):
+    path_stem = barrel_path(tmp_path, 0)
+    write_barrel(path_stem, lists, FIXED)
+    with BarrelReader(path_stem) as reader:
+        assert reader.codec == FIXED
+        for word_id, postings in lists.items():
+            assert reader.get_postings(word_id) == postings
+
+
+def test_positions_round_trip(tmp_path):
+    rng = random.Random(4)
+    postings = [(rng.randrange(2000), sorted(rng.sample(range(5000), rng.randint(1, 6)))) for _ in range(600)]
+    path_stem = barrel_path(tmp_path, 0)
+    with BarrelWriter(path_stem, POSITIONS) as writer:
+        writer.add(1, postings)
+    expected = {}
+    for doc_id, positions in postings:
+        expected.setdefault(doc_id, set()).update(positions)
+    with BarrelReader(path_stem) as reader:
+        assert [(doc_id, list(positions)) for doc_id, positions in reader.get_postings(1)] == \
+            [(doc_id, sorted(positions)) for doc_id, positions in sorted(expected.items())]
+
+
+@pytest.mark.parametrize('codec', [PACKED, FIXED])
+def test_next_geq_and_block_bounds(tmp_path, lists, codec):
+    path_stem = barrel_path(tmp_path, 0)
+    write_barrel(path_stem, {word_id: expected_packed(postings) for word_id, postings in lists.items()}, codec)
+    rng = random.Random(9)
+    with BarrelReader(path_stem) as reader:
+        for word_id, postings in lists.items():
+            expected = expected_packed(postings)
+            cursor = reader.cursor(word_id)
+            target = 0
+            for _ in range(50):
+                target += rng.randrange(300)
+                found = cursor.next_geq(target)
+                following = [posting for posting in expected if posting[0] >= target]
+                assert found == (following[0] if following else None)
+                if found is None:
+                    assert cursor.block_bound(target) is None
+                    break
+                # the block bound covers every posting up to the end of the block
+                last_doc, max_bits = cursor.block_bound(target)
+                covered = [bit_array for doc_id, bit_array in following if doc_id <= last_doc]
+                assert covered and max_bit_array(covered + [max_bits]) == max_bits
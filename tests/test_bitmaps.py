@@ -0,0 +1,93 @@
+import random
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from binary_barrel import BarrelReader, BarrelWriter, barrel_path
+from bitmaps import ARRAY_MAX, BITMAP_MIN_DOCS, RoaringBitmap, encode_bitmap
+from query_engine import QueryEngine, tf_array
+from top_k import ALL_TERMS_BOOST, QueryTerm, intersect_arrays, top_k_arrays, top_k_conjunctive
+
+
+def random_doc_ids(rng):
+    """
+    Sorted doc ids spread over several containers: a dense one (bitmap), a sparse one (array)
+    and one just at the array size limit.
+    """
+    doc_ids = set(rng.sample(range(1 << 16), ARRAY_MAX * 3))
+    doc_ids.update(rng.sample(range(3 << 16, 4 << 16), 100))
+    doc_ids.update(rng.sample(range(5 << 16, 6 << 16), ARRAY_MAX))
+    doc_ids.update(rng.sample(range(1 << 16, 1 << 17), rng.randrange(ARRAY_MAX * 2)))
+    return sorted(doc_ids)
+
+
+@pytest.fixture
+def rng():
+    return random.Random(23)
+
+
+def test_encoded_bitmap_round_trip(rng):
+    doc_ids = random_doc_ids(rng)
+    bitmap = RoaringBitmap.from_bytes(b'xx' + encode_bitmap(doc_ids), 2)
+    assert bitmap.to_array().tolist() == doc_ids
+    assert len(bitmap) == len(doc_ids)
+    assert RoaringBitmap.from_array(np.array(doc_ids)).to_array().tolist() == doc_ids
+
+
+def test_bitmap_operations_match_sets(rng):
+    a, b = random_doc_ids(rng), random_doc_ids(rng)
+    left, right = RoaringBitmap.from_array(np.array(a)), RoaringBitmap.from_bytes(encode_bitmap(b), 0)
+    assert (left & right).to_array().tolist() == sorted(set(a) & set(b))
+    assert (left | right).to_array().tolist() == sorted(set(a) | set(b))
+    probes = np.array(sorted(rng.sample(range(7 << 16), 20000)))
+    members = set(a)
+    assert left.contains(probes).tolist() == [doc_id in members for doc_id in probes.tolist()]
+    assert (left & RoaringBitmap.from_array(np.array([], np.int64))).to_array().tolist() == []
+
+
+def write_lists(tmp_path, lists):
+    path_stem = barrel_path(tmp_path, 0)
+    with BarrelWriter(path_stem) as writer:
+        for word_id, postings in enumerate(lists):
+            writer.add(word_id, postings)
+    return path_stem
+
+
+@pytest.mark.parametrize('sizes', [
+    (BITMAP_MIN_DOCS * 2, BITMAP_MIN_DOCS * 3),  # every list has a bitmap
+    (50, BITMAP_MIN_DOCS * 2, 9000),  # a rare list probed against bitmaps and skip tables
+    (700, 2000, 3000),  # no bitmaps, lookups through the skip tables only
+])
+def test_intersect_arrays_matches_sets(tmp_path, rng, sizes):
+    lists = [sorted({rng.randrange(40000): rng.randrange(1, 1 << 10) for _ in range(size)}.items()) for size in sizes]
+    weights = [rng.uniform(0.5, 2.0) for _ in lists]
+    with BarrelReader(write_lists(tmp_path, lists)) as reader:
+        assert (reader.bitmap(0) is not None) == (len(lists[0]) >= BITMAP_MIN_DOCS)
+        terms = [QueryTerm(reader.cursor(word_id), weight, QueryEngine.calculate_tf, tf_array)
+                 for word_id, weight in enumerate(weights)]
+        doc_ids, scores = intersect_arrays(terms)
+
+        by_doc = [dict(postings) for postings in lists]
+        common = sorted(set.intersection(*(set(postings) for postings in by_doc)))
+        assert doc_ids.tolist() == common
+        expected = [sum(weight * QueryEngine.calculate_tf(postings[doc_id]) for postings, weight in zip(by_doc, weights))
+                    for doc_id in common]
+        assert scores.tolist() == pytest.approx(expected)
+
+        arrays = top_k_arrays([QueryTerm(reader.cursor(word_id), weight, QueryEngine.calculate_tf, tf_array)
+                               for word_id, weight in enumerate(weights)], 10, True)[0]
+        pruned = top_k_conjunctive([QueryTerm(reader.cursor(word_id), weight, QueryEngine.calculate_tf)
+                                    for word_id, weight in enumerate(weights)], 10)
+        assert [score for _, score in arrays] == pytest.approx([score for _, score in pruned])
+        for doc_id, score in arrays:
+            assert ALL_TERMS_BOOST * expected[common.index(doc_id)] == pytest.approx(score)
+
+
+def test_cursor_lookup_matches_postings(tmp_path, rng):
+    postings = sorted({rng.randrange(100000): rng.randrange(1 << 10) for _ in range(5000)}.items())
+    with BarrelReader(write_lists(tmp_path, [postings])) as reader:
+        probes = np.array(sorted(rng.sample(range(100000), 3000)))
+        found, bit_arrays = reader.cursor(0).lookup(probes)
+        by_doc = dict(postings)
+        assert found.tolist() == [doc_id in by_doc for doc_id in probes.tolist()]
+        assert bit_arrays[found].tolist() == [by_doc[doc_id] for doc_id in probes.tolist() if doc_id in by_doc]
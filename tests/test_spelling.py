@@ -0,0 +1,113 @@
+import random
+import pytest
+from compact_lexicon import LEXICON_FILE, CompactLexicon, encode_lexicon, write_lexicon
+from query_engine import correct_query
+from spelling import (MIN_DOC_FREQUENCY, MIN_WORD_LENGTH, SHORT_WORD, SPELLING_FILE, SpellingIndex, edit_distance,
+                      encode_spelling, load_spelling, write_spelling)
+
+LETTERS = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def reference_distance(a, b):
+    """
+    Optimal string alignment distance, the textbook dynamic program without any cutoff.
+    """
+    d = [[i + j if i * j == 0 else 0 for j in range(len(b) + 1)] for i in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            d[i][j] = min(d[i - 1][j] + 1, d[i][j - 1] + 1, d[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                d[i][j] = min(d[i][j], d[i - 2][j - 2] + 1)
+    return d[len(a)][len(b)]
+
+
+def brute_force(lexicon, word):
+    """
+    The correction SpellingIndex.correct should find, by scanning the whole lexicon (edit_distance
+    itself is checked against the reference above).
+    """
+    if len(word) < MIN_WORD_LENGTH or not word.isalpha():
+        return None
+    max_distance = 1 if len(word) < SHORT_WORD else 2
+    best = None
+    for index in range(len(lexicon)):
+        candidate = lexicon.word(index)
+        if lexicon.doc_frequencies[index] < MIN_DOC_FREQUENCY or not candidate.isalpha():
+            continue
+        distance = edit_distance(word, candidate, max_distance)
+        if distance is not None and (best is None or (distance, -lexicon.doc_frequencies[index], index) < best):
+            best = (distance, -lexicon.doc_frequencies[index], index)
+    return None if best is None else (lexicon.word(best[2]), best[0])
+
+
+def misspell(rng, word):
+    for _ in range(rng.randint(1, 3)):
+        i = rng.randrange(len(word))
+        edit = rng.randrange(4)
+        if edit == 0 and len(word) > 1:
+            word = word[:i] + word[i + 1:]
+        elif edit == 1:
+            word = word[:i] + rng.choice(LETTERS) + word[i:]
+        elif edit == 2:
+            word = word[:i] + rng.choice(LETTERS) + word[i + 1:]
+        elif i < len(word) - 1:
+            word = word[:i] + word[i + 1] + word[i] + word[i + 2:]
+    return word
+
+
+@pytest.fixture(scope='module')
+def lexicon():
+    rng = random.Random(25)
+    # few letters, so that words have many close neighbours; long words exercise the prefix
+    words = {''.join(rng.choice('abcdefg') for _ in range(rng.randint(2, 16))) for _ in range(3000)}
+    words.update(['colour', 'color', 'x1y2z3'])
+    entries = [(word, word_id, word_id, rng.choice([0, 1, 2, 5, 40, 300])) for word_id, word in enumerate(sorted(words))]
+    return CompactLexicon(encode_lexicon(entries))
+
+
+def test_edit_distance_matches_reference():
+    rng = random.Random(1)
+    for _ in range(2000):
+        a = ''.join(rng.choice('abc') for _ in range(rng.randint(0, 8)))
+        b = ''.join(rng.choice('abc') for _ in range(rng.randint(0, 8)))
+        expected = reference_distance(a, b)
+        for max_distance in (1, 2, 3):
+            assert edit_distance(a, b, max_distance) == (expected if expected <= max_distance else None)
+
+
+def test_correct_matches_brute_force(lexicon):
+    index = SpellingIndex(encode_spelling(lexicon), lexicon)
+    rng = random.Random(2)
+    words = list(lexicon)
+    for _ in range(200):
+        word = misspell(rng, rng.choice(words))
+        assert index.correct(word) == brute_force(lexicon, word), word
+
+
+def test_correct_leaves_short_and_non_alphabetic_words(lexicon):
+    index = SpellingIndex(encode_spelling(lexicon), lexicon)
+    assert index.correct('ab') is None
+    assert index.correct('x1y2z4') is None
+
+
+def test_spelling_file_belongs_to_its_lexicon(tmp_path):
+    write_lexicon(tmp_path / LEXICON_FILE, [('colour', 1, 1, 9), ('color', 2, 2, 4), ('flavour', 3, 3, 2)])
+    write_spelling(tmp_path)
+    lexicon = CompactLexicon.open(tmp_path / LEXICON_FILE)
+    spelling = load_spelling(tmp_path, lexicon)
+    assert spelling.correct('colr') == ('color', 1)
+    assert spelling.correct('flavuor') == ('flavour', 1)
+    spelling.close()
+    lexicon.close()
+
+    # a lexicon rewritten without its spelling index is not corrected against a stale one
+    write_lexicon(tmp_path / LEXICON_FILE, [('colour', 1, 1, 9), ('flavour', 3, 3, 2)])
+    lexicon = CompactLexicon.open(tmp_path / LEXICON_FILE)
+    assert load_spelling(tmp_path, lexicon) is None
+    assert load_spelling(tmp_path / 'missing', lexicon) is None
+    lexicon.close()
+    assert (tmp_path / SPELLING_FILE).exists()
+
+
+def test_correct_query_keeps_the_rest_of_the_query():
+    assert correct_query('"Teh quick" fox~2', {'teh': 'the'}) == '"the quick" fox~2'
@@ -0,0 +1,58 @@
+import random
+from term_stats import DocLengths, TermStats, load_stats
+
+
+def random_stats(rng, first_doc, count):
+    stats = TermStats()
+    for doc_id in range(first_doc, first_doc + count):
+        postings = [(rng.randrange(50), rng.randrange(1, 8) | rng.choice((0, 1 << 8, 1 << 9))) for _ in range(rng.randrange(6))]
+        stats.add_document(doc_id, postings)
+    return stats
+
+
+def test_doc_lengths_match_a_dict():
+    rng = random.Random(3)
+    lengths, expected = DocLengths(), {}
+    for _ in range(2000):
+        doc_id, length = rng.randrange(100, 400), rng.randrange(1, 1000)
+        lengths[doc_id] = length
+        expected[doc_id] = length
+    assert dict(lengths.items()) == expected
+    assert all(lengths.get(doc_id) == expected.get(doc_id, 0) for doc_id in range(0, 500))
+
+
+def test_update_copies_following_and_overlapping_lengths():
+    for first, second in ((1, 120), (1, 60), (80, 1)):
+        a, b = DocLengths(), DocLengths()
+        for doc_id in range(first, first + 100):
+            a[doc_id] = doc_id * 3
+        for doc_id in range(second, second + 50):
+            b[doc_id] = doc_id * 5
+        expected = dict(a.items())
+        expected.update(b.items())
+        a.update(b)
+        assert dict(a.items()) == expected
+
+
+def test_save_and_load_round_trip(tmp_path):
+    rng = random.Random(5)
+    stats = random_stats(rng, 1, 300)
+    stats.set_impact_scale()
+    stats.save(tmp_path / 'term_stats.bin')
+    loaded = TermStats.load(tmp_path / 'term_stats.bin')
+    assert (loaded.num_docs, loaded.total_length, loaded.impact_scale) == (stats.num_docs, stats.total_length, stats.impact_scale)
+    assert loaded.doc_frequency == stats.doc_frequency
+    assert dict(loaded.doc_lengths.items()) == dict(stats.doc_lengths.items())
+    without_lengths = TermStats.load(tmp_path / 'term_stats.bin', doc_lengths=False)
+    assert without_lengths.doc_frequency == stats.doc_frequency and not list(without_lengths.doc_lengths.items())
+
+
+def test_merged_segments_score_like_one_collection(tmp_path):
+    rng = random.Random(9)
+    whole = random_stats(random.Random(9), 1, 400)
+    index, segment = random_stats(rng, 1, 300), random_stats(rng, 301, 100)
+    index.save(tmp_path / 'index.bin')
+    segment.save(tmp_path / 'segment.bin')
+    merged = load_stats([tmp_path / 'index.bin', tmp_path / 'segment.bin'])
+    assert (merged.num_docs, merged.total_length, merged.doc_frequency) == (whole.num_docs, whole.total_length, whole.doc_frequency)
+    assert all(merged.bm25(term_id, doc_id, 3) == whole.bm25(term_id, doc_id, 3) for term_id in range(50) for doc_id in range(1, 401, 7))
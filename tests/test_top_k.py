@@ -0,0 +1,87 @@
+import random
+import pytest
+from binary_barrel import BarrelReader, BarrelWriter, barrel_path
+from query_engine import QueryEngine
+from top_k import ALL_TERMS_BOOST, QueryTerm, TopK, top_k_conjunctive, top_k_disjunctive
+
+
+def make_lists(rng, sizes, max_doc, max_value):
+    return [sorted({rng.randrange(max_doc): rng.randrange(1, max_value) for _ in range(size)}.items()) for size in sizes]
+
+
+def exhaustive(lists, weights, tf, k, match_all):
+    """
+    Score every document of the lists and sort them all, as the ranking did before pruning.
+    """
+    scores, matched = {}, {}
+    for postings, weight in zip(lists, weights):
+        for doc_id, value in postings:
+            scores[doc_id] = scores.get(doc_id, 0.0) + weight * tf(value)
+            matched[doc_id] = matched.get(doc_id, 0) + 1
+    all_terms = all(lists)
+    ranked = []
+    for doc_id, score in scores.items():
+        if matched[doc_id] == len(lists):
+            ranked.append((doc_id, ALL_TERMS_BOOST * score if all_terms else score))
+        elif not match_all:
+            ranked.append((doc_id, score))
+    ranked = [(doc_id, score) for doc_id, score in ranked if score > 0]
+    ranked.sort(key=lambda result: (-result[1], result[0]))
+    return ranked[:k]
+
+
+def assert_same_top_k(results, expected, lists, weights, tf, match_all):
+    # scores summed in another order may differ in the last bits and reorder exact ties,
+    # so the scores are compared rank by rank and each document against its own exhaustive score
+    assert [score for _, score in results] == pytest.approx([score for _, score in expected])
+    every = dict(exhaustive(lists, weights, tf, 10 ** 9, match_all))
+    for doc_id, score in results:
+        assert every[doc_id] == pytest.approx(score)
+
+
+def rank(tmp_path, lists, weights, tf, k, match_all):
+    path_stem = barrel_path(tmp_path, 0)
+    with BarrelWriter(path_stem) as writer:
+        for word_id, postings in enumerate(lists):
+            writer.add(word_id, postings)
+    with BarrelReader(path_stem) as reader:
+        terms = [QueryTerm(reader.cursor(word_id), weight, tf) for word_id, weight in enumerate(weights)]
+        if match_all:
+            return top_k_conjunctive(terms, k)
+        return top_k_disjunctive(terms, k)
+
+
+@pytest.mark.parametrize('match_all', [True, False])
+@pytest.mark.parametrize('seed', range(12))
+def test_pruned_top_k_equals_exhaustive(tmp_path, seed, match_all):
+    rng = random.Random(seed)
+    num_terms = rng.randint(1, 4)
+    lists = make_lists(rng, [rng.choice([1, 20, 300, 3000]) for _ in range(num_terms)], 5000, 1 << 10)
+    weights = [rng.uniform(0.1, 3.0) for _ in lists]
+    k = rng.choice([1, 10, 100])
+    results = rank(tmp_path, lists, weights, QueryEngine.calculate_tf, k, match_all)
+    expected = exhaustive(lists, weights, QueryEngine.calculate_tf, k, match_all)
+    assert_same_top_k(results, expected, lists, weights, QueryEngine.calculate_tf, match_all)
+
+
+@pytest.mark.parametrize('match_all', [True, False])
+def test_pruned_top_k_with_impacts(tmp_path, match_all):
+    # impact barrels store the score itself, weighted 1 and scored with int
+    rng = random.Random(21)
+    lists = make_lists(rng, [2500, 800, 40], 4000, 1 << 16)
+    results = rank(tmp_path, lists, [1, 1, 1], int, 10, match_all)
+    expected = exhaustive(lists, [1, 1, 1], int, 10, match_all)
+    assert_same_top_k(results, expected, lists, [1, 1, 1], int, match_all)
+
+
+def test_or_with_an_empty_list_gives_no_boost(tmp_path):
+    lists = [[(1, 5), (2, 5)], []]
+    results = rank(tmp_path, lists, [1.0, 1.0], QueryEngine.calculate_tf, 10, False)
+    assert results == [(1, pytest.approx(QueryEngine.calculate_tf(5))), (2, pytest.approx(QueryEngine.calculate_tf(5)))]
+
+
+def test_top_k_breaks_ties_by_doc_id():
+    top = TopK(2)
+    for doc_id in (3, 5, 8):
+        top.offer(doc_id, 1.0)
+    assert top.results() == [(3, 1.0), (5, 1.0)]